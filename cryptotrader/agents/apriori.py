@@ -1,4 +1,6 @@
 from time import time, sleep
+import os
+import json
 
 from ..core import Agent
 from ..utils import *
@@ -24,10 +26,88 @@ from scipy import stats
 import cvxopt as opt
 import cvxopt.solvers as optsolvers
 import warnings
+from collections import deque, OrderedDict
 import talib as ta
 optsolvers.options['show_progress'] = False
 
 
+# Fit helpers
+class RewardCache(object):
+    """
+    Memo of (params, episode) -> reward for hyperparameter search.
+    When a path is given, entries are appended to it as json lines so repeated or resumed fits skip finished work.
+    """
+    def __repr__(self):
+        return "RewardCache"
+
+    def __init__(self, path=None):
+        """
+        :param path: str: Cache file path. If None, cache is kept in memory only.
+        """
+        self.path = path
+        self.data = {}
+        self.hits = 0
+        self.misses = 0
+
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self.data[entry['key']] = entry['reward']
+                    except (ValueError, KeyError):
+                        # Truncated line from an interrupted fit
+                        continue
+
+    @staticmethod
+    def encode(obj):
+        return obj.tolist() if hasattr(obj, 'tolist') else str(obj)
+
+    @staticmethod
+    def make_key(*args):
+        return json.dumps(args, sort_keys=True, default=RewardCache.encode)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __contains__(self, key):
+        if key in self.data:
+            self.hits += 1
+            return True
+        else:
+            self.misses += 1
+            return False
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, reward):
+        self.data[key] = reward
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'key': key, 'reward': reward}, default=self.encode) + '\n')
+
+
+def sample_search_space(search_space, random_state=np.random):
+    """
+    Draw random params from an optunity structured search space.
+    Lists are [low, high] boxes and dicts are choices between keys, each one with its own optional subspace.
+    :param search_space: dict: Search space
+    :param random_state: numpy RandomState: Random generator
+    :return: dict: Sampled params
+    """
+    params = {}
+    for key, value in search_space.items():
+        if isinstance(value, dict):
+            choice = sorted(value.keys())[random_state.randint(len(value))]
+            params[key] = choice
+            if value[choice]:
+                params.update(sample_search_space(value[choice], random_state))
+        else:
+            params[key] = random_state.uniform(value[0], value[1])
+    return params
+
+
 # Base class
 class APrioriAgent(Agent):
     """
@@ -64,14 +144,116 @@ class APrioriAgent(Agent):
     def set_params(self, **kwargs):
         raise NotImplementedError("You must overwrite this class in your implementation.")
 
+    def evaluate(self, env, params, episodes, cache=None, nb_max_episode_steps=None, **kwargs):
+        """
+        Evaluate model params over a fixed set of episodes
+        :param env: BacktestEnvironment instance
+        :param params: dict: Model params
+        :param episodes: list: Episode start indexes
+        :param cache: RewardCache: Rewards memo. Cached episodes are not run again.
+        :param nb_max_episode_steps: Number of steps for one episode
+        :param kwargs: Agent.test keyword arguments
+        :return: tuple: Episodes reward mean and std
+        """
+        self.set_params(**params)
+
+        rewards = []
+        for start in episodes:
+            if cache is not None:
+                key = cache.make_key(self.__repr__(), params, env.pairs, env.period, env.obs_steps,
+                                     np.float64(env.benchmark).round(8), env.tapi.ohlc_data[env.pairs[0]].index[start],
+                                     nb_max_episode_steps, kwargs.get('noise_abs', 0.0))
+                if key in cache:
+                    rewards.append(cache[key])
+                    continue
+
+            # Run episode from a fixed start
+            try:
+                env.start_index = start
+                r, _ = Agent.test(self, env, nb_episodes=1, nb_max_episode_steps=nb_max_episode_steps, **kwargs)
+            finally:
+                env.start_index = None
+
+            if cache is not None:
+                cache[key] = r
+            rewards.append(r)
+
+        return np.mean(rewards), np.std(rewards)
+
+    def successive_halving(self, env, nb_steps, episodes, cache, search_space, constraints, eta=3, seed=None,
+                           verbose=1, **kwargs):
+        """
+        Successive halving params search.
+        Starts nb_steps random configurations on a few episodes and promotes only the best 1/eta of them
+        to eta times more episodes, until one configuration is left or all episodes are used.
+        :param env: BacktestEnvironment instance
+        :param nb_steps: Number of initial configurations
+        :param episodes: list: Episode start indexes. The full set is used on the last rung.
+        :param cache: RewardCache: Rewards memo. Promoted configurations only run their new episodes.
+        :param search_space: Parameter search space
+        :param constraints: list: Functions returning False when constrains are violated
+        :param eta: int: Reduction factor between rungs
+        :param seed: int: Random seed for configurations sampling
+        :param kwargs: evaluate keyword arguments
+        :return: tuple: Optimal parameters, information about the search
+        """
+        assert eta >= 2, "eta must be >= 2."
+        random_state = np.random.RandomState(seed)
+
+        # Sample configurations satisfying constraints
+        configs = []
+        for _ in range(nb_steps):
+            for _ in range(1000):
+                params = sample_search_space(search_space, random_state)
+                if all(constraint(**params) for constraint in constraints):
+                    configs.append(params)
+                    break
+            else:
+                raise ValueError("Could not sample params satisfying constraints.")
+
+        # First rung size
+        nb_rungs = 1 + int(np.floor(np.log(min(nb_steps, len(episodes))) / np.log(eta) + 1e-9))
+        nb_episodes = max(1, len(episodes) // eta ** (nb_rungs - 1))
+
+        rungs = []
+        misses = cache.misses
+        while True:
+            rewards = np.array([self.evaluate(env, params, episodes[:nb_episodes], cache, **kwargs)[0]
+                                for params in configs])
+            rank = np.argsort(rewards)[::-1]
+            rungs.append({'configs': len(configs), 'episodes': nb_episodes, 'best': rewards[rank[0]]})
+
+            if verbose:
+                print("Rung {0}: {1} configs, {2} episodes, best r: {3:.8f}, episodes run: {4}".format(
+                    len(rungs), len(configs), nb_episodes, rewards[rank[0]], cache.misses - misses))
+
+            if len(configs) == 1 or nb_episodes >= len(episodes):
+                break
+
+            # Promote best configurations to longer evaluations
+            configs = [configs[k] for k in rank[:max(1, len(configs) // eta)]]
+            nb_episodes = min(len(episodes), nb_episodes * eta)
+
+        info = {'optimum': rewards[rank[0]],
+                'budget': cache.misses - misses,
+                'full_budget': nb_steps * len(episodes),
+                'rungs': rungs}
+
+        if verbose:
+            print("Episodes run: %d of %d for a full search" % (info['budget'], info['full_budget']))
+
+        return configs[rank[0]], info
+
     def fit(self, env, nb_steps, batch_size, search_space, constraints=None, action_repetition=1, callbacks=None, verbose=1,
             visualize=False, nb_max_start_steps=0, start_step_policy=None, log_interval=10000, start_step=0,
-            nb_max_episode_steps=None, noise_abs=0.0):
+            nb_max_episode_steps=None, noise_abs=0.0, episodes=None, seed=None, cache_path=None, method='optunity',
+            eta=3):
         """
         Fit the model on parameters on the environment
+        All evaluations run over the same episodes, so params are compared on common random numbers.
         :param env: BacktestEnvironment instance
         :param nb_steps: Number of optimization evals
-        :param batch_size: Size of the batch for each optimization pass
+        :param batch_size: Number of episodes for each optimization pass
         :param search_space: Parameter search space
         :param constrains: Function returning False when constrains are violated
         :param action_repetition:
@@ -83,6 +265,11 @@ class APrioriAgent(Agent):
         :param log_interval:
         :param nb_max_episode_steps: Number of steps for one episode
         :param noise_abs: Noise radius to use on sample runs
+        :param episodes: list: Episode start indexes shared by all evaluations. If None, batch_size starts are drawn once.
+        :param seed: int: Random seed for drawing episode starts
+        :param cache_path: str: File to memoise (params, episode) rewards across fits
+        :param method: str: optunity for optunity maximize_structured, halving for successive halving search
+        :param eta: int: Successive halving reduction factor
         :return: tuple: Optimal parameters, information about the optimization process
         """
         try:
@@ -91,11 +278,23 @@ class APrioriAgent(Agent):
             i = 0
             t0 = time()
 
+            # Draw episodes once for all evaluations
+            if episodes is None:
+                episodes = env.sample_episodes(batch_size, seed)
+            cache = RewardCache(cache_path)
+
             if verbose:
                 print("Optimizing model for %d steps with batch size %d..." % (nb_steps, batch_size))
 
             ### First, optimize benchmark
-            env.optimize_benchmark(nb_steps * 100, verbose=True)
+            # Rewards are measured against it, so a resumed fit reuses the cached one to keep memoised rewards valid
+            bench_key = cache.make_key('benchmark', env.pairs, env.period, env.obs_steps, env.data_length,
+                                       env.tapi.ohlc_data[env.pairs[0]].index[0])
+            if bench_key in cache:
+                env.benchmark = np.array(cache[bench_key])
+            else:
+                env.optimize_benchmark(nb_steps * 100, verbose=True)
+                cache[bench_key] = np.float64(env.benchmark)
 
             ## Now optimize model w.r.t benchmark
             # First define optimization constrains
@@ -110,6 +309,24 @@ class APrioriAgent(Agent):
             if not constraints:
                 constraints = [lambda *args, **kwargs: True]
 
+            if method == 'halving':
+                opt_params, info = self.successive_halving(env, nb_steps, episodes, cache, search_space, constraints,
+                                                           eta=eta, seed=seed, verbose=verbose,
+                                                           nb_max_episode_steps=nb_max_episode_steps,
+                                                           action_repetition=action_repetition,
+                                                           callbacks=callbacks,
+                                                           visualize=visualize,
+                                                           nb_max_start_steps=nb_max_start_steps,
+                                                           start_step_policy=start_step_policy,
+                                                           start_step=start_step,
+                                                           noise_abs=noise_abs)
+                self.set_params(**opt_params)
+                env.training = False
+                return opt_params, info
+
+            elif method != 'optunity':
+                raise ValueError("Unknown search method: %s" % str(method))
+
             # Initialize buffer
             optimization_rewards = []
 
@@ -121,22 +338,17 @@ class APrioriAgent(Agent):
                     # Init variables
                     nonlocal i, nb_steps, t0, env, nb_max_episode_steps, optimization_rewards
 
-                    # Sample params
-                    self.set_params(**kwargs)
-
-                    # Try model for a batch
-                    # sample environment
-                    r, rstd = self.test(env,
-                                    nb_episodes=batch_size,
-                                    action_repetition=action_repetition,
-                                    callbacks=callbacks,
-                                    visualize=visualize,
-                                    nb_max_episode_steps=nb_max_episode_steps,
-                                    nb_max_start_steps=nb_max_start_steps,
-                                    start_step_policy=start_step_policy,
-                                    start_step=start_step,
-                                    noise_abs=noise_abs,
-                                    verbose=False)
+                    # Try model for a batch of fixed episodes
+                    r, rstd = self.evaluate(env, kwargs, episodes, cache,
+                                            nb_max_episode_steps=nb_max_episode_steps,
+                                            action_repetition=action_repetition,
+                                            callbacks=callbacks,
+                                            visualize=visualize,
+                                            nb_max_start_steps=nb_max_start_steps,
+                                            start_step_policy=start_step_policy,
+                                            start_step=start_step,
+                                            noise_abs=noise_abs,
+                                            verbose=False)
 
                     # Log batch reward
                     optimization_rewards.append(r)
@@ -192,6 +404,10 @@ class APrioriAgent(Agent):
             # Set flag off
             env.training = False
 
+            if verbose:
+                print("\nEpisodes: %d, cached rewards used: %d/%d" % (len(episodes), cache.hits,
+                                                                     cache.hits + cache.misses))
+
             # Return optimal params and information
             return opt_params, info
 
@@ -202,6 +418,93 @@ class APrioriAgent(Agent):
             print("\nOptimization interrupted by user.")
             return opt_params, info
 
+    # Replay methods
+    def replay_signal(self, prices):
+        """
+        Precompute agent signal for every step of a price history
+        :param prices: numpy array: Open prices with shape (steps, symbols). Fiat is the last column.
+        :return: numpy array: Signal array with the same shape as prices
+        """
+        raise NotImplementedError("%s does not support offline replay." % self.__repr__())
+
+    def replay_init(self, n_symbols):
+        """
+        Initial portfolio vector for offline replay
+        :param n_symbols: int: Number of symbols, fiat included
+        :return: numpy array: Portfolio vector
+        """
+        action = np.ones(n_symbols)
+        action[-1] = 0
+        return array_normalize(action)
+
+    def replay_step(self, x, b, drift):
+        """
+        Portfolio update for offline replay
+        :param x: numpy array: Precomputed signal for the current step
+        :param b: numpy array: Last executed portfolio vector
+        :param drift: numpy array: Last portfolio vector after price drift
+        :return: numpy array: New portfolio vector
+        """
+        raise NotImplementedError("%s does not support offline replay." % self.__repr__())
+
+    def replay(self, prices, fee=0.0025, start=1, init_weights=None):
+        """
+        Offline replay of the agent weight path over a price history, bypassing BacktestEnvironment.
+        Only for agents whose decision depends solely on the price window and the previous weights.
+        :param prices: pandas DataFrame or numpy array: Open prices with shape (steps, pairs), fiat excluded
+        :param fee: float: Proportional transaction fee charged over the portfolio turnover
+        :param start: int: Index of the first decision row. Rows before it are used as history only.
+        :param init_weights: numpy array: Portfolio vector before the first decision. Default is full fiat.
+        :return: tuple: weights, turnover and net wealth arrays, one row per decision step
+        """
+        prices = np.asarray(prices, dtype=np.float64)
+        prices = np.hstack([prices, np.ones((prices.shape[0], 1))])
+        n_steps, n_symbols = prices.shape
+
+        assert 1 <= start < n_steps, "start must be inside the price history."
+
+        if init_weights is None:
+            init_weights = np.zeros(n_symbols)
+            init_weights[-1] = 1.0
+
+        # Precompute signal and price relatives for the whole history
+        signal = self.replay_signal(prices)
+        relative = np.vstack([np.ones((1, n_symbols)), safe_div(prices[1:], prices[:-1])])
+
+        weights = np.empty((n_steps - start, n_symbols))
+        turnover = np.empty(n_steps - start)
+        wealth = np.empty(n_steps - start)
+
+        # Reset agent state
+        self.init = False
+        self.step = 0
+        b = np.float64(init_weights)
+        w = 1.0
+
+        for k, t in enumerate(range(start, n_steps)):
+            # Weights after price drift since the last rebalance
+            if k:
+                drift = b * relative[t]
+                w *= drift.sum()
+                drift /= drift.sum()
+            else:
+                drift = b.copy()
+
+            if self.step:
+                b = np.float64(self.replay_step(signal[t], b.copy(), drift.copy()))
+            else:
+                b = np.float64(self.replay_init(n_symbols))
+
+            # Pay fees over the traded amount
+            turnover[k] = np.abs(b - drift)[:-1].sum()
+            w *= 1 - fee * turnover[k]
+
+            weights[k] = b
+            wealth[k] = w
+            self.step += 1
+
+        return weights, turnover, wealth
+
 
 # Test and benchmark
 class TestAgent(APrioriAgent):
@@ -418,6 +721,17 @@ class ConstantRebalance(APrioriAgent):
         factor = self.predict(obs)
         return factor
 
+    def replay_signal(self, prices):
+        return prices
+
+    def replay_init(self, n_symbols):
+        if not isinstance(self.position, np.ndarray):
+            self.position = np.append(array_normalize(np.ones(n_symbols - 1)), [0.0])
+        return self.position
+
+    def replay_step(self, x, b, drift):
+        return self.position
+
     def set_params(self, **kwargs):
         self.position = np.append(array_normalize(np.array([kwargs[key]
                                             for key in kwargs]))[:-1], [0.0])
@@ -571,6 +885,20 @@ class OGS(APrioriAgent):
 
         return pp * (1 - self.eta) + np.ones(len(x)) / float(len(x)) * self.eta
 
+    def replay_signal(self, prices):
+        if self.factor is not models.price_relative:
+            raise NotImplementedError("OGS replay only supports the price_relative factor.")
+        return models.price_relative_array(prices)
+
+    def replay_init(self, n_symbols):
+        self.crp = super().replay_init(n_symbols)
+        self.gti = np.ones_like(self.crp)
+        self.init = True
+        return self.crp
+
+    def replay_step(self, x, b, drift):
+        return self.update(drift, x)
+
     def set_params(self, **kwargs):
         if 'lr'in kwargs:
             self.lr = kwargs['lr']
@@ -634,6 +962,14 @@ class MW(APrioriAgent):
 
         return simplex_proj(b)
 
+    def replay_signal(self, prices):
+        if self.factor is not models.price_relative:
+            raise NotImplementedError("MW replay only supports the price_relative factor.")
+        return models.price_relative_array(prices)
+
+    def replay_step(self, x, b, drift):
+        return self.update(drift, x)
+
     def set_params(self, **kwargs):
         if 'lr'in kwargs:
             self.lr = kwargs['lr']
@@ -1059,6 +1395,14 @@ class HarmonicTrader(APrioriAgent):
     def __repr__(self):
         return "HarmonicTrader"
 
+    # Fibonacci ratios for AB/XA, BC/AB and CD/BC legs
+    patterns = {
+        'gartley': ((0.618, 0.618), (0.382, 0.886), (1.27, 1.618)),
+        'butterfly': ((0.786, 0.786), (0.382, 0.886), (1.618, 2.618)),
+        'bat': ((0.382, 0.5), (0.382, 0.886), (1.618, 2.618)),
+        'crab': ((0.382, 0.618), (0.382, 0.886), (2.24, 3.618))
+    }
+
     def __init__(self, peak_order=7, err_allowed=0.05, decay=0.99, activation=simplex_proj, fiat="BTC", name="Harmonic"):
         """
         Fibonacci trader init method
@@ -1073,6 +1417,7 @@ class HarmonicTrader(APrioriAgent):
         self.alpha = [1., 1.]
         self.decay = decay
         self.activation = activation
+        self.detectors = {}
 
     def find_extreme(self, obs):
         max_idx = argrelextrema(obs.open.values, np.greater, order=self.peak_order)[0]
@@ -1081,60 +1426,76 @@ class HarmonicTrader(APrioriAgent):
         extreme_idx.sort()
         return obs.open.iloc[extreme_idx]
 
+    def track_extreme(self, pair, obs):
+        """
+        Incremental version of find_extreme. Keeps one pivot detector per pair and feed it only the new candles.
+        :param pair: str: Pair name
+        :param obs: pandas DataFrame: Pair observation
+        :return: numpy array: Confirmed extremes followed by last open price
+        """
+        if pair not in self.detectors or self.detectors[pair].order != self.peak_order:
+            self.detectors[pair] = models.PivotDetector(order=self.peak_order)
+        return self.detectors[pair].feed(obs.open)
+
     def calc_intervals(self, extremes):
-        XA = extremes.iloc[-2] - extremes.iloc[-1]
-        AB = extremes.iloc[-3] - extremes.iloc[-2]
-        BC = extremes.iloc[-4] - extremes.iloc[-3]
-        CD = extremes.iloc[-5] - extremes.iloc[-4]
+        extremes = np.asarray(extremes)
+        XA = extremes[-2] - extremes[-1]
+        AB = extremes[-3] - extremes[-2]
+        BC = extremes[-4] - extremes[-3]
+        CD = extremes[-5] - extremes[-4]
 
         return XA, AB, BC, CD
 
-    def find_pattern(self, obs, c1, c2, c3):
-        try:
-            XA, AB, BC, CD = self.calc_intervals(self.find_extreme(obs))
-
-            # Gartley fibonacci pattern
-            AB_range = np.array([c1[0] - self.err_allowed, c1[1] + self.err_allowed]) * abs(XA)
-            BC_range = np.array([c2[0] - self.err_allowed, c2[1] + self.err_allowed]) * abs(AB)
-            CD_range = np.array([c3[0] - self.err_allowed, c3[1] + self.err_allowed]) * abs(BC)
-
-            if AB_range[0] < abs(AB) < AB_range[1] and \
-                                    BC_range[0] < abs(BC) < BC_range[1] and \
-                                    CD_range[0] < abs(CD) < CD_range[1]:
-                if XA > 0 and AB < 0 and BC > 0 and CD < 0:
-                    return 1
-                elif XA < 0 and AB > 0 and BC < 0 and CD > 0:
-                    return -1
-                else:
-                    return 0
+    def match_pattern(self, intervals, c1, c2, c3):
+        XA, AB, BC, CD = intervals
+
+        # Fibonacci ratios check
+        AB_range = np.array([c1[0] - self.err_allowed, c1[1] + self.err_allowed]) * abs(XA)
+        BC_range = np.array([c2[0] - self.err_allowed, c2[1] + self.err_allowed]) * abs(AB)
+        CD_range = np.array([c3[0] - self.err_allowed, c3[1] + self.err_allowed]) * abs(BC)
+
+        if AB_range[0] < abs(AB) < AB_range[1] and \
+                                BC_range[0] < abs(BC) < BC_range[1] and \
+                                CD_range[0] < abs(CD) < CD_range[1]:
+            if XA > 0 and AB < 0 and BC > 0 and CD < 0:
+                return 1
+            elif XA < 0 and AB > 0 and BC < 0 and CD > 0:
+                return -1
             else:
                 return 0
+        else:
+            return 0
+
+    def find_pattern(self, obs, c1, c2, c3):
+        try:
+            return self.match_pattern(self.calc_intervals(self.find_extreme(obs)), c1, c2, c3)
         except IndexError:
             return 0
 
     def is_gartley(self, obs):
-        return self.find_pattern(obs, c1=(0.618, 0.618), c2=(0.382, 0.886), c3=(1.27, 1.618))
+        return self.find_pattern(obs, *self.patterns['gartley'])
 
     def is_butterfly(self, obs):
-        return self.find_pattern(obs, c1=(0.786, 0.786), c2=(0.382, 0.886), c3=(1.618, 2.618))
+        return self.find_pattern(obs, *self.patterns['butterfly'])
 
     def is_bat(self, obs):
-        return self.find_pattern(obs, c1=(0.382, 0.5), c2=(0.382, 0.886), c3=(1.618, 2.618))
+        return self.find_pattern(obs, *self.patterns['bat'])
 
     def is_crab(self, obs):
-        return self.find_pattern(obs, c1=(0.382, 0.618), c2=(0.382, 0.886), c3=(2.24, 3.618))
+        return self.find_pattern(obs, *self.patterns['crab'])
 
     def predict(self, obs):
         pairs = obs.columns.levels[0]
         action = np.zeros(pairs.shape[0] - 1)
         for i, pair in enumerate(pairs):
             if pair is not self.fiat:
-                pattern = np.array([pattern(obs[pair]) for pattern in [self.is_gartley,
-                                                                       self.is_butterfly,
-                                                                       self.is_bat,
-                                                                       self.is_crab]]).sum()
+                try:
+                    # Compute intervals once for all patterns
+                    intervals = self.calc_intervals(self.track_extreme(pair, obs[pair]))
+                except IndexError:
+                    continue
 
-                action[i] = pattern
+                action[i] = np.sum([self.match_pattern(intervals, *ratios) for ratios in self.patterns.values()])
 
         return action
 
@@ -1168,6 +1529,7 @@ class HarmonicTrader(APrioriAgent):
         self.peak_order = int(kwargs['peak_order'])
         self.decay = kwargs['decay']
         self.alpha = [kwargs['alpha_up'], kwargs['alpha_down']]
+        self.detectors = {}
 
 
 # Mean reversion
@@ -1255,6 +1617,12 @@ class PAMR(APrioriAgent):
         # project it onto simplex
         return simplex_proj(b)
 
+    def replay_signal(self, prices):
+        return safe_div(1.0, models.price_relative_array(prices))
+
+    def replay_step(self, x, b, drift):
+        return self.update(b, x)
+
     def set_params(self, **kwargs):
         self.eps = kwargs['eps']
         if 'C' in kwargs:
@@ -1331,6 +1699,17 @@ class OLMAR(APrioriAgent):
         # project it onto simplex
         return simplex_proj(b)
 
+    def replay_signal(self, prices):
+        # Moving average over the last window rows, from cumulative sums
+        csum = np.vstack([np.zeros((1, prices.shape[1])), np.cumsum(prices, axis=0)])
+        end = np.arange(1, prices.shape[0] + 1)
+        begin = np.clip(end - self.window, 0, None)
+        mean = (csum[end] - csum[begin]) / (end - begin).reshape([-1, 1])
+        return safe_div(mean, prices)
+
+    def replay_step(self, x, b, drift):
+        return self.update(b, x)
+
     def set_params(self, **kwargs):
         self.eps = kwargs['eps']
         self.window = int(kwargs['window'])
@@ -1705,7 +2084,7 @@ class TCO(APrioriAgent):
         #     price_predict[key] = np.float64(obs[symbol].open.iloc[-self.window:].mean() /
         #                                     (obs.get_value(obs.index[-1], (symbol, 'open')) + self.epsilon))
         prev_posit = self.get_portfolio_vector(obs, index=-1) + 1
-        factor_posit = self.factor(obs) + 1
+        factor_posit = np.append(self.factor(obs).iloc[-1].values, [1.0]) + 1
         return safe_div(factor_posit, prev_posit)
 
     def rebalance(self, obs):
@@ -1739,6 +2118,16 @@ class TCO(APrioriAgent):
         # project it onto simplex
         return simplex_proj(b)
 
+    def replay_signal(self, prices):
+        if self.factor is not models.price_relative:
+            raise NotImplementedError("TCO replay only supports the price_relative factor.")
+        return models.price_relative_array(prices)
+
+    def replay_step(self, x, b, drift):
+        if self.reb == -1:
+            b = drift.copy()
+        return self.update(b, safe_div(x + 1, drift + 1))
+
     def set_params(self, **kwargs):
         self.toff = kwargs['toff']
         if self.optimize_factor:
@@ -2190,3 +2579,250 @@ class Pipeline(APrioriAgent):
         self.factor.step = self.risk.step = self.step
 
         return self.b
+
+
+## Agent Arena
+class Ledger(object):
+    """
+    Lightweight portfolio ledger used by Arena to simulate one agent trades.
+    Follows TradingEnvironment.simulate_trade rules with float arithmetic.
+    """
+    def __repr__(self):
+        return "Ledger"
+
+    def __init__(self, amounts, tax, obs_steps):
+        """
+        :param amounts: numpy array: Initial symbol amounts, fiat last
+        :param tax: numpy array: Symbol fees, fiat last
+        :param obs_steps: int: Observation length
+        """
+        self.amounts = np.array(amounts, dtype=np.float64)
+        self.tax = np.array(tax, dtype=np.float64)
+        self.history = deque([self.amounts.copy()], maxlen=obs_steps)
+        self.index = []
+        self.portval = []
+        self.turnover = []
+        self.fees = []
+
+    def calc_portval(self, prices):
+        """
+        :param prices: numpy array: Crypto prices in fiat units
+        :return: float: Portfolio value
+        """
+        return np.dot(self.amounts[:-1], prices) + self.amounts[-1]
+
+    def calc_portfolio_vector(self, prices):
+        return safe_div(np.append(self.amounts[:-1] * prices, self.amounts[-1]), self.calc_portval(prices))
+
+    def get_amounts(self, n_rows):
+        """
+        Symbol amounts for each observation row, as the environment portfolio observation
+        :param n_rows: int: Observation length
+        :return: numpy array: Amounts with shape (n_rows, n_symbols)
+        """
+        # Last row keeps amounts from the previous trade, older rows are padded with the oldest amounts
+        history = list(self.history) + [self.history[-1]]
+        history = [history[0]] * max(0, n_rows - len(history)) + history[-n_rows:]
+        return np.array(history)
+
+    def log(self, timestamp, prices, turnover=0.0, fees=0.0):
+        self.index.append(timestamp)
+        self.portval.append(self.calc_portval(prices))
+        self.turnover.append(turnover)
+        self.fees.append(fees)
+
+    def trade(self, action, prices, timestamp):
+        """
+        Simulate portfolio rebalance
+        :param action: numpy array: Desired portfolio vector
+        :param prices: numpy array: Crypto prices in fiat units
+        :param timestamp: Trade time
+        """
+        action = safe_div(np.clip(np.array(action, dtype=np.float64), 0.0, None), np.clip(action, 0.0, None).sum())
+        posit_change = (action - self.calc_portfolio_vector(prices))[:-1]
+        portval = self.calc_portval(prices)
+        fees = 0.0
+
+        # Sell assets first
+        for i in np.where(posit_change < 0)[0]:
+            fee = portval * abs(posit_change[i]) * self.tax[i]
+            self.amounts[-1] += portval * abs(posit_change[i]) - fee
+            self.amounts[i] = safe_div(portval * action[i], prices[i])
+            fees += fee
+
+        # Update portval with deduced taxes
+        portval = self.calc_portval(prices)
+
+        # Then buy some goods
+        for i in np.where(posit_change > 0)[0]:
+            self.amounts[-1] -= portval * posit_change[i]
+
+            # if fiat is negative, deduce it from portval and clip
+            if self.amounts[-1] < 0:
+                portval += self.amounts[-1]
+                self.amounts[-1] = 0.0
+
+            fee = portval * posit_change[i] * self.tax[i]
+            self.amounts[i] = safe_div(portval * action[i] - fee, prices[i])
+            fees += fee
+
+        self.history.append(self.amounts.copy())
+        self.log(timestamp, prices, np.abs(posit_change).sum(), fees)
+
+    def to_frame(self):
+        return pd.DataFrame({'portval': self.portval, 'turnover': self.turnover, 'fees': self.fees},
+                            index=self.index)
+
+
+class Arena(object):
+    """
+    Run several agents over the same backtest in a single pass.
+    Market observation is fetched and converted once per step and shared by all agents,
+    each one keeping its own portfolio on a Ledger.
+    """
+    def __repr__(self):
+        return "Arena"
+
+    def __init__(self, agents):
+        """
+        :param agents: list: APrioriAgent instances to compare
+        """
+        self.agents = OrderedDict()
+        for agent in agents:
+            name = agent.name if agent.name else repr(agent)
+            key, i = name, 1
+            while key in self.agents:
+                key = "%s_%d" % (name, i)
+                i += 1
+            self.agents[key] = agent
+
+        self.ledgers = OrderedDict()
+        self.errors = {}
+        self.results = None
+
+    def get_observation(self, market, index, ledger):
+        """
+        Build agent observation from shared market observation and agent ledger
+        :param market: numpy array: Market observation values
+        :param index: pandas DatetimeIndex: Observation index
+        :param ledger: Ledger: Agent ledger
+        :return: pandas DataFrame: Agent observation, same as env.get_observation(True)
+        """
+        values = np.empty((market.shape[0], self.columns.shape[0]), dtype=np.float64)
+        values[:, self.market_idx] = market
+        values[:, self.amounts_idx] = ledger.get_amounts(market.shape[0])
+        return pd.DataFrame(values, index=index, columns=self.columns)
+
+    def run(self, env, nb_max_episode_steps=None, verbose=False):
+        """
+        Test all agents on backtest environment
+        :param env: BacktestEnvironment: Backtest environment
+        :param nb_max_episode_steps: int: Max number of steps
+        :param verbose: bool: Print progress
+        :return: pandas DataFrame: Comparative results table
+        """
+        assert hasattr(env, 'data_length'), "Arena needs a backtest environment."
+
+        # Reset env, it sets the data cursor and initial balance
+        env.reset_status()
+        obs = env.reset()
+
+        if nb_max_episode_steps is None:
+            nb_max_episode_steps = env.data_length
+
+        symbols = list(env.symbols)
+        amounts_cols = [(pair, symbol) for pair, symbol in zip(env.pairs, symbols[:-1])] + [(env._fiat, env._fiat)]
+        market_cols = [col for col in obs.columns if col not in amounts_cols]
+        self.columns = obs.columns
+        self.amounts_idx = obs.columns.get_indexer(amounts_cols)
+        self.market_idx = obs.columns.get_indexer(market_cols)
+        price_cols = [(pair, 'open') for pair in env.pairs]
+
+        amounts = [np.float64(env.init_balance[symbol]) for symbol in symbols]
+        tax = [np.float64(env.tax[symbol]) for symbol in symbols]
+
+        # Reset agents and ledgers
+        self.ledgers = OrderedDict()
+        self.errors = {}
+        prices = obs[price_cols].values[-1]
+        for name, agent in self.agents.items():
+            agent.fiat = env._fiat
+            agent.step = 0
+            # Same reset as Agent.test, so each run starts from scratch
+            agent.init = False
+            agent.reset_states()
+            self.ledgers[name] = Ledger(amounts, tax, env.obs_steps)
+            self.ledgers[name].log(env.portfolio_df.index[-1], prices)
+
+        step = 0
+        t0 = time()
+        while True:
+            # Shared market observation
+            timestamp = env.timestamp
+            market = env.get_history().astype(np.float64)
+            index = market.index
+            prices = market[price_cols].values[-1]
+            market = market[market_cols].values
+
+            for name, agent in self.agents.items():
+                if name in self.errors:
+                    continue
+                ledger = self.ledgers[name]
+                try:
+                    action = agent.rebalance(self.get_observation(market, index, ledger))
+                    ledger.trade(action, prices, timestamp)
+                    agent.step += 1
+
+                except Exception as e:
+                    Logger.error(Arena.run, "%s: %s" % (name, env.parse_error(e)))
+                    self.errors[name] = e
+
+            step += 1
+            if verbose:
+                print(">> step {0}/{1}, {2} % done, Samples/s: {3:.04f}                   ".format(
+                    step,
+                    nb_max_episode_steps - env.obs_steps - 2,
+                    int(100 * step / (nb_max_episode_steps - env.obs_steps - 2)),
+                    step / (time() - t0)
+                ), end="\r", flush=True)
+
+            # Check for end condition
+            if env.index >= env.data_length - 2 or step == nb_max_episode_steps:
+                break
+
+            # Move data cursor
+            env.index += 1
+
+        return self.get_results()
+
+    def get_results(self):
+        """
+        Comparative results table
+        :return: pandas DataFrame: Agents metrics
+        """
+        results = []
+        for name, ledger in self.ledgers.items():
+            portval = np.array(ledger.portval)
+            returns = portval[1:] / portval[:-1] - 1
+            results.append({
+                'portval': portval[-1],
+                'return': portval[-1] / portval[0] - 1,
+                'sharpe': safe_div(returns.mean(), returns.std()),
+                'max_drawdown': (portval / np.maximum.accumulate(portval) - 1).min(),
+                'turnover': np.sum(ledger.turnover),
+                'fees': np.sum(ledger.fees),
+                'steps': len(ledger.index) - 1,
+                'error': repr(self.errors[name]) if name in self.errors else None
+            })
+
+        self.results = pd.DataFrame(results, index=list(self.ledgers.keys()),
+                                    columns=['portval', 'return', 'sharpe', 'max_drawdown',
+                                             'turnover', 'fees', 'steps', 'error'])
+        return self.results.sort_values('return', ascending=False)
+
+    def get_portval(self):
+        """
+        :return: pandas DataFrame: Portfolio value history for each agent
+        """
+        return pd.concat([pd.Series(ledger.portval, index=ledger.index, name=name)
+                          for name, ledger in self.ledgers.items()], axis=1)
@@ -2,7 +2,7 @@
 import numpy as np
 from time import time, sleep
 from datetime import datetime, timedelta, timezone
-from cryptotrader.utils import floor_datetime, Logger, safe_div
+from cryptotrader.utils import floor_datetime, Logger, safe_div, BarScheduler
 import pandas as pd
 from cryptotrader.exceptions import *
 
@@ -182,7 +182,8 @@ class Agent(object):
                 return episode_reward / self.step, 0.0
 
     # Trade methods
-    def trade(self, env, start_step=0, act_now=False, timeout=None, verbose=False, render=False, email=False, save_dir="./"):
+    def trade(self, env, start_step=0, act_now=False, timeout=None, verbose=False, render=False, email=False, save_dir="./",
+              scheduler=None, bar_offset=0.5):
         """
         TRADE REAL ASSETS WITHIN EXCHANGE. USE AT YOUR OWN RISK!
         :param env: Livetrading or Papertrading environment instance
@@ -193,8 +194,16 @@ class Agent(object):
         :param render: bool: Not implemented yet
         :param email: bool: Wheter to send report email or not
         :param save_dir: str: Save directory for logs
+        :param scheduler: BarScheduler: Bar open trigger. Call its notify method when a new candle arrives on the feed.
+        Defaults to the env subscriber mode scheduler, if subscribed
+        :param bar_offset: float: Seconds after bar open to act, if no scheduler is given
         :return:
         """
+        if scheduler is None:
+            scheduler = getattr(env, 'scheduler', None) or BarScheduler(env.period, offset=bar_offset)
+        # Bar times are on the scheduler clock, which may be a replay clock
+        clock = getattr(scheduler, 'clock', time)
+
         try:
             # Fiat symbol
             self.fiat = env._fiat
@@ -204,16 +213,19 @@ class Agent(object):
             obs = env.reset()
 
             # Set flags
-            can_act = act_now
+            can_act = False
             may_report = True
             status = env.status
 
             # Get initial values
             prev_portval = init_portval = env.calc_total_portval()
             init_time = env.timestamp
-            last_action_time = floor_datetime(env.timestamp, env.period)
             t0 = time() # # TODO: use datetime
 
+            # Steps are driven by bar triggers, so env must not sleep within them
+            env.wait_bar = False
+            scheduler.start(fire_now=act_now)
+
             # Initialize var
             episode_reward = 0
             reward = 0
@@ -238,64 +250,70 @@ class Agent(object):
 
             while True:
                 try:
-                    # Log action time
-                    loop_time = env.timestamp
+                    # When everything is done, wait for the next bar trigger
+                    if not can_act:
+                        trigger = scheduler.wait()
+                        if trigger is None:
+                            break
 
-                    # Can act?
-                    if loop_time >= last_action_time + timedelta(minutes=env.period):
+                        bar, lag = trigger
                         can_act = True
                         try:
                             del self.log["Trade_incomplete"]
                         except Exception:
                             pass
 
-                    # If can act, run strategy and step environment
-                    if can_act:
-                        # Log action time
-                        last_action_time = floor_datetime(env.timestamp, env.period)
+                    # Log action time
+                    loop_time = env.timestamp
 
-                        # Ask oracle for a prediction
-                        action = self.rebalance(env.get_observation(True).astype(np.float64))
+                    # Observe
+                    with env.timings.measure('observe'):
+                        obs = env.get_observation(True).astype(np.float64)
 
-                        # Generate report
-                        if verbose or email:
-                            msg = self.make_report(env, obs, reward, episode_reward, t0,
-                                                   loop_time, action, prev_portval, init_portval)
+                    # Decide
+                    with env.timings.measure('decide'):
+                        action = self.rebalance(obs)
 
-                            if verbose:
-                                print(msg, end="\r", flush=True)
+                    # Bar open to first order latency
+                    env.timings.record('bar_to_orders', clock() - bar)
+                    self.log["Bar latency"] = "trigger %.1f ms, orders %.1f ms" % (1000 * lag, 1000 * (clock() - bar))
 
-                            if email and may_report:
-                                if hasattr(env, 'email'):
-                                    env.send_email("Trading report " + self.name, msg)
-                                may_report = False
+                    # Execute
+                    obs, reward, done, status = env.step(action)
 
-                        # Save portval for report
-                        prev_portval = env.calc_total_portval()
+                    # Accumulate reward
+                    episode_reward += reward
 
-                        # Sample environment
-                        obs, reward, done, status = env.step(action)
+                    # If action is complete, increment step counter, log action time and allow report
+                    if done:
+                        # Increase step counter
+                        self.step += 1
 
-                        # Accumulate reward
-                        episode_reward += reward
+                        # You can act just one time per candle
+                        can_act = False
 
-                        # If action is complete, increment step counter, log action time and allow report
-                        if done:
-                            # Increase step counter
-                            self.step += 1
+                        # If you've acted, report yourself to nerds
+                        may_report = True
 
-                            # You can act just one time per candle
-                            can_act = False
+                    else:
+                        self.log["Trade_incomplete"] = "Position change was not fully completed."
 
-                            # If you've acted, report yourself to nerds
-                            may_report = True
+                    # Generate report, out of the order path
+                    if verbose or email:
+                        with env.timings.measure('report'):
+                            msg = self.make_report(env, obs, reward, episode_reward, t0,
+                                                   loop_time, action, prev_portval, init_portval)
 
-                        else:
-                            self.log["Trade_incomplete"] = "Position change was not fully completed."
+                        if verbose:
+                            print(msg, end="\r", flush=True)
 
-                    # If can't act, just take an observation and return
-                    else:
-                        obs = env.get_observation(True).astype(np.float64)
+                        if email and may_report:
+                            if hasattr(env, 'email'):
+                                env.send_email("Trading report " + self.name, msg)
+                            may_report = False
+
+                    # Save portval for the next report, out of the order path
+                    prev_portval = env.calc_total_portval()
 
                     # Not implemented yet
                     if render:
@@ -317,14 +335,6 @@ class Agent(object):
                         # Panic
                         break
 
-                    if not can_act:
-                        # When everything is done, wait for the next candle
-                        try:
-                            sleep(datetime.timestamp(last_action_time + timedelta(minutes=env.period))
-                                  - datetime.timestamp(env.timestamp) + np.random.random(1) * 3)
-                        except ValueError:
-                            sleep(np.random.random(1) * 3)
-
                 except MaxRetriesException as e:
                     # Tell nerds the delay
                     Logger.error(Agent.trade, "Retries exhausted. Waiting for connection...")
@@ -335,11 +345,7 @@ class Agent(object):
                         pass
 
                     # Wait for the next candle
-                    try:
-                        sleep(datetime.timestamp(last_action_time + timedelta(minutes=env.period))
-                              - datetime.timestamp(env.timestamp) + np.random.random(1) * 30)
-                    except ValueError:
-                        sleep(1 + int(np.random.random(1) * 30))
+                    can_act = False
 
                 # Catch exceptions
                 except Exception as e:
@@ -378,6 +384,10 @@ class Agent(object):
                   type(e).__name__ + ' in line ' + str(e.__traceback__.tb_lineno) + ': ' + str(e))
             raise e
 
+        finally:
+            scheduler.stop()
+            env.wait_bar = True
+
     def make_report(self, env, obs, reward, episode_reward, t0, action_time, next_action, prev_portval, init_portval):
         """
         Report generator
@@ -491,6 +501,14 @@ class Agent(object):
             if symbol is not 'count':
                 msg += "%-4s: %7.02f %%\n" % (str(symbol), sl[symbol])
 
+        # Latency summary
+        summary = env.timings.summary()
+        if summary:
+            msg += "\nLatency summary:\n"
+            msg += "Stage          : p50:          p99:\n"
+            for stage in summary:
+                msg += "%-15s: %10.2f ms  %10.2f ms\n" % (stage, summary[stage]['p50'], summary[stage]['p99'])
+
         # Operational status summary
         msg += "\nStatus: %s\n" % str(env.status)
 
@@ -1,14 +1,23 @@
 from functools import wraps as _wraps
-from itertools import chain as _chain
+from itertools import chain as _chain, count as _count
+import os
+import re
+import builtins
 import json
-from .utils import convert_to, Logger, dec_con
-from decimal import Decimal
+import queue
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from .utils import convert_to, Logger, dec_con, Timings, BarScheduler, CircuitBreaker, hedged
+from decimal import Decimal, InvalidOperation
 import pandas as pd
-from time import sleep
+from time import sleep, time, perf_counter
 from datetime import datetime, timezone, timedelta
 import zmq
+import msgpack
+import numpy as np
 import threading
 from multiprocessing import Process
+from collections import OrderedDict, deque
 from .exceptions import *
 from cryptotrader.utils import send_email
 
@@ -42,32 +51,674 @@ class ExchangeConnection(object):
         return NotImplementedError("This class is not intended to be used directly.")
 
     def pair_reciprocal(self, df):
-        df[['open', 'high', 'low', 'close']] = df.apply(
-            {col: lambda x: str((Decimal('1') / convert_to.decimal(x)).quantize(Decimal('0E-8')))
-             for col in ['open', 'low', 'high', 'close']}, raw=True).rename(columns={'low': 'high',
-                                                                                     'high': 'low'}
-                                                                            )
-        return df.rename(columns={'quoteVolume': 'volume', 'volume': 'quoteVolume'})
+        return pair_reciprocal(df)
+
+## Binary protocol
+# Multipart messages: header frame, msgpack envelope, then one frame per numpy array.
+# Requests carry the same positional arguments as the string protocol, so the daemon parses both the same way.
+PROTOCOL = b'CTP'
+PROTOCOL_VERSION = 1
+
+# Commands replied with numpy frames
+ARRAY_COMMANDS = ['returnChartData', 'returnChartDataMulti']
+
+# Api methods returning numpy record arrays, for requests that take float64 numbers instead of exact decimals
+FLOAT_METHODS = {'returnChartData': 'returnChartArray'}
+
+# Chart data numbers travel as int64 fixed point, exact up to 8 decimals
+FIXED_DECIMALS = 8
+FIXED_SCALE = 10 ** FIXED_DECIMALS
+FIXED_MAX = 2 ** 63 - 1
+
+
+def pack_request(exchange, command, args, encoding=None):
+    """
+    :param exchange: str: FeedDaemon exchange
+    :param command: str: Api command
+    :param args: list: Positional command arguments
+    :param encoding: str: float to take float64 arrays, if the exchange api can decode to them.
+    Defaults to exact numpy frames for array commands
+    :return: list: Message frames
+    """
+    if encoding is None and command in ARRAY_COMMANDS:
+        encoding = 'numpy'
+    envelope = {'v': PROTOCOL_VERSION,
+                'exchange': exchange,
+                'command': command,
+                'args': [str(arg) for arg in args],
+                'encoding': encoding}
+    return [PROTOCOL, msgpack.packb(envelope, use_bin_type=True)]
+
+
+def unpack_request(frames):
+    """
+    :param frames: list: Message frames
+    :return: dict: Request envelope
+    """
+    envelope = msgpack.unpackb(frames[1], raw=False)
+    if envelope.get('v') != PROTOCOL_VERSION:
+        raise DataFeedException("Unsupported protocol version: %s" % str(envelope.get('v')))
+    return envelope
+
+
+def to_fixed(value):
+    """
+    Exact int64 fixed point from an exchange number
+    :param value: str, int or float
+    :return: int
+    """
+    text = str(value)
+    integer, _, fraction = text.partition('.')
+    if integer.lstrip('-').isdigit() and len(fraction) <= FIXED_DECIMALS and (fraction.isdigit() or not fraction):
+        return int(integer + fraction.ljust(FIXED_DECIMALS, '0'))
+
+    # Exponents and extra decimals
+    value = Decimal(text)
+    if not value.is_finite():
+        raise ValueError("Non finite value: %s" % text)
+    return int((value * FIXED_SCALE).to_integral_value())
+
+
+def encode_chart_data(records):
+    """
+    Chart data records to columns. Numbers become int64 fixed point, or float64 if out of range.
+    :param records: list: Candle dicts
+    :return: tuple: list of column metadata, list of numpy arrays
+    """
+    meta, arrays = [], []
+    for name in records[0]:
+        if name == 'date':
+            arrays.append(np.array([int(record[name]) for record in records], dtype=np.int64))
+            meta.append({'name': name, 'dtype': 'int64', 'scale': 0})
+            continue
+
+        try:
+            fixed = [to_fixed(record[name]) for record in records]
+            assert all(abs(value) <= FIXED_MAX for value in fixed)
+            arrays.append(np.array(fixed, dtype=np.int64))
+            meta.append({'name': name, 'dtype': 'int64', 'scale': FIXED_DECIMALS})
+        except (AssertionError, ValueError, InvalidOperation):
+            arrays.append(np.array([float(record[name]) for record in records], dtype=np.float64))
+            meta.append({'name': name, 'dtype': 'float64', 'scale': 0})
+
+    for item, array in zip(meta, arrays):
+        item['shape'] = array.shape
+
+    return meta, arrays
+
+
+def encode_record_array(data):
+    """
+    Record array fields to columns, as they are
+    :param data: numpy record array
+    :return: tuple: list of column metadata, list of numpy arrays
+    """
+    meta, arrays = [], []
+    for name in data.dtype.names:
+        array = np.ascontiguousarray(data[name])
+        arrays.append(array)
+        meta.append({'name': name, 'dtype': array.dtype.str, 'scale': 0, 'shape': array.shape})
+    return meta, arrays
+
+
+def fixed_to_str(array):
+    """
+    Exact decimal strings from int64 fixed point
+    :param array: numpy array: int64 fixed point values
+    :return: list: str values
+    """
+    integer, fraction = np.divmod(np.abs(array), FIXED_SCALE)
+    return ['%s%d.%08d' % ('-' if negative else '', i, f)
+            for negative, i, f in zip((array < 0).tolist(), integer.tolist(), fraction.tolist())]
+
+
+# Exchange number strings, with all 8 decimals, comma separated
+FIXED_TEXT = re.compile(r'(?:-?\d+\.\d{8},)*-?\d+\.\d{8}')
+
+
+def str_to_fixed(values):
+    """
+    Vectorized to_fixed for number strings
+    :param values: list or numpy array: str values. int, float and Decimal cells are read as their str
+    :return: numpy array: int64 fixed point values
+    """
+    values = values.tolist() if isinstance(values, np.ndarray) else list(values)
+    values = [value if isinstance(value, str) else str(value) for value in values]
+
+    # Exchange format is parsed in C. Other layouts go one by one
+    text = ','.join(values)
+    if FIXED_TEXT.fullmatch(text):
+        return np.fromstring(text.replace('.', ''), dtype=np.int64, sep=',')
+    return np.array([to_fixed(value) for value in values], dtype=np.int64)
+
+
+def reciprocal(values):
+    """
+    Vectorized 1 / x. Number strings give exact strings, rounded half even to 8 decimals like
+    Decimal quantize. Numbers give float64.
+    :param values: list or numpy array
+    :return: list of str, or numpy array
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+        with np.errstate(divide='ignore'):
+            return 1.0 / values.astype(np.float64)
+
+    fixed = str_to_fixed(values)
+    if (fixed == 0).any():
+        raise ZeroDivisionError("Reciprocal of zero price")
+
+    # 1 / (fixed / scale) * scale == scale ** 2 / fixed
+    sign = np.sign(fixed)
+    fixed = np.abs(fixed)
+    quotient, remainder = np.divmod(FIXED_SCALE ** 2, fixed)
+    half = fixed - remainder
+    quotient += (remainder > half) | ((remainder == half) & (quotient % 2 == 1))
+    return fixed_to_str(sign * quotient)
+
+
+def pair_reciprocal(data):
+    """
+    Chart data of a pair listed the other way around on the exchange. Prices are inverted, high and low swap,
+    and so do volume and quote volume. String columns stay exact, number columns are float64.
+    :param data: pandas DataFrame, numpy record array or list of candle dicts
+    :return: Same type as data
+    """
+    if isinstance(data, list):
+        if not data:
+            return data
+        columns = pair_reciprocal(OrderedDict((name, [candle[name] for candle in data]) for name in data[0]))
+        return [dict(zip(columns.keys(), row)) for row in zip(*columns.values())]
+
+    if isinstance(data, np.ndarray):
+        out = data.copy()
+        names = data.dtype.names
+    elif isinstance(data, dict):
+        out = OrderedDict(data)
+        names = list(data.keys())
+    else:
+        out = data.copy()
+        names = list(data.columns)
+
+    for col, src in [('open', 'open'), ('high', 'low'), ('low', 'high'), ('close', 'close')]:
+        column = data[src]
+        out[col] = reciprocal(column if isinstance(column, list) else np.asarray(column))
+    if 'volume' in names and 'quoteVolume' in names:
+        out['volume'], out['quoteVolume'] = data['quoteVolume'], data['volume']
+    return out
+
+
+def decode_chart_data(meta, frames):
+    """
+    Columns back to chart data records, with exact number strings like the exchange replies
+    :param meta: list: Column metadata
+    :param frames: list: zmq frames or buffers, one per column
+    :return: list: Candle dicts
+    """
+    columns = []
+    for item, frame in zip(meta, frames):
+        # Zero copy view on the message buffer
+        array = np.frombuffer(getattr(frame, 'buffer', frame), dtype=item['dtype']).reshape(item['shape'])
+        if item['scale']:
+            columns.append(fixed_to_str(array))
+        else:
+            columns.append(array.tolist())
+
+    names = [item['name'] for item in meta]
+    return [dict(zip(names, row)) for row in zip(*columns)]
+
+
+def chart_frame(meta, frames):
+    """
+    Columns to a chart data DataFrame, with float64 numbers
+    :param meta: list: Column metadata
+    :param frames: list: zmq frames or buffers, one per column
+    :return: pandas DataFrame
+    """
+    columns = OrderedDict()
+    for item, frame in zip(meta, frames):
+        array = np.frombuffer(getattr(frame, 'buffer', frame), dtype=item['dtype']).reshape(item['shape'])
+        columns[item['name']] = array / 10 ** item['scale'] if item['scale'] else array
+    return pd.DataFrame(columns)
+
+
+def multi_columns(name):
+    """
+    Batch chart data column name to pair and field
+    :param name: str: Reply column, like 'USDT_BTC close'
+    :return: tuple: pair, field. Date column has no pair
+    """
+    pair, _, field = name.rpartition(' ')
+    return pair, field
+
+
+def pack_reply(data, encoding=None):
+    """
+    :param data: Api reply
+    :param encoding: str: numpy to send chart data as array frames
+    :return: list: Message frames
+    """
+    envelope = {'v': PROTOCOL_VERSION, 'encoding': None, 'data': data}
+    arrays = []
+    if isinstance(data, np.ndarray) and data.dtype.names:
+        meta, arrays = encode_record_array(data)
+        envelope.update({'encoding': 'numpy', 'data': None, 'arrays': meta})
+    elif encoding in ('numpy', 'float') and isinstance(data, list) and data and isinstance(data[0], dict):
+        meta, arrays = encode_chart_data(data)
+        envelope.update({'encoding': 'numpy', 'data': None, 'arrays': meta})
+
+    return [PROTOCOL, msgpack.packb(envelope, use_bin_type=True)] + arrays
+
+
+def unpack_reply(frames, frame=False):
+    """
+    :param frames: list: Message frames
+    :param frame: bool: Return chart data as DataFrame
+    :return: Api reply
+    """
+    envelope = msgpack.unpackb(getattr(frames[1], 'bytes', frames[1]), raw=False)
+    if envelope.get('v') != PROTOCOL_VERSION:
+        raise UnexpectedResponseException("Unsupported protocol version: %s" % str(envelope.get('v')))
+
+    if envelope['encoding'] == 'numpy':
+        if frame:
+            return chart_frame(envelope['arrays'], frames[2:])
+        return decode_chart_data(envelope['arrays'], frames[2:])
+    return envelope['data']
+
+
+## Response cache
+# Public commands, with their cache ttl in seconds. None expires the entry at the next candle open.
+PUBLIC_TTL = {'returnTicker': 1.0,
+              'returnCurrencies': 3600.0,
+              'returnChartData': None,
+              'returnChartArray': None}
+
+
+class ResponseCache(object):
+    """
+    Daemon side TTL cache for public exchange calls.
+    Identical calls in flight are coalesced, so only one of them goes upstream.
+    """
+    def __init__(self, ttl=None, maxsize=1024, clock=time):
+        """
+
+        :param ttl: dict: command: ttl in seconds, or None to expire at the next candle open. Updates PUBLIC_TTL
+        :param maxsize: int: Max cached entries. Least recently used are dropped first
+        :param clock: callable: Time source
+        """
+        self.ttl = dict(PUBLIC_TTL)
+        if ttl:
+            self.ttl.update(ttl)
+        self.maxsize = maxsize
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def upstream(self, call):
+        """
+        Normalize a call so requests for the same candles share one upstream call.
+        Chart data ranges are floored to the candle period and the exact range is sliced from the reply.
+        :param call: tuple: exchange, command, args
+        :return: tuple: upstream call
+        """
+        if call[1] in ('returnChartData', 'returnChartArray'):
+            args = dict(call[2])
+            period = int(args['period'])
+            args['start'] = str(int(float(args['start']) // period * period))
+            args['end'] = str(int(float(args['end']) // period * period))
+            return call[0], call[1], args
+        return call
+
+    def key(self, call):
+        """
+        Cache key for a call
+        :param call: tuple: exchange, command[, args]
+        :return: tuple or None if the command is not public
+        """
+        if call[1] not in self.ttl:
+            return None
+        if len(call) > 2:
+            return (call[0], call[1]) + tuple(sorted(call[2].items()))
+        return call[0], call[1]
+
+    def expires(self, call, now):
+        """
+        Entry expire time
+        :param call: tuple: upstream call
+        :param now: float: current time
+        :return: float: timestamp
+        """
+        ttl = self.ttl[call[1]]
+        if ttl is None:
+            period = int(call[2]['period'])
+            return (now // period + 1) * period
+        return now + ttl
+
+    def select(self, call, rep):
+        """
+        Slice the requested range from an upstream chart data reply.
+        Ranges without candles get the exchange empty range reply, a single candle of zeros.
+        :param call: tuple: original call
+        :param rep: upstream reply
+        :return: reply
+        """
+        if call[1] not in ('returnChartData', 'returnChartArray') or isinstance(rep, str):
+            return rep
+        start, end = float(call[2]['start']), float(call[2]['end'])
+        if isinstance(rep, np.ndarray):
+            data = rep[(rep['date'] >= start) & (rep['date'] <= end)]
+            return data if data.shape[0] else np.zeros(1, dtype=rep.dtype)
+        data = [candle for candle in rep if start <= candle['date'] <= end]
+        return data if data or not rep else [dict.fromkeys(rep[0], 0)]
+
+    def get(self, call, fetch):
+        """
+        Return a cached reply, or fetch it once for all identical calls in flight
+        :param call: tuple: exchange, command[, args]
+        :param fetch: callable: upstream call handler. Error replies come back as str and are not cached
+        :return: reply
+        """
+        if self.key(call) is None:
+            return fetch(call)
+
+        upstream = self.upstream(call)
+        key = self.key(upstream)
+
+        with self.lock:
+            now = self.clock()
+            entry = self.entries.get(key)
+            if entry and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.select(call, entry[1])
+
+            if key in self.inflight:
+                self.coalesced += 1
+                done, result = self.inflight[key]
+                leader = False
+            else:
+                self.misses += 1
+                done, result = self.inflight[key] = (threading.Event(), [])
+                leader = True
+
+        if not leader:
+            done.wait()
+            # Leader failed, go upstream on our own
+            if not result:
+                return self.select(call, fetch(upstream))
+            return self.select(call, result[0])
+
+        try:
+            rep = fetch(upstream)
+            result.append(rep)
+        finally:
+            with self.lock:
+                self.inflight.pop(key, None)
+                if result and not isinstance(result[0], str):
+                    self.entries[key] = (self.expires(upstream, self.clock()), result[0])
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.maxsize:
+                        self.entries.popitem(last=False)
+            done.set()
+
+        return self.select(call, rep)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """
+        Cache counters
+        :return: dict: hits, misses, coalesced, size and hit rate
+        """
+        with self.lock:
+            total = self.hits + self.misses + self.coalesced
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'coalesced': self.coalesced,
+                    'size': len(self.entries),
+                    'hit_rate': (self.hits + self.coalesced) / total if total else 0.0}
+
+
+## Metrics
+# Health levels, best first
+HEALTH = ['ok', 'degraded', 'down']
+
+# Exchange error replies telling the exchange is in trouble, rather than the call was wrong
+UPSTREAM_ERRORS = ['try again', 'timed out', 'internal error', 'maintenance']
+
+
+class FeedMetrics(object):
+    """
+    FeedDaemon request and upstream call counters, with latency histograms by exchange and command.
+    Upstream calls seen in the last window seconds tell each exchange health. Thread safe.
+    """
+    def __init__(self, window=60.0, max_error_rate=0.2, max_latency=5.0, min_calls=3, clock=time):
+        """
+
+        :param window: float: Seconds of upstream calls the health looks at
+        :param max_error_rate: float: Failed upstream calls share above which an exchange is degraded
+        :param max_latency: float: Median upstream seconds above which an exchange is degraded
+        :param min_calls: int: Calls in window, all failed, for an exchange to be down
+        :param clock: callable: Time source
+        """
+        self.window = window
+        self.max_error_rate = max_error_rate
+        self.max_latency = max_latency
+        self.min_calls = min_calls
+        self.clock = clock
+        self.started = clock()
+        self.lock = threading.Lock()
+        self.counts = {'requests': OrderedDict(), 'upstream': OrderedDict()}
+        self.timings = {'requests': Timings(), 'upstream': Timings()}
+        self.recent = {}
+        self.last_error = {}
+        self.hedges = OrderedDict()
+
+    def record(self, kind, exchange, command, seconds, error=False):
+        """
+        :param kind: str: requests for client requests, upstream for exchange api calls
+        :param exchange: str: Exchange name
+        :param command: str: Api command
+        :param seconds: float: Elapsed time
+        :param error: bool or str: Error message if the call failed
+        """
+        key = '%s %s' % (exchange, command)
+        self.timings[kind].record(key, seconds)
+        with self.lock:
+            count = self.counts[kind].setdefault(key, [0, 0])
+            count[0] += 1
+            count[1] += bool(error)
+
+            if kind == 'upstream':
+                now = self.clock()
+                recent = self.recent.setdefault(exchange, deque())
+                recent.append((now, seconds, bool(error)))
+                while recent and recent[0][0] < now - self.window:
+                    recent.popleft()
+                if error:
+                    self.last_error[exchange] = (now, str(error))
+
+    def hedge(self, exchange, command, sent, won):
+        """
+        :param exchange: str: Exchange name
+        :param command: str: Api command
+        :param sent: int: Hedge calls sent
+        :param won: bool: Whether a hedge call replied first
+        """
+        if not sent:
+            return
+        with self.lock:
+            count = self.hedges.setdefault('%s %s' % (exchange, command), [0, 0])
+            count[0] += sent
+            count[1] += bool(won)
+
+    def hedge_summary(self):
+        """
+        :return: OrderedDict: hedge calls sent and won by exchange and command
+        """
+        with self.lock:
+            return OrderedDict((key, OrderedDict([('sent', sent), ('won', won)]))
+                               for key, (sent, won) in self.hedges.items())
+
+    def summary(self, kind):
+        """
+        :param kind: str: requests or upstream
+        :return: OrderedDict: count, errors and latency percentiles in ms by exchange and command
+        """
+        latency = self.timings[kind].summary((50, 90, 99, 100))
+        with self.lock:
+            counts = OrderedDict((key, list(count)) for key, count in self.counts[kind].items())
+        return OrderedDict((key, OrderedDict([('count', count), ('errors', errors)] +
+                                             [(q, value) for q, value in latency.get(key, {}).items()]))
+                           for key, (count, errors) in counts.items())
+
+    def health(self):
+        """
+        Exchange health from upstream calls in window. Exchanges with no recent calls are ok.
+        :return: OrderedDict: status, and calls, error rate, median latency in ms and last error by exchange
+        """
+        now = self.clock()
+        exchanges = OrderedDict()
+        with self.lock:
+            for exchange, recent in self.recent.items():
+                recent = [call for call in recent if call[0] >= now - self.window]
+                errors = sum(call[2] for call in recent)
+                error_rate = errors / len(recent) if recent else 0.0
+                latency = float(np.median([call[1] for call in recent])) if recent else 0.0
+
+                if recent and errors == len(recent) and len(recent) >= self.min_calls:
+                    status = 'down'
+                elif error_rate > self.max_error_rate or latency > self.max_latency:
+                    status = 'degraded'
+                else:
+                    status = 'ok'
+
+                last_error = self.last_error.get(exchange)
+                exchanges[exchange] = {'status': status,
+                                       'calls': len(recent),
+                                       'error_rate': error_rate,
+                                       'latency_ms': 1000 * latency,
+                                       'last_error': {'time': last_error[0], 'error': last_error[1]}
+                                       if last_error else None}
+
+        status = max([item['status'] for item in exchanges.values()] + ['ok'], key=HEALTH.index)
+        return OrderedDict([('status', status), ('uptime', now - self.started), ('exchanges', exchanges)])
+
 
 ## Feed daemon
+# Commands the broker answers itself, so they get a reply while all workers are busy
+INLINE_COMMANDS = ['health', 'metrics']
+
+# Idempotent reads sent again upstream when slow, see FeedDaemon hedge_after
+HEDGED_COMMANDS = ['returnTicker', 'returnChartData', 'returnChartArray']
+
+# Request lanes, highest priority first. Commands not listed go to the account lane.
+LANES = ['trade', 'account', 'market']
+COMMAND_LANES = {'buy': 'trade',
+                 'sell': 'trade',
+                 'returnBalances': 'account',
+                 'returnFeeInfo': 'account',
+                 'returnTradeHistory': 'account',
+                 'returnDepositsWithdrawals': 'account',
+                 'returnTicker': 'market',
+                 'returnCurrencies': 'market',
+                 'returnChartData': 'market',
+                 'returnChartDataMulti': 'market'}
+
+
+def circuit_endpoint(func, args, kwargs):
+    """
+    Circuit breaker key of a client call, so one failing pair does not open the method for all pairs
+    :param func: Client method
+    :param args: tuple: Call arguments, self first
+    :param kwargs: dict: Call keyword arguments
+    :return: str: Method name, followed by the pair for single pair calls
+    """
+    pair = kwargs.get('currencyPair')
+    if pair is None and len(args) > 1 and func.__code__.co_varnames[1:2] == ('currencyPair',):
+        pair = args[1]
+    return func.__name__ if pair in (None, 'all') else '%s %s' % (func.__name__, pair)
+
+
+def candle_topic(exchange, pair, period):
+    """
+    Candle broadcast topic. Subscriptions match by prefix, so the trailing space keeps periods apart.
+    :return: bytes
+    """
+    return ('candle %s %s %d ' % (exchange, pair, int(period))).encode()
+
+
 # Server
 class FeedDaemon(Process):
     """
     Data Feed server
     """
-    def __init__(self, api={}, addr='ipc:///tmp/feed.ipc', n_workers=8, email={}):
+    def __init__(self, api={}, addr='ipc:///tmp/feed.ipc', n_workers=8, email={}, cache=True, cache_ttl=None,
+                 min_workers=2, idle_timeout=30, pub_addr=None, poll_offset=1.0, health=None, hedge_after=None,
+                 hedge_commands=HEDGED_COMMANDS):
         """
 
         :param api: dict: exchange name: api instance
         :param addr: str: client side address
-        :param n_workers: int: n threads
+        :param n_workers: int: max threads
+        :param cache: bool: Cache public command replies and coalesce identical requests
+        :param cache_ttl: dict: command: ttl in seconds. See PUBLIC_TTL
+        :param min_workers: int: threads kept alive when idle
+        :param idle_timeout: float: seconds before an idle thread above min_workers exits
+        :param pub_addr: str: candle broadcast address. None disables subscriptions
+        :param poll_offset: float: seconds after bar open to poll subscribed candles
+        :param health: dict: FeedMetrics health thresholds
+        :param hedge_after: float: seconds before a slow upstream call of hedge_commands is sent again.
+        The first reply wins. None disables hedging
+        :param hedge_commands: list: idempotent commands to hedge
         """
         super(FeedDaemon, self).__init__()
         self.api = api
         self.email = email
         self.context = zmq.Context()
         self.n_workers = n_workers
+        self.min_workers = max(1, min(min_workers, n_workers))
+        self.idle_timeout = idle_timeout
         self.addr = addr
+        self.cache = ResponseCache(cache_ttl) if cache else None
+
+        # Upstream calls of batch commands run in parallel
+        self.batch_pool = ThreadPoolExecutor(max_workers=n_workers)
+
+        # Hedged upstream calls. Under the cache, so coalesced requests share the hedge
+        self.hedge_after = hedge_after
+        self.hedge_commands = hedge_commands
+        self.hedge_pool = ThreadPoolExecutor(max_workers=2 * n_workers) if hedge_after is not None else None
+
+        # One keep-alive connection per worker thread
+        for exchange in self.api.values():
+            if hasattr(exchange, 'resizePool'):
+                exchange.resizePool(n_workers)
+
+        # Lane queues and pool state, shared by the broker and worker threads
+        self.lanes = OrderedDict((lane, deque()) for lane in LANES)
+        self.lane_lock = threading.Condition()
+        self.workers = 0
+        self.idle = 0
+        self.busy = OrderedDict((lane, 0) for lane in LANES)
+        self.served = OrderedDict((lane, 0) for lane in LANES)
+        self.max_depth = OrderedDict((lane, 0) for lane in LANES)
+        self.timings = Timings()
+
+        # Request and upstream call metrics
+        self.metrics = FeedMetrics(**(health or {}))
+
+        # Candle broadcast. One poller thread per subscribed exchange, pair and period
+        self.pub_addr = pub_addr
+        self.poll_offset = poll_offset
+        self.subscriptions = {}
+        self.sub_lock = threading.Lock()
 
         self.MINUTE, self.HOUR, self.DAY = 60, 60 * 60, 60 * 60 * 24
         self.WEEK, self.MONTH = self.DAY * 7, self.DAY * 30
@@ -92,6 +743,23 @@ class FeedDaemon(Process):
             return req[0], req[1]
 
         else:
+            # Candle broadcast subscription
+            if req[1] == 'subscribe':
+                return req[0], req[1], {'currencyPair': str(req[2]).upper(), 'period': str(req[3])}
+
+            # Candle data for several pairs, comma separated
+            if req[1] == 'returnChartDataMulti':
+
+                if req[4] == 'None':
+                    req[4] = datetime.utcnow().timestamp() - self.DAY
+                if req[5] == 'None':
+                    req[5] = datetime.utcnow().timestamp()
+
+                return req[0], req[1], {'currencyPairs': [pair.upper() for pair in req[2].split(',') if pair],
+                                        'period': str(req[3]),
+                                        'start': str(req[4]),
+                                        'end': str(req[5])}
+
             # Candle data
             if req[1] == 'returnChartData':
 
@@ -149,46 +817,435 @@ class FeedDaemon(Process):
                 return req[0], req[1], args
 
 
-    def worker(self):
-        # Init socket
-        sock = self.context.socket(zmq.REP)
-        sock.connect("inproc://workers.inproc")
+    def public_call(self, call):
+        """
+        Public call through the response cache, if enabled
+        :param call: tuple: exchange, command[, args]
+        :return: api reply, or error message str
+        """
+        if self.cache:
+            return self.cache.get(call, self.call_api)
+        return self.call_api(call)
 
-        while True:
-            try:
-                # Wait for request
-                req = sock.recv_string()
+    def pair_chart(self, exchange, command, pair, args):
+        """
+        One pair chart data for a batch. Pairs not listed on the exchange are fetched reversed and inverted.
+        :param exchange: str: Exchange name
+        :param command: str: returnChartData for exact records, returnChartArray for a float record array
+        :param pair: str: Pair symbol
+        :param args: dict: period, start and end
+        :return: pandas DataFrame or numpy record array, indexed or sorted by date. Error message str on failure
+        """
+        call_args = dict(args, currencyPair=pair)
+        call_args.pop('currencyPairs', None)
+        rep = self.public_call((exchange, command, call_args))
 
-                Logger.info(FeedDaemon.worker, req)
+        inverted = isinstance(rep, str) and 'Invalid currency pair.' in rep
+        if inverted:
+            call_args['currencyPair'] = '_'.join(pair.split('_')[::-1])
+            rep = self.public_call((exchange, command, call_args))
 
-                # Handle request
-                call = self.handle_req(req)
+        if isinstance(rep, str):
+            return rep
+        if inverted:
+            rep = pair_reciprocal(rep)
+        if isinstance(rep, np.ndarray):
+            return rep
+        return pd.DataFrame.from_records(rep).set_index('date', drop=True)
 
-                # Send request to api
-                if call:
-                    try:
-                        self.api[call[0]].nonce = self.nonce
-                        rep = self.api[call[0]].__call__(*call[1:])
-                    except ExchangeError as e:
-                        rep = e.__str__()
-                        Logger.error(FeedDaemon.worker, "Exchange error: %s\n%s" % (req, rep))
+    def chart_multi(self, call, encoding=False):
+        """
+        Chart data for several pairs, fetched in parallel through the response cache and aligned on
+        the candles all pairs have. Reply columns are named '<pair> <field>', see multi_columns.
+        :param call: tuple: exchange, returnChartDataMulti, args
+        :param encoding: str: float for a float64 record array, if the exchange api can decode to it
+        :return: list: Candle records with exact numbers, or numpy record array. Error message str on failure
+        """
+        exchange, args = call[0], call[2]
+        pairs = args['currencyPairs']
+        if not pairs:
+            return "No currency pairs."
+
+        command = 'returnChartData'
+        if encoding == 'float' and hasattr(self.api.get(exchange), FLOAT_METHODS[command]):
+            command = FLOAT_METHODS[command]
+
+        futures = [self.batch_pool.submit(self.pair_chart, exchange, command, pair, args) for pair in pairs]
+        reps = [future.result() for future in futures]
+        for pair, rep in zip(pairs, reps):
+            if isinstance(rep, str):
+                return "%s: %s" % (pair, rep)
+
+        if command == 'returnChartData':
+            dates = reps[0].index
+            for rep in reps[1:]:
+                dates = dates.intersection(rep.index)
+            df = pd.concat([rep.loc[dates].rename(columns=lambda col, pair=pair: '%s %s' % (pair, col))
+                            for pair, rep in zip(pairs, reps)], axis=1)
+            df.insert(0, 'date', dates.astype(np.int64))
+            return df.to_dict('records')
+
+        # Float arrays, one field per pair and column
+        dates = reps[0]['date']
+        for rep in reps[1:]:
+            dates = np.intersect1d(dates, rep['date'])
+        fields = [name for name in reps[0].dtype.names if name != 'date']
+        out = np.empty(dates.shape[0], dtype=[('date', np.int64)] + [('%s %s' % (pair, field), np.float64)
+                                                                      for pair in pairs for field in fields])
+        out['date'] = dates
+        for pair, rep in zip(pairs, reps):
+            rep = rep[np.isin(rep['date'], dates)]
+            for field in fields:
+                out['%s %s' % (pair, field)] = rep[field]
+        return out
+
+    def subscribe(self, exchange, pair, period):
+        """
+        Start broadcasting a pair candles. Pairs not listed on the exchange are polled reversed.
+        :param exchange: str: Exchange name
+        :param pair: str: Pair symbol
+        :param period: int: Candle period in seconds
+        :return: dict: Upstream pair, reciprocal flag, topic and broadcast address. Error message str on failure
+        """
+        if not self.pub_addr:
+            return "Candle broadcast is disabled."
+
+        now = time()
+        for upstream, reciprocal in [(pair, False), ('_'.join(pair.split('_')[::-1]), True)]:
+            rep = self.public_call((exchange, 'returnChartData', {'currencyPair': upstream, 'period': str(period),
+                                                                  'start': str(now - 2 * period), 'end': str(now)}))
+            if not isinstance(rep, str):
+                break
+        else:
+            return rep
 
-                    except DataFeedException as e:
-                        rep = e.__str__()
-                        Logger.error(FeedDaemon.worker,  "DataFeedException: %s\n%s" % (req, rep))
+        key = (exchange, upstream, period)
+        with self.sub_lock:
+            if key not in self.subscriptions:
+                self.subscriptions[key] = threading.Thread(target=self.poller, args=key, daemon=True)
+                self.subscriptions[key].start()
 
-                    if debug:
-                        Logger.debug(FeedDaemon.worker, "Debug: %s" % req)
+        return {'pair': upstream,
+                'reciprocal': reciprocal,
+                'topic': candle_topic(exchange, upstream, period).decode(),
+                'pub_addr': self.pub_addr}
 
-                    # send reply back to client
-                    sock.send_json(rep)
-                else:
-                    raise TypeError("Bad call format.")
+    def poller(self, exchange, pair, period, retries=5):
+        """
+        Publish each closed candle and a fresh ticker once per bar
+        :param exchange: str: Exchange name
+        :param pair: str: Upstream pair symbol
+        :param period: int: Candle period in seconds
+        :param retries: int: Polls per bar while the closed candle is not out yet
+        """
+        sock = self.context.socket(zmq.PUSH)
+        sock.connect("inproc://publish.inproc")
+        scheduler = BarScheduler(period / 60, offset=self.poll_offset)
+        scheduler.start()
+
+        try:
+            while True:
+                trigger = scheduler.wait()
+                if trigger is None:
+                    break
+
+                try:
+                    closed = int(trigger[0]) - period
+                    call = (exchange, 'returnChartData', {'currencyPair': pair, 'period': str(period),
+                                                          'start': str(closed), 'end': str(closed)})
+                    candle = None
+                    for i in range(retries):
+                        rep = self.public_call(call) if i == 0 else self.call_api(call)
+                        if isinstance(rep, list):
+                            candle = next((item for item in rep if int(item['date']) == closed), None)
+                        if candle:
+                            break
+                        sleep(self.poll_offset)
+
+                    if candle is None:
+                        Logger.error(FeedDaemon.poller, "No %s %d candle for %d" % (pair, period, closed))
+                        continue
+
+                    ticker = self.public_call((exchange, 'returnTicker'))
+                    sock.send_multipart([candle_topic(exchange, pair, period),
+                                         msgpack.packb({'v': PROTOCOL_VERSION,
+                                                        'exchange': exchange,
+                                                        'pair': pair,
+                                                        'period': period,
+                                                        'candle': candle,
+                                                        'ticker': ticker if isinstance(ticker, dict) else None},
+                                                       use_bin_type=True)])
+                except Exception as e:
+                    Logger.error(FeedDaemon.poller, e)
+        finally:
+            sock.close()
+
+    def call_api(self, call):
+        """
+        Send a call to the exchange api
+        :param call: tuple: exchange, command[, args]
+        :return: api reply, or error message str
+        """
+        api = self.api[call[0]]
+
+        def fetch():
+            if call[1] in FLOAT_METHODS.values():
+                return getattr(api, call[1])(**call[2])
+            # Hedge calls get their own args, the api adds to them
+            return api.__call__(call[1], *[dict(args) for args in call[2:]])
+
+        t0 = perf_counter()
+        try:
+            api.nonce = self.nonce
+            if self.hedge_pool and call[1] in self.hedge_commands:
+                rep, index, sent = hedged(self.hedge_pool, fetch, self.hedge_after)
+                self.metrics.hedge(call[0], call[1], sent - 1, index > 0)
+            else:
+                rep = fetch()
+            self.metrics.record('upstream', call[0], call[1], perf_counter() - t0)
+            return rep
+
+        # Exchange errors are replies. Only some of them tell the exchange is in trouble
+        except ExchangeError as e:
+            failed = any(error in e.__str__().lower() for error in UPSTREAM_ERRORS)
+            self.metrics.record('upstream', call[0], call[1], perf_counter() - t0, failed and e)
+            Logger.error(FeedDaemon.worker, "Exchange error: %s\n%s" % (str(call), e.__str__()))
+            return e.__str__()
 
+        except DataFeedException as e:
+            self.metrics.record('upstream', call[0], call[1], perf_counter() - t0, e)
+            Logger.error(FeedDaemon.worker, "DataFeedException: %s\n%s" % (str(call), e.__str__()))
+            return e.__str__()
+
+        except Exception as e:
+            self.metrics.record('upstream', call[0], call[1], perf_counter() - t0, e)
+            raise e
+
+    def command(self, frames):
+        """
+        Request command
+        :param frames: list: Request message frames
+        :return: str: command name. None on bad requests
+        """
+        try:
+            if frames[0] == PROTOCOL:
+                return unpack_request(frames)['command']
+            return frames[0].decode().split(' ')[1]
+        except Exception:
+            return None
+
+    def lane(self, frames):
+        """
+        Request priority lane
+        :param frames: list: Request message frames
+        :return: str: lane name
+        """
+        # Bad requests get their error reply from a worker
+        return COMMAND_LANES.get(self.command(frames), 'account')
+
+    def health(self):
+        """
+        Daemon health
+        :return: OrderedDict: status, uptime, exchange health and worker pool saturation
+        """
+        health = self.metrics.health()
+        with self.lane_lock:
+            depth = sum(len(queue) for queue in self.lanes.values())
+            health['workers'] = self.workers
+            health['idle'] = self.idle
+            health['queue_depth'] = depth
+            health['saturated'] = bool(depth) and self.idle == 0 and self.workers >= self.n_workers
+        if health['saturated'] and health['status'] == 'ok':
+            health['status'] = 'degraded'
+        return health
+
+    def get_metrics(self):
+        """
+        Machine readable daemon metrics
+        :return: dict: health, request and upstream counters and latencies in ms by exchange and command,
+        hedge counters, worker pool, cache and exchange api retry, circuit breaker and rate limiter stats
+        """
+        exchanges = OrderedDict()
+        for name, api in self.api.items():
+            if hasattr(api, 'stats'):
+                try:
+                    exchanges[name] = api.stats()
+                except Exception as e:
+                    Logger.error(FeedDaemon.get_metrics, e)
+
+        queue_stats = self.queue_stats()
+        queue_stats['utilisation'] = sum(queue_stats['busy'].values()) / self.n_workers
+        return {'health': self.health(),
+                'requests': self.metrics.summary('requests'),
+                'upstream': self.metrics.summary('upstream'),
+                'hedges': self.metrics.hedge_summary(),
+                'workers': queue_stats,
+                'cache': self.cache.stats() if self.cache else {},
+                'exchanges': exchanges}
+
+    def queue_stats(self):
+        """
+        Lane queue metrics
+        :return: dict: depth, max depth, busy and served counts by lane, pool size and wait percentiles in ms
+        """
+        with self.lane_lock:
+            stats = {'depth': OrderedDict((lane, len(queue)) for lane, queue in self.lanes.items()),
+                     'max_depth': OrderedDict(self.max_depth),
+                     'busy': OrderedDict(self.busy),
+                     'served': OrderedDict(self.served),
+                     'workers': self.workers,
+                     'idle': self.idle}
+        stats['wait'] = self.timings.summary()
+        return stats
+
+    def enqueue(self, route, frames):
+        """
+        Queue a request on its lane and grow the pool if requests are waiting
+        :param route: list: Reply envelope frames
+        :param frames: list: Request frames
+        """
+        lane = self.lane(frames)
+        with self.lane_lock:
+            self.lanes[lane].append((route, frames, perf_counter()))
+            depth = sum(len(queue) for queue in self.lanes.values())
+            self.max_depth[lane] = max(self.max_depth[lane], len(self.lanes[lane]))
+
+            if depth > self.idle and self.workers < self.n_workers:
+                self.start_worker()
+            self.lane_lock.notify()
+
+    def start_worker(self):
+        """ Must hold lane_lock """
+        self.workers += 1
+        self.idle += 1
+        thread = threading.Thread(target=self.worker, args=(), daemon=True)
+        thread.start()
+
+    def next_task(self):
+        """
+        Wait for the next request. Trading requests go first, and market data is not taken while
+        a trading request waits or when it would leave no thread free for trading.
+        :return: tuple: lane, route, frames, enqueue time. None if the thread should exit
+        """
+        with self.lane_lock:
+            while True:
+                for lane, queue in self.lanes.items():
+                    if not queue:
+                        continue
+                    if lane == 'market' and (self.lanes['trade'] or
+                                             self.busy['market'] >= max(1, self.n_workers - 1)):
+                        continue
+                    self.busy[lane] += 1
+                    self.idle -= 1
+                    return (lane,) + queue.popleft()
+
+                if not self.lane_lock.wait(self.idle_timeout) and self.workers > self.min_workers:
+                    self.workers -= 1
+                    self.idle -= 1
+                    return None
+
+    def process(self, frames):
+        """
+        Serve one request
+        :param frames: list: Request frames
+        :return: list: Reply frames
+        """
+        # Binary protocol requests map to the same call string
+        encoding = False
+        if frames[0] == PROTOCOL:
+            try:
+                envelope = unpack_request(frames)
+            except DataFeedException as e:
+                Logger.error(FeedDaemon.worker, e)
+                return pack_reply(e.__str__())
+
+            encoding = envelope['encoding']
+            req = ' '.join([envelope['exchange'], envelope['command']] + envelope['args'])
+        else:
+            req = frames[0].decode()
+
+        Logger.info(FeedDaemon.worker, req)
+
+        # Handle request
+        call = self.handle_req(req)
+
+        # Float requests skip the exact decimal decoding, if the exchange api can
+        if call and encoding == 'float' and call[1] in FLOAT_METHODS and \
+                hasattr(self.api.get(call[0]), FLOAT_METHODS[call[1]]):
+            call = (call[0], FLOAT_METHODS[call[1]]) + tuple(call[2:])
+
+        # Send request to api
+        if call:
+            t0 = perf_counter()
+            try:
+                rep = self.dispatch(call, encoding)
             except Exception as e:
-                send_email(self.email, "FeedDaemon Error", e)
-                sock.close()
+                self.metrics.record('requests', call[0], call[1], perf_counter() - t0, e)
                 raise e
+            self.metrics.record('requests', call[0], call[1], perf_counter() - t0, isinstance(rep, str) and rep)
+
+            if debug:
+                Logger.debug(FeedDaemon.worker, "Debug: %s" % req)
+
+        else:
+            rep = "Bad call format."
+            Logger.error(FeedDaemon.worker, "%s: %s" % (rep, req))
+
+        # Reply in the request protocol
+        if encoding is False:
+            return [json.dumps(rep).encode()]
+        return pack_reply(rep, encoding)
+
+    def dispatch(self, call, encoding=False):
+        """
+        Daemon commands are served here, the rest go to the exchange api
+        :param call: tuple: exchange, command[, args]
+        :param encoding: Request encoding
+        :return: reply, or error message str
+        """
+        if call[1] == 'cacheStats':
+            return self.cache.stats() if self.cache else {}
+        elif call[1] == 'health':
+            return self.health()
+        elif call[1] == 'metrics':
+            return self.get_metrics()
+        elif call[1] == 'queueStats':
+            return self.queue_stats()
+        elif call[1] == 'subscribe':
+            return self.subscribe(call[0], call[2]['currencyPair'], int(call[2]['period']))
+        elif call[1] == 'returnChartDataMulti':
+            return self.chart_multi(call, encoding)
+        return self.public_call(call)
+
+    def worker(self):
+        # Replies go back through the broker
+        sock = self.context.socket(zmq.PUSH)
+        sock.connect("inproc://replies.inproc")
+
+        try:
+            while True:
+                task = self.next_task()
+                if task is None:
+                    break
+
+                lane, route, frames, t0 = task
+                self.timings.record(lane, perf_counter() - t0)
+                try:
+                    reply = self.process(frames)
+                except Exception as e:
+                    Logger.error(FeedDaemon.worker, e)
+                    send_email(self.email, "FeedDaemon Error", e)
+                    reply = pack_reply(e.__str__()) if frames[0] == PROTOCOL else [json.dumps(e.__str__()).encode()]
+                finally:
+                    with self.lane_lock:
+                        self.busy[lane] -= 1
+                        self.idle += 1
+                        self.served[lane] += 1
+                        self.lane_lock.notify()
+
+                sock.send_multipart(route + reply, copy=False)
+        finally:
+            sock.close()
 
     def run(self):
         try:
@@ -198,22 +1255,53 @@ class FeedDaemon(Process):
             clients = self.context.socket(zmq.ROUTER)
             clients.bind(self.addr)
 
-            # Socket to talk to workers
-            workers = self.context.socket(zmq.DEALER)
-            workers.bind("inproc://workers.inproc")
+            # Socket to get replies from workers
+            replies = self.context.socket(zmq.PULL)
+            replies.bind("inproc://replies.inproc")
 
-            # Launch pool of worker threads
-            for i in range(self.n_workers):
-                thread = threading.Thread(target=self.worker, args=())
-                thread.start()
+            # Candle broadcast, fed by poller threads
+            publish = self.context.socket(zmq.PULL)
+            publish.bind("inproc://publish.inproc")
+            if self.pub_addr:
+                pub = self.context.socket(zmq.PUB)
+                pub.bind(self.pub_addr)
+
+            # Launch pool of worker threads. It grows up to n_workers with the queue depth
+            with self.lane_lock:
+                for i in range(self.min_workers):
+                    self.start_worker()
 
             Logger.info(FeedDaemon.run, "Feed Daemon running. Serving on %s" % self.addr)
 
-            zmq.proxy(clients, workers)
+            poller = zmq.Poller()
+            poller.register(clients, zmq.POLLIN)
+            poller.register(replies, zmq.POLLIN)
+            poller.register(publish, zmq.POLLIN)
+
+            while True:
+                socks = dict(poller.poll())
+
+                if socks.get(publish) == zmq.POLLIN:
+                    pub.send_multipart(publish.recv_multipart(copy=False), copy=False)
+
+                if socks.get(replies) == zmq.POLLIN:
+                    clients.send_multipart(replies.recv_multipart(copy=False), copy=False)
+
+                if socks.get(clients) == zmq.POLLIN:
+                    # Client identity and request id frames, up to the empty delimiter, route the reply back
+                    msg = clients.recv_multipart()
+                    split = msg.index(b'') + 1 if b'' in msg else 1
+                    if msg[split:] and self.command(msg[split:]) in INLINE_COMMANDS:
+                        clients.send_multipart(msg[:split] + self.process(msg[split:]))
+                    elif msg[split:]:
+                        self.enqueue(msg[:split], msg[split:])
 
         except KeyboardInterrupt:
             clients.close()
-            workers.close()
+            replies.close()
+            publish.close()
+            if self.pub_addr:
+                pub.close()
             self.context.term()
 
 # Client
@@ -224,7 +1312,7 @@ class DataFeed(ExchangeConnection):
     # TODO WRITE TESTS
     retryDelays = [2 ** i for i in range(8)]
 
-    def __init__(self, exchange='', addr='ipc:///tmp/feed.ipc', timeout=30):
+    def __init__(self, exchange='', addr='ipc:///tmp/feed.ipc', timeout=30, binary=True, breaker=None):
         """
 
         :param period: int: Data sampling period
@@ -232,6 +1320,9 @@ class DataFeed(ExchangeConnection):
         :param exchange: str: FeedDaemon exchange to query
         :param addr: str: Client socked address
         :param timeout: int:
+        :param binary: bool: Use the binary protocol. Otherwise, string requests and json replies
+        :param breaker: dict: CircuitBreaker settings for the retry path. On by default, False disables it.
+        Circuits are kept per method and currencyPair. Trade methods always get the full retry
         """
         super(DataFeed, self).__init__()
 
@@ -240,15 +1331,50 @@ class DataFeed(ExchangeConnection):
         self.addr = addr
         self.exchange = exchange
         self.timeout = timeout * 1000
+        self.binary = binary
 
-        self.sock = self.context.socket(zmq.REQ)
-        self.sock.connect(addr)
+        # Methods and pairs failing in a row stop retrying and fail fast for a while
+        self.breaker = CircuitBreaker(**(breaker or {})) if breaker is not False else None
 
-        self.poll = zmq.Poller()
-        self.poll.register(self.sock, zmq.POLLIN)
+        # REQ sockets are not thread safe, so each thread gets its own
+        self._local = threading.local()
+        self._socks = []
+        self.connect()
 
     def __del__(self):
-        self.sock.close()
+        for sock in self._socks:
+            sock.close()
+
+    def connect(self):
+        self.sock
+
+    @property
+    def sock(self):
+        if not hasattr(self._local, 'sock'):
+            self._local.sock = self.context.socket(zmq.REQ)
+            self._socks.append(self._local.sock)
+            self._local.poll = zmq.Poller()
+            self._local.poll.register(self._local.sock, zmq.POLLIN)
+            self._local.sock.connect(self.addr)
+        return self._local.sock
+
+    @sock.setter
+    def sock(self, value):
+        # Reconnected sockets take the place of the closed one, so the list does not grow
+        old = getattr(self._local, 'sock', None)
+        self._local.sock = value
+        for i, sock in enumerate(self._socks):
+            if sock is old:
+                self._socks[i] = value
+                break
+        else:
+            self._socks.append(value)
+
+    @property
+    def poll(self):
+        if not hasattr(self._local, 'poll'):
+            self.sock
+        return self._local.poll
 
     # Retry decorator
     def retry(func):
@@ -256,18 +1382,38 @@ class DataFeed(ExchangeConnection):
 
         @_wraps(func)
         def retrying(*args, **kwargs):
+            # Orders keep the full retry
+            breaker = getattr(args[0], 'breaker', None) if args and COMMAND_LANES.get(func.__name__) != 'trade' \
+                else None
+            endpoint = circuit_endpoint(func, args, kwargs)
             problems = []
             for delay in _chain(DataFeed.retryDelays, [None]):
+                # fail fast if method is known to be down
+                if breaker:
+                    breaker.check(endpoint)
+
                 try:
                     # attempt call
-                    return func(*args, **kwargs)
+                    rep = func(*args, **kwargs)
+                    if breaker:
+                        breaker.success(endpoint)
+                    return rep
+
+                # open circuits are not retried
+                except CircuitOpenException as e:
+                    raise e
 
                 # we need to try again
                 except DataFeedException as problem:
                     problems.append(problem)
+                    opened = breaker.failure(endpoint, problem) if breaker else False
                     if delay is None:
                         Logger.debug(DataFeed, problems)
                         raise MaxRetriesException('retryDelays exhausted ' + str(problem))
+                    elif opened:
+                        Logger.debug(DataFeed, problems)
+                        raise CircuitOpenException("%s circuit open after %d failures: %s" %
+                                                   (endpoint, len(problems), str(problem)))
                     else:
                         # log exception and wait
                         Logger.debug(DataFeed, problem)
@@ -276,13 +1422,22 @@ class DataFeed(ExchangeConnection):
 
         return retrying
 
-    def get_response(self, req):
-
+    def get_response(self, req, frame=False):
+        """
+        :param req: str: Command and arguments, space separated
+        :param frame: bool: Return chart data as DataFrame. Binary protocol only
+        :return: Api reply
+        """
         req = self.exchange + ' ' + req
 
         # Send request
         try:
-            self.sock.send_string(req)
+            if self.binary:
+                req = req.split(' ')
+                self.sock.send_multipart(pack_request(req[0], req[1], req[2:], 'float' if frame else None))
+                req = ' '.join(req)
+            else:
+                self.sock.send_string(req)
         except zmq.ZMQError as e:
             if 'Operation cannot be accomplished in current state' == e.__str__():
                 # If request timeout, restart socket
@@ -303,6 +1458,8 @@ class DataFeed(ExchangeConnection):
         socks = dict(self.poll.poll(self.timeout))
         if socks.get(self.sock) == zmq.POLLIN:
             # If response, return
+            if self.binary:
+                return unpack_reply(self.sock.recv_multipart(copy=False), frame)
             return self.sock.recv_json()
 
         else:
@@ -330,6 +1487,70 @@ class DataFeed(ExchangeConnection):
         except AssertionError:
             raise UnexpectedResponseException("Unexpected response from DataFeed.returnTicker")
 
+    def stats(self):
+        """
+        Client side retry path stats
+        :return: dict: circuit breaker state by method
+        """
+        return {'breaker': self.breaker.stats() if self.breaker else {}}
+
+    @retry
+    def cacheStats(self):
+        """
+        Return FeedDaemon response cache counters
+        :return: dict: hits, misses, coalesced, size and hit rate
+        """
+        try:
+            rep = self.get_response('cacheStats')
+            assert isinstance(rep, dict)
+            return rep
+
+        except AssertionError:
+            raise UnexpectedResponseException("Unexpected response from DataFeed.cacheStats")
+
+    @retry
+    def health(self):
+        """
+        Return FeedDaemon health. Answered even when all daemon workers are busy.
+        :return: dict: status (ok, degraded or down), uptime, exchange health and worker pool saturation
+        """
+        try:
+            rep = self.get_response('health')
+            assert isinstance(rep, dict)
+            return rep
+
+        except AssertionError:
+            raise UnexpectedResponseException("Unexpected response from DataFeed.health")
+
+    @retry
+    def metrics(self):
+        """
+        Return FeedDaemon metrics
+        :return: dict: health, request and upstream counters and latencies in ms by exchange and command,
+        worker pool, cache and exchange api retry and rate limiter stats
+        """
+        try:
+            rep = self.get_response('metrics')
+            assert isinstance(rep, dict)
+            return rep
+
+        except AssertionError:
+            raise UnexpectedResponseException("Unexpected response from DataFeed.metrics")
+
+    @retry
+    def queueStats(self):
+        """
+        Return FeedDaemon lane queue metrics
+        :return: dict: depth, max depth, busy and served counts by lane, pool size and wait percentiles in ms
+        """
+        try:
+            rep = self.get_response('queueStats')
+            assert isinstance(rep, dict)
+            return rep
+
+        except AssertionError:
+            raise UnexpectedResponseException("Unexpected response from DataFeed.queueStats")
+
     @retry
     def returnBalances(self):
         """
@@ -399,9 +1620,9 @@ class DataFeed(ExchangeConnection):
                                                             str(start),
                                                             str(end))
 
-                    rep =  json.loads(
-                        self.pair_reciprocal(pd.DataFrame.from_records(self.get_response(call))).to_json(
-                            orient='records'))
+                    rep = self.get_response(call)
+                    if isinstance(rep, list):
+                        rep = self.pair_reciprocal(rep)
                 except Exception as e:
                     raise e
 
@@ -414,6 +1635,108 @@ class DataFeed(ExchangeConnection):
         except AssertionError:
             raise UnexpectedResponseException("Unexpected response from DataFeed.returnChartData")
 
+    @retry
+    def returnChartFrame(self, currencyPair, period, start=None, end=None):
+        """
+        Return pair OHLC data as DataFrame. Numbers are float64, built straight from the reply arrays.
+        :param currencyPair: str: Desired pair str
+        :param period: int: Candle period. Must be in [300, 900, 1800, 7200, 14400, 86400]
+        :param start: str: UNIX timestamp to start from
+        :param end:  str: UNIX timestamp to end returned data
+        :return: pandas DataFrame: Chart data
+        """
+        if not self.binary:
+            return pd.DataFrame.from_records(self.returnChartData(currencyPair, period, start, end))
+
+        try:
+            call = "returnChartData %s %s %s %s" % (str(currencyPair),
+                                                    str(period),
+                                                    str(start),
+                                                    str(end))
+            rep = self.get_response(call, frame=True)
+
+            if isinstance(rep, str) and 'Invalid currency pair.' in rep:
+                symbols = currencyPair.split('_')
+                pair = symbols[1] + '_' + symbols[0]
+
+                call = "returnChartData %s %s %s %s" % (str(pair),
+                                                        str(period),
+                                                        str(start),
+                                                        str(end))
+
+                rep = self.pair_reciprocal(self.get_response(call, frame=True))
+
+            assert isinstance(rep, pd.DataFrame), "returnChartData reply is not DataFrame"
+            assert int(rep['date'].iat[-1]), "Bad returnChartData reply data"
+            assert float(rep['open'].iat[-1]), "Bad returnChartData reply data"
+            assert float(rep['close'].iat[-1]), "Bad returnChartData reply data"
+            return rep
+
+        except AssertionError:
+            raise UnexpectedResponseException("Unexpected response from DataFeed.returnChartFrame")
+
+    @retry
+    def returnChartDataMulti(self, currencyPairs, period, start=None, end=None):
+        """
+        Return OHLC data for several pairs in one request, on the same dates.
+        Reversed pairs are inverted by the daemon.
+        :param currencyPairs: list: Desired pairs str
+        :param period: int: Candle period. Must be in [300, 900, 1800, 7200, 14400, 86400]
+        :param start: str: UNIX timestamp to start from
+        :param end:  str: UNIX timestamp to end returned data
+        :return: OrderedDict: pair: list of candles in "records" format
+        """
+        try:
+            call = "returnChartDataMulti %s %s %s %s" % (','.join(currencyPairs),
+                                                         str(period),
+                                                         str(start),
+                                                         str(end))
+            rep = self.get_response(call)
+
+            assert isinstance(rep, list), "returnChartDataMulti reply is not list: %s" % str(rep)
+            assert rep, "Empty returnChartDataMulti reply"
+
+            data = OrderedDict((pair, [{'date': candle['date']} for candle in rep]) for pair in currencyPairs)
+            for name in rep[0]:
+                pair, field = multi_columns(name)
+                if pair:
+                    for candle, record in zip(data[pair], rep):
+                        candle[field] = record[name]
+            return data
+
+        except AssertionError:
+            raise UnexpectedResponseException("Unexpected response from DataFeed.returnChartDataMulti")
+
+    @retry
+    def returnChartFrameMulti(self, currencyPairs, period, start=None, end=None):
+        """
+        Return OHLC data for several pairs in one request, as one float64 DataFrame.
+        :param currencyPairs: list: Desired pairs str
+        :param period: int: Candle period. Must be in [300, 900, 1800, 7200, 14400, 86400]
+        :param start: str: UNIX timestamp to start from
+        :param end:  str: UNIX timestamp to end returned data
+        :return: pandas DataFrame: Indexed by date, with pair and field column levels
+        """
+        try:
+            call = "returnChartDataMulti %s %s %s %s" % (','.join(currencyPairs),
+                                                         str(period),
+                                                         str(start),
+                                                         str(end))
+            if self.binary:
+                rep = self.get_response(call, frame=True)
+            else:
+                rep = self.get_response(call)
+                rep = pd.DataFrame.from_records(rep) if isinstance(rep, list) and rep else rep
+
+            assert isinstance(rep, pd.DataFrame), "returnChartDataMulti reply is not DataFrame: %s" % str(rep)
+
+            df = rep.set_index('date', drop=True).astype(np.float64)
+            df.columns = pd.MultiIndex.from_tuples([multi_columns(name) for name in df.columns])
+            return df
+
+        except AssertionError:
+            raise UnexpectedResponseException("Unexpected response from DataFeed.returnChartFrameMulti")
+
     @retry
     def returnTradeHistory(self, currencyPair='all', start=None, end=None):
         try:
@@ -505,6 +1828,588 @@ class DataFeed(ExchangeConnection):
 
 
 # Test datafeeds
+class PipelinedDataFeed(DataFeed):
+    """
+    DataFeed client with many requests in flight over a single DEALER socket.
+    Replies are matched to requests by id, so a slow request does not hold the others.
+    """
+    def __init__(self, exchange='', addr='ipc:///tmp/feed.ipc', timeout=30, binary=True, max_workers=16,
+                 breaker=None):
+        """
+
+        :param exchange: str: FeedDaemon exchange to query
+        :param addr: str: Client socked address
+        :param timeout: int: Request timeout in seconds
+        :param binary: bool: Use the binary protocol. Otherwise, string requests and json replies
+        :param max_workers: int: Threads running submitted calls
+        :param breaker: dict: CircuitBreaker settings for the retry path. False disables it
+        """
+        self.max_workers = max_workers
+        super(PipelinedDataFeed, self).__init__(exchange=exchange, addr=addr, timeout=timeout, binary=binary,
+                                                breaker=breaker)
+
+    def connect(self):
+        # Requests are queued here and sent by the io thread, the only one touching the socket
+        self._ids = _count()
+        self._outbox = queue.Queue()
+        self._pending = {}
+        self._wake_r, self._wake_w = os.pipe()
+        self.running = True
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        self._dealer = self.context.socket(zmq.DEALER)
+        self._dealer.setsockopt(zmq.LINGER, 0)
+        self._dealer.connect(self.addr)
+        self._socks.append(self._dealer)
+
+        self._io = threading.Thread(target=self.io_loop, name='PipelinedDataFeed io', daemon=True)
+        self._io.start()
+
+    def close(self):
+        """ Stop the io thread and close the socket. Pending requests fail. """
+        if getattr(self, 'running', False):
+            self.running = False
+            os.write(self._wake_w, b'\0')
+            self._io.join()
+            self.executor.shutdown(wait=False)
+            self._dealer.close()
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+
+    def __del__(self):
+        self.close()
+
+    def io_loop(self):
+        poller = zmq.Poller()
+        poller.register(self._dealer, zmq.POLLIN)
+        poller.register(self._wake_r, zmq.POLLIN)
+
+        while self.running:
+            # Sleep until a reply, a new request or the next timeout
+            now = time()
+            deadline = min((item[1] for item in self._pending.values()), default=now + 1)
+            events = dict(poller.poll(max(0, int((deadline - now) * 1000)) + 1))
+
+            # Send queued requests
+            if self._wake_r in events:
+                os.read(self._wake_r, 4096)
+            while True:
+                try:
+                    req_id, frames, future, deadline, frame, req = self._outbox.get_nowait()
+                except queue.Empty:
+                    break
+                if future.set_running_or_notify_cancel():
+                    self._pending[req_id] = (future, deadline, frame, req)
+                    self._dealer.send_multipart([req_id, b''] + frames)
+
+            # Match replies by id. Late replies of timed out requests are dropped
+            while self._dealer in events:
+                try:
+                    msg = self._dealer.recv_multipart(zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    break
+                entry = self._pending.pop(msg[0].bytes, None)
+                if entry:
+                    try:
+                        if self.binary:
+                            entry[0].set_result(unpack_reply(msg[2:], entry[2]))
+                        else:
+                            entry[0].set_result(json.loads(msg[2].bytes.decode()))
+                    except Exception as e:
+                        entry[0].set_exception(e)
+
+            # Expire timed out requests
+            now = time()
+            for req_id in [key for key, item in self._pending.items() if item[1] <= now]:
+                future, _, _, req = self._pending.pop(req_id)
+                Logger.error(PipelinedDataFeed.io_loop, "%s request timeout." % req)
+                future.set_exception(RequestTimeoutException("%s request timedout" % req))
+
+        while not self._outbox.empty():
+            req_id, _, future, deadline, frame, req = self._outbox.get_nowait()
+            if future.set_running_or_notify_cancel():
+                self._pending[req_id] = (future, deadline, frame, req)
+        for future, _, _, req in self._pending.values():
+            future.set_exception(DataFeedException("%s request canceled. Client closed." % req))
+        self._pending.clear()
+
+    def request(self, req, frame=False):
+        """
+        Send a request without waiting for the reply
+        :param req: str: Command and arguments, space separated
+        :param frame: bool: Return chart data as DataFrame. Binary protocol only
+        :return: concurrent.futures.Future: Api reply
+        """
+        if not self.running:
+            raise DataFeedException("PipelinedDataFeed is closed.")
+
+        req = self.exchange + ' ' + req
+        if self.binary:
+            args = req.split(' ')
+            frames = pack_request(args[0], args[1], args[2:], 'float' if frame else None)
+        else:
+            frames = [req.encode()]
+
+        future = Future()
+        self._outbox.put((str(next(self._ids)).encode(), frames, future, time() + self.timeout / 1000, frame, req))
+        os.write(self._wake_w, b'\0')
+        return future
+
+    def get_response(self, req, frame=False):
+        """
+        :param req: str: Command and arguments, space separated
+        :param frame: bool: Return chart data as DataFrame. Binary protocol only
+        :return: Api reply
+        """
+        return self.request(req, frame).result()
+
+    def submit(self, method, *args, **kwargs):
+        """
+        Run a client method in the background. All calls share the same socket.
+        :param method: str: Method name, like returnChartData
+        :return: concurrent.futures.Future: Method return
+        """
+        return self.executor.submit(getattr(self, method), *args, **kwargs)
+
+    async def call(self, method, *args, **kwargs):
+        """
+        Await a client method from asyncio code
+        :param method: str: Method name, like returnChartData
+        :return: Method return
+        """
+        return await asyncio.wrap_future(self.submit(method, *args, **kwargs))
+
+
+class CandleSubscriber(object):
+    """
+    Receives closed candles broadcast by FeedDaemon.
+    Subscribe to all pairs first, then start the listener thread.
+    """
+    def __init__(self, feed, callback, pub_addr=None):
+        """
+
+        :param feed: DataFeed: Client connected to the daemon
+        :param callback: callable: callback(pair, period, candle, ticker), called from the listener thread
+        :param pub_addr: str: Broadcast address to connect to. Defaults to the one the daemon binds
+        """
+        self.feed = feed
+        self.callback = callback
+        self.pub_addr = pub_addr
+        self.topics = {}
+        self.running = False
+        self.thread = None
+
+    def subscribe(self, pair, period):
+        """
+        Ask the daemon to broadcast a pair
+        :param pair: str: Pair symbol
+        :param period: int: Candle period in seconds
+        :return: dict: Subscription info
+        """
+        rep = self.feed.get_response("subscribe %s %d" % (pair, period))
+        if isinstance(rep, str):
+            raise DataFeedException(rep)
+
+        self.topics[rep['topic'].encode()] = (pair, rep['reciprocal'])
+        if self.pub_addr is None:
+            self.pub_addr = rep['pub_addr']
+        return rep
+
+    def start(self):
+        self.running = True
+        ready = threading.Event()
+        self.thread = threading.Thread(target=self.listen, args=(ready,), name='CandleSubscriber', daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def stop(self):
+        self.running = False
+        if self.thread:
+            self.thread.join()
+
+    def listen(self, ready):
+        sock = self.feed.context.socket(zmq.SUB)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.connect(self.pub_addr)
+        for topic in self.topics:
+            sock.setsockopt(zmq.SUBSCRIBE, topic)
+        ready.set()
+
+        try:
+            while self.running:
+                if not sock.poll(100):
+                    continue
+
+                topic, data = sock.recv_multipart()
+                msg = msgpack.unpackb(data, raw=False)
+                if topic not in self.topics or msg.get('v') != PROTOCOL_VERSION:
+                    continue
+
+                pair, reciprocal = self.topics[topic]
+                candle = msg['candle']
+                if reciprocal:
+                    candle = self.feed.pair_reciprocal([candle])[0]
+
+                try:
+                    self.callback(pair, msg['period'], candle, msg['ticker'])
+                except Exception as e:
+                    Logger.error(CandleSubscriber.listen, e)
+        finally:
+            sock.close()
+
+
+## Record and replay
+# Log of exchange calls: a msgpack stream with a header per session, then one record per call.
+# Reply values are packed apart, so each replay gets its own copy.
+LOG_VERSION = 1
+
+# Extension types for values msgpack can not pack
+LOG_DECIMAL, LOG_FRAME, LOG_ARRAY, LOG_TIME = 1, 2, 3, 4
+
+
+def log_default(obj):
+    """
+    msgpack default hook for call log values
+    :param obj: Value msgpack can not pack
+    :return: msgpack.ExtType
+    """
+    if isinstance(obj, Decimal):
+        return msgpack.ExtType(LOG_DECIMAL, str(obj).encode())
+    if isinstance(obj, pd.DataFrame):
+        return msgpack.ExtType(LOG_FRAME, pack_log({'columns': list(obj.columns),
+                                                    'dtypes': [str(dtype) for dtype in obj.dtypes],
+                                                    'index': list(obj.index),
+                                                    'index_name': obj.index.name,
+                                                    'data': [obj.iloc[:, i].tolist()
+                                                             for i in range(obj.shape[1])]}))
+    if isinstance(obj, np.ndarray):
+        array = np.ascontiguousarray(obj)
+        return msgpack.ExtType(LOG_ARRAY, pack_log({'dtype': np.lib.format.dtype_to_descr(array.dtype),
+                                                    'shape': array.shape,
+                                                    'data': array.tobytes()}))
+    if isinstance(obj, datetime):
+        return msgpack.ExtType(LOG_TIME, obj.isoformat().encode())
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError("Can not log %s" % type(obj))
+
+
+def log_ext_hook(code, data):
+    """
+    msgpack ext hook for call log values
+    """
+    if code == LOG_DECIMAL:
+        return Decimal(data.decode())
+    if code == LOG_FRAME:
+        frame = unpack_log(data)
+        columns = [tuple(col) if isinstance(col, list) else col for col in frame['columns']]
+        df = pd.DataFrame(OrderedDict((i, values) for i, values in enumerate(frame['data'])),
+                          index=frame['index'] or None)
+        df.columns = pd.MultiIndex.from_tuples(columns) if columns and isinstance(columns[0], tuple) else columns
+        df.index.name = frame['index_name']
+        for col, dtype in zip(df.columns, frame['dtypes']):
+            if dtype != 'object' and df[col].dtype != dtype:
+                df[col] = df[col].astype(dtype)
+        return df
+    if code == LOG_ARRAY:
+        array = unpack_log(data)
+        return np.frombuffer(array['data'], dtype=np.lib.format.descr_to_dtype(array['dtype'])).reshape(
+            array['shape']).copy()
+    if code == LOG_TIME:
+        return pd.Timestamp(data.decode())
+    return msgpack.ExtType(code, data)
+
+
+def pack_log(value):
+    return msgpack.packb(value, default=log_default, use_bin_type=True)
+
+
+def unpack_log(data):
+    return msgpack.unpackb(data, ext_hook=log_ext_hook, raw=False, strict_map_key=False)
+
+
+def log_key(method, args, kwargs):
+    """
+    Replay match key. Calls are matched by method and pair, in order, so time ranges may differ.
+    :return: tuple: method, pair
+    """
+    pair = args[0] if args else kwargs.get('currencyPair', kwargs.get('currencyPairs', ''))
+    return method, ','.join(pair) if isinstance(pair, (list, tuple)) else str(pair)
+
+
+class RecordingFeed(ExchangeConnection):
+    """
+    Exchange connection wrapper that appends every call, reply and error, with timestamps, to a binary log.
+    Serve the log back with ReplayFeed.
+    """
+    def __init__(self, tapi, path, attrs=('pairs', 'binary', 'exchange', 'period'), clock=time):
+        """
+
+        :param tapi: ExchangeConnection: Exchange api to record
+        :param path: str: Log file. Sessions are appended
+        :param attrs: tuple: tapi attributes to store, so the replay feed has them too
+        :param clock: callable: Time source
+        """
+        self.tapi = tapi
+        self.path = path
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.file = open(path, 'ab')
+        self.write({'v': LOG_VERSION,
+                    't': clock(),
+                    'attrs': {name: getattr(tapi, name) for name in attrs if hasattr(tapi, name)}})
+
+    def __getattr__(self, name):
+        # Methods not in ExchangeConnection are recorded too
+        if name.startswith('_') or 'tapi' not in self.__dict__:
+            raise AttributeError(name)
+        attr = getattr(self.tapi, name)
+        if callable(attr):
+            return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+        return attr
+
+    def write(self, record):
+        data = pack_log(record)
+        with self.lock:
+            self.file.write(data)
+            self.file.flush()
+
+    def call(self, method, *args, **kwargs):
+        """
+        Call tapi method and log it
+        :param method: str: Method name
+        :return: Method return
+        """
+        t0 = self.clock()
+        record = {'t': t0, 'm': method, 'a': list(args), 'k': kwargs}
+        try:
+            rep = getattr(self.tapi, method)(*args, **kwargs)
+            record['r'] = pack_log(rep)
+            return rep
+        except Exception as e:
+            record['e'] = [type(e).__name__, e.__str__()]
+            raise e
+        finally:
+            record['d'] = self.clock() - t0
+            try:
+                self.write(record)
+            except Exception as e:
+                Logger.error(RecordingFeed.call, "Unable to log %s: %s" % (method, e))
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+    @property
+    def balance(self):
+        return self.tapi.balance
+
+    def returnBalances(self):
+        return self.call('returnBalances')
+
+    def returnFeeInfo(self):
+        return self.call('returnFeeInfo')
+
+    def returnCurrencies(self):
+        return self.call('returnCurrencies')
+
+    def returnChartData(self, currencyPair, period, start=None, end=None):
+        return self.call('returnChartData', currencyPair, period, start=start, end=end)
+
+    def sell(self, currencyPair, rate, amount, orderType=False):
+        return self.call('sell', currencyPair, rate, amount, orderType=orderType)
+
+    def buy(self, currencyPair, rate, amount, orderType=False):
+        return self.call('buy', currencyPair, rate, amount, orderType=orderType)
+
+    def pair_reciprocal(self, df):
+        return self.tapi.pair_reciprocal(df)
+
+
+class ReplayFeed(ExchangeConnection):
+    """
+    Serve a RecordingFeed log. Calls get the recorded replies of the same method and pair, in recorded order,
+    and a virtual clock follows the recorded call times, as fast as possible or scaled to real time.
+    Reads past the end of the log get their last reply again. Trades and calls never recorded raise ReplayException.
+    """
+    def __init__(self, path, speed=None, session=0):
+        """
+
+        :param path: str: RecordingFeed log file
+        :param speed: float: Virtual seconds per real second. None replays as fast as possible
+        :param session: int: Recorded session to serve, in file order
+        """
+        self.path = path
+        self.speed = speed
+        self.lock = threading.Lock()
+        self.queues = OrderedDict()
+        self.last = {}
+        self.served = 0
+        self.reused = 0
+
+        sessions = []
+        with open(path, 'rb') as f:
+            for record in msgpack.Unpacker(f, raw=False, strict_map_key=False):
+                if 'v' in record:
+                    sessions.append((record, []))
+                elif sessions:
+                    sessions[-1][1].append(record)
+
+        if not sessions:
+            raise ReplayException("No session recorded in %s" % path)
+        header, records = sessions[session]
+        if header['v'] != LOG_VERSION:
+            raise ReplayException("Unsupported log version: %s" % str(header['v']))
+
+        self.attrs = header['attrs']
+        self.start = header['t']
+        self.end = max([record['t'] + record['d'] for record in records] + [self.start])
+        for record in sorted(records, key=lambda record: record['t']):
+            self.queues.setdefault(log_key(record['m'], record['a'], record['k']), deque()).append(record)
+        self.methods = set(key[0] for key in self.queues)
+
+        # Virtual clock, and the real time it started at
+        self.now = self.start
+        self.origin = None
+
+    def __getattr__(self, name):
+        if name.startswith('_') or 'attrs' not in self.__dict__:
+            raise AttributeError(name)
+        if name in self.attrs:
+            return self.attrs[name]
+        if name in self.methods:
+            return lambda *args, **kwargs: self.call(name, *args, **kwargs)
+        raise AttributeError(name)
+
+    def clock(self):
+        """
+        :return: float: Virtual epoch time
+        """
+        return self.now
+
+    def advance(self, t):
+        """
+        Move the virtual clock forward. Real time replays sleep until then.
+        :param t: float: Virtual epoch time
+        """
+        if self.speed:
+            if self.origin is None:
+                self.origin = (self.now, perf_counter())
+            delay = (t - self.origin[0]) / self.speed - (perf_counter() - self.origin[1])
+            if delay > 0:
+                sleep(delay)
+        with self.lock:
+            self.now = max(self.now, t)
+
+    def call(self, method, *args, **kwargs):
+        """
+        Serve the next recorded reply for a call
+        :param method: str: Method name
+        :return: Recorded reply. Recorded errors are raised again
+        """
+        key = log_key(method, args, kwargs)
+        with self.lock:
+            if self.queues.get(key):
+                record = self.queues[key].popleft()
+                self.last[key] = record
+                self.served += 1
+            elif key in self.last and COMMAND_LANES.get(method) != 'trade':
+                record = self.last[key]
+                self.reused += 1
+            else:
+                raise ReplayException("No recorded reply for %s %s" % key)
+
+        # Clock moves to the recorded reply time
+        self.advance(record['t'] + record['d'])
+
+        if 'e' in record:
+            name, message = record['e']
+            error = globals().get(name, getattr(builtins, name, None))
+            if not (isinstance(error, type) and issubclass(error, Exception)):
+                error = DataFeedException
+            try:
+                error = error(message)
+            except TypeError:
+                # Exception types taking several arguments can't be built from the message alone
+                error = DataFeedException(message)
+            raise error
+        return unpack_log(record['r'])
+
+    def stats(self):
+        """
+        :return: dict: replies served, reused past the log end, and left
+        """
+        with self.lock:
+            return {'served': self.served,
+                    'reused': self.reused,
+                    'remaining': sum(len(queue) for queue in self.queues.values())}
+
+    def attach(self, env, offset=0.5):
+        """
+        Drive an environment with the replay clock. Agent.trade picks the returned scheduler from env.
+        :param env: TradingEnvironment: Environment using this feed
+        :param offset: float: Seconds after bar open to trigger
+        :return: ReplayScheduler
+        """
+        env.clock = self.clock
+        if hasattr(env, 'snapshot'):
+            env.snapshot.clock = self.clock
+        env.scheduler = ReplayScheduler(self, env.period, offset)
+        return env.scheduler
+
+    def returnBalances(self):
+        return self.call('returnBalances')
+
+    def returnFeeInfo(self):
+        return self.call('returnFeeInfo')
+
+    def returnCurrencies(self):
+        return self.call('returnCurrencies')
+
+    def returnChartData(self, currencyPair, period, start=None, end=None):
+        return self.call('returnChartData', currencyPair, period, start=start, end=end)
+
+    def sell(self, currencyPair, rate, amount, orderType=False):
+        return self.call('sell', currencyPair, rate, amount, orderType=orderType)
+
+    def buy(self, currencyPair, rate, amount, orderType=False):
+        return self.call('buy', currencyPair, rate, amount, orderType=orderType)
+
+
+class ReplayScheduler(BarScheduler):
+    """
+    Bar trigger on a replay clock. Jumps to the next bar instead of waiting for it, and stops at the log end.
+    """
+    def __init__(self, feed, period, offset=0.5):
+        """
+        :param feed: ReplayFeed: Feed driving the clock
+        :param period: int: Bar period in minutes
+        :param offset: float: Seconds after bar open to fire
+        """
+        super(ReplayScheduler, self).__init__(period, offset, clock=feed.clock)
+        self.feed = feed
+
+    def wait(self):
+        if self.last_bar is None:
+            self.start()
+
+        if self.stopped:
+            return None
+
+        now = self.clock()
+        bar = max(self.due(now), self.last_bar + self.seconds)
+        if bar + self.offset > self.feed.end:
+            return None
+
+        self.feed.advance(bar + self.offset)
+        self.last_bar = bar
+        lag = self.clock() - bar
+        self.lags.append(lag)
+        return bar, lag
+
+
 class BacktestDataFeed(ExchangeConnection):
     """
     Data feeder for backtesting with TradingEnvironment.
@@ -700,12 +2605,7 @@ class PaperTradingDataFeed(ExchangeConnection):
                 try:
                     symbols = currencyPair.split('_')
                     pair = symbols[1] + '_' + symbols[0]
-                    return json.loads(
-                        self.pair_reciprocal(pd.DataFrame.from_records(self.tapi.returnChartData(pair, period,
-                                                                                                 start=start,
-                                                                                                 end=end
-                                                                                                 ))).to_json(
-                            orient='records'))
+                    return self.pair_reciprocal(self.tapi.returnChartData(pair, period, start=start, end=end))
                 except Exception as e:
                     raise e
             else:
@@ -751,12 +2651,9 @@ class PoloniexConnection(DataFeed):
                                                             str(start),
                                                             str(end))
 
-                    rep =  json.loads(
-                        self.pair_reciprocal(
-                            pd.DataFrame.from_records(
-                                self.get_response(call)
-                            )
-                        ).to_json(orient='records'))
+                    rep = self.get_response(call)
+                    if isinstance(rep, list):
+                        rep = self.pair_reciprocal(rep)
 
                 except Exception as e:
                     raise e
@@ -13,8 +13,11 @@ import os
 import smtplib
 from socket import gaierror
 from datetime import datetime, timedelta, timezone
-from decimal import localcontext, ROUND_UP, Decimal
-from time import sleep
+from decimal import localcontext, ROUND_UP, ROUND_DOWN, Decimal
+from time import sleep, time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import empyrical as ec
 import optunity as ot
@@ -53,6 +56,29 @@ class TradingEnvironment(Env):
         self.portfolio_df = pd.DataFrame()
         self.action_df = pd.DataFrame()
 
+        # Rolling candle buffers for live data, by pair and period. Broadcast candles come from another thread
+        self.candles = {}
+        self.candle_lock = threading.Lock()
+
+        # Candle broadcast subscriber mode
+        self.subscriber = None
+        self.scheduler = None
+        self.bar_pairs = {}
+        self.sub_lock = threading.Lock()
+
+        # Epoch time source. None is the wall clock, replay feeds swap in their virtual clock
+        self.clock = None
+
+        # Concurrent chart data fetch
+        self.fetch_workers = 4
+        self.fetch_executor = None
+
+        # Sleep until next bar open within live steps. Turned off when a scheduler drives the env
+        self.wait_bar = True
+
+        # Trade loop latency by stage
+        self.timings = Timings()
+
         # Logging and debugging
         self.status = {'OOD': False,
                        'Error': False,
@@ -298,11 +324,20 @@ class TradingEnvironment(Env):
                 Logger.error(TradingEnvironment.add_pairs, "Symbol name must be a string")
 
     ## Data feed methods
+    def now(self):
+        """
+        Current utc time on the env clock
+        :return: datetime.datetime
+        """
+        if self.clock is None:
+            return datetime.now(timezone.utc)
+        return datetime.fromtimestamp(self.clock(), timezone.utc)
+
     @property
     def timestamp(self):
         # return floor_datetime(datetime.now(timezone.utc) - timedelta(minutes=self.period), self.period)
         # Poloniex returns utc timestamp delayed one full bar
-        return datetime.now(timezone.utc) - timedelta(minutes=self.period)
+        return self.now() - timedelta(minutes=self.period)
 
     # Exchange data getters
     def get_balance(self):
@@ -422,6 +457,147 @@ class TradingEnvironment(Env):
     #     return out
 
     # Low frequency getter
+    def get_candles(self, symbol, start, end):
+        """
+        Return raw candles for desired pair from a rolling buffer.
+        The buffer is seeded once and then extended by fetching only candles newer than the last complete one.
+        :param symbol: str: Pair symbol
+        :param start: datetime.datetime: First candle time
+        :param end: datetime.datetime: Last candle time
+        :return: pandas DataFrame: Candles from start, indexed by utc time
+        """
+        key = (symbol, self.period)
+        now = self.now()
+
+        # Compare times in utc
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        if start.tzinfo is None:
+            start = start.tz_localize(timezone.utc)
+        if end.tzinfo is None:
+            end = end.tz_localize(timezone.utc)
+
+        # Fetch only candles not complete on the last call
+        with self.candle_lock:
+            buffer = self.candles.get(key)
+        if buffer is not None and buffer['data'].shape[0] and buffer['data'].index[0] <= start:
+            fetch_start = buffer['next']
+            cached = buffer['data']
+            cached = cached[(cached.index >= start) & (cached.index < fetch_start)]
+        else:
+            fetch_start = start
+            cached = None
+
+        if fetch_start <= end:
+            # Binary feeds deliver chart data as arrays
+            if getattr(self.tapi, 'binary', False):
+                ohlc_df = self.tapi.returnChartFrame(symbol,
+                                                     period=self.period * 60,
+                                                     start=datetime.timestamp(fetch_start),
+                                                     end=datetime.timestamp(end))
+            else:
+                ohlc_df = pd.DataFrame.from_records(self.tapi.returnChartData(symbol,
+                                                                                period=self.period * 60,
+                                                                                start=datetime.timestamp(fetch_start),
+                                                                                end=datetime.timestamp(end)))
+            # TODO: FIX TIMESTAMP
+            # Set index
+            ohlc_df.set_index(ohlc_df.date.transform(lambda x: datetime.fromtimestamp(x).astimezone(timezone.utc)),
+                              inplace=True, drop=True)
+            ohlc_df = ohlc_df[ohlc_df.index >= fetch_start]
+
+            if cached is not None:
+                ohlc_df = pd.concat([cached, ohlc_df])
+
+            # A candle is complete once its period is over
+            incomplete = ohlc_df.index[ohlc_df.index + timedelta(minutes=self.period) > now]
+            if incomplete.shape[0]:
+                next_fetch = incomplete[0]
+            elif ohlc_df.shape[0]:
+                next_fetch = ohlc_df.index[-1] + timedelta(minutes=self.period)
+            else:
+                next_fetch = fetch_start
+
+            with self.candle_lock:
+                # Broadcast candles that came in during the fetch are complete, keep them
+                current = self.candles.get(key)
+                if current is not None and current is not buffer and current['next'] > next_fetch:
+                    newer = current['data'][(current['data'].index >= next_fetch) &
+                                            (current['data'].index < current['next'])]
+                    ohlc_df = pd.concat([ohlc_df[ohlc_df.index < next_fetch], newer])
+                    next_fetch = current['next']
+
+                # Keep buffer with the newest data seen
+                if current is None or cached is not None or end >= current['next']:
+                    self.candles[key] = {'data': ohlc_df, 'next': next_fetch}
+
+        else:
+            # All candles are complete and in memory
+            ohlc_df = cached
+
+        return ohlc_df
+
+    def subscribe(self, pub_addr=None, scheduler=None, fallback=5.0):
+        """
+        Subscriber mode. Candles broadcast by the FeedDaemon as bars close are appended to the candle buffers,
+        and the bar scheduler fires once all pairs are in.
+        :param pub_addr: str: Daemon broadcast address. Defaults to the one the daemon binds
+        :param scheduler: BarScheduler: Bar open trigger to notify
+        :param fallback: float: Seconds after bar open to fire if candles are late. Used if no scheduler is given
+        :return: BarScheduler: Pass it to Agent.trade
+        """
+        assert isinstance(self.tapi, DataFeed), "Subscriber mode needs a DataFeed tapi."
+        self.scheduler = scheduler or BarScheduler(self.period, offset=fallback)
+        self.subscriber = CandleSubscriber(self.tapi, self.on_candle, pub_addr)
+        for pair in self.pairs:
+            self.subscriber.subscribe(pair, self.period * 60)
+        self.subscriber.start()
+        return self.scheduler
+
+    def unsubscribe(self):
+        if self.subscriber:
+            self.subscriber.stop()
+        self.subscriber = None
+        self.scheduler = None
+
+    def on_candle(self, pair, period, candle, ticker):
+        """
+        Append a broadcast candle to the pair buffer
+        :param pair: str: Pair symbol
+        :param period: int: Candle period in seconds
+        :param candle: dict: Closed candle
+        :param ticker: dict: Exchange ticker at broadcast time
+        """
+        if period != self.period * 60:
+            return
+
+        key = (pair, self.period)
+        timestamp = datetime.fromtimestamp(int(candle['date'])).astimezone(timezone.utc)
+
+        # Only the candle the buffer misses next. Gaps are filled by get_candles
+        with self.candle_lock:
+            buffer = self.candles.get(key)
+            if buffer is not None and buffer['data'].shape[0] and buffer['next'] == timestamp:
+                data = buffer['data']
+                row = pd.DataFrame.from_records([candle]).reindex(columns=data.columns)
+                row = row.astype(data.dtypes.to_dict())
+                row.index = pd.DatetimeIndex([timestamp])
+                self.candles[key] = {'data': pd.concat([data[data.index < timestamp], row]),
+                                     'next': timestamp + timedelta(minutes=self.period)}
+
+        if ticker and hasattr(self, 'snapshot'):
+            self.snapshot.put('returnTicker', ticker)
+
+        # Fire the bar once every pair is in
+        bar = int(candle['date']) + period
+        with self.sub_lock:
+            self.bar_pairs.setdefault(bar, set()).add(pair)
+            done = len(self.bar_pairs[bar]) >= len(self.pairs)
+            for stale in [item for item in self.bar_pairs if item < bar]:
+                self.bar_pairs.pop(stale)
+
+        if done and self.scheduler:
+            self.scheduler.notify(bar)
+
     def get_ohlc(self, symbol, index):
         """
         Return OHLC data for desired pair
@@ -434,17 +610,7 @@ class TradingEnvironment(Env):
         end = index[-1]
 
         # Call for data
-        ohlc_df = pd.DataFrame.from_records(self.tapi.returnChartData(symbol,
-                                                                        period=self.period * 60,
-                                                                        start=datetime.timestamp(start),
-                                                                        end=datetime.timestamp(end)),
-                                                                        nrows=index.shape[0])
-        # TODO 1 FIND A BETTER WAY
-        # TODO: FIX TIMESTAMP
-
-        # Set index
-        ohlc_df.set_index(ohlc_df.date.transform(lambda x: datetime.fromtimestamp(x).astimezone(timezone.utc)),
-                          inplace=True, drop=True)
+        ohlc_df = self.get_candles(symbol, start, end)
 
         # Get right values to fill nans
         # TODO: FIND A BETTER PERFORMANCE METHOD
@@ -467,8 +633,56 @@ class TradingEnvironment(Env):
 
         return ohlc_df.astype(str)#.fillna('0.0')
 
+    def fetch_ohlc(self, pairs, index):
+        """
+        Fetch OHLC data for several pairs concurrently, bounded by fetch_workers.
+        A failing pair does not affect the others.
+        :param pairs: list: Pair symbols
+        :param index: pandas DatetimeIndex: Time span for data retrieval
+        :return: tuple: OrderedDicts with pair data and pair errors
+        """
+        if len(pairs) > 1 and self.fetch_workers > 1:
+            # Keep worker threads between calls, so their exchange connections are reused
+            if self.fetch_executor is None:
+                self.fetch_executor = ThreadPoolExecutor(max_workers=self.fetch_workers)
+            futures = [self.fetch_executor.submit(self.get_ohlc, pair, index) for pair in pairs]
+        else:
+            futures = None
+
+        # Wait for all pairs
+        data = OrderedDict()
+        errors = OrderedDict()
+        for i, pair in enumerate(pairs):
+            try:
+                data[pair] = futures[i].result() if futures else self.get_ohlc(pair, index)
+            except Exception as e:
+                errors[pair] = e
+
+        return data, errors
+
+    def get_pairs_history(self, history, index):
+        """
+        Complete pairs history, fetching only pairs not in it yet
+        :param history: OrderedDict: Pairs data already fetched
+        :param index: pandas DatetimeIndex: Time span for data retrieval
+        :return: OrderedDict: Data for all pairs
+        """
+        data, errors = self.fetch_ohlc([pair for pair in self.pairs if pair not in history], index)
+        history.update(data)
+
+        for pair, error in errors.items():
+            Logger.error(TradingEnvironment.get_pairs_history, "%s: %s" % (pair, self.parse_error(error)))
+
+        # Raise after all pairs returned. Retries will fetch only failed pairs.
+        if errors:
+            retry = [error for error in errors.values() if isinstance(error, MaxRetriesException)]
+            raise (retry or list(errors.values()))[0]
+
+        return history
+
     # Observation maker
     def get_history(self, start=None, end=None, portfolio_vector=False):
+        history = OrderedDict()
         while True:
             try:
                 obs_list = []
@@ -503,12 +717,10 @@ class TradingEnvironment(Env):
                     port_vec.at[port_vec.index[-1], list(last_balance.keys())] = list(last_balance.values())
 
                     # Get pairs history
+                    history = self.get_pairs_history(history, index)
                     for pair in self.pairs:
                         keys.append(pair)
-                        history = self.get_ohlc(pair, index)
-
-                        history = pd.concat([history, port_vec[pair.split('_')[1]]], axis=1)
-                        obs_list.append(history)
+                        obs_list.append(pd.concat([history[pair], port_vec[pair.split('_')[1]]], axis=1))
 
                     # Get fiat history
                     keys.append(self._fiat)
@@ -527,10 +739,10 @@ class TradingEnvironment(Env):
                     return obs.apply(convert_to.decimal, raw=True)
                 else:
                     # Get history
+                    history = self.get_pairs_history(history, index)
                     for pair in self.pairs:
                         keys.append(pair)
-                        history = self.get_ohlc(pair, index)
-                        obs_list.append(history)
+                        obs_list.append(history[pair])
 
                     # Concatenate
                     obs = pd.concat(obs_list, keys=keys, axis=1)
@@ -1385,11 +1597,24 @@ class BacktestEnvironment(TradingEnvironment):
         self.data_length = None
         self.training = False
         self.initialized = False
+        self.start_index = None
 
     @property
     def timestamp(self):
         return datetime.fromtimestamp(self.tapi.ohlc_data[self.tapi.pairs[0]].index[self.index]).astimezone(timezone.utc)
 
+    def sample_episodes(self, nb_episodes, seed=None):
+        """
+        Draw episode start indexes from the same range used by training resets.
+        Set start_index to one of them to make reset start the episode there.
+        :param nb_episodes: int: Number of episodes to draw
+        :param seed: int: Random seed
+        :return: numpy array: Episode start indexes
+        """
+        if not self.initialized:
+            self.setup()
+        return np.random.RandomState(seed).randint(self.obs_steps, self.data_length - 2, size=nb_episodes)
+
     def get_hindsight(self):
         """
         Stay away from look ahead bias!
@@ -1608,7 +1833,9 @@ class BacktestEnvironment(TradingEnvironment):
                 self.setup()
 
             # Get start point
-            if self.training:
+            if self.start_index is not None:
+                self.index = int(self.start_index)
+            elif self.training:
                 self.index = np.random.random_integers(self.obs_steps, self.data_length - 3)
             else:
                 self.index = self.obs_steps
@@ -1786,7 +2013,10 @@ class TrainingEnvironment(BacktestEnvironment):
             self.setup()
 
         # choose new start point
-        self.index = np.random.random_integers(self.obs_steps, self.data_length - 3)
+        if self.start_index is not None:
+            self.index = int(self.start_index)
+        else:
+            self.index = np.random.random_integers(self.obs_steps, self.data_length - 3)
 
         # Clean data frames
         self.obs_df = pd.DataFrame()
@@ -1921,11 +2151,12 @@ class PaperTradingEnvironment(TradingEnvironment):
         done = self.simulate_trade(action, timestamp)
 
         # Wait for next bar open
-        try:
-            sleep(datetime.timestamp(floor_datetime(timestamp, self.period) + timedelta(minutes=self.period)) -
-                  datetime.timestamp(self.timestamp))
-        except ValueError:
-            pass
+        if self.wait_bar:
+            try:
+                sleep(datetime.timestamp(floor_datetime(timestamp, self.period) + timedelta(minutes=self.period)) -
+                      datetime.timestamp(self.timestamp))
+            except ValueError:
+                pass
 
         # Observe environment
         new_obs = self.get_observation(True).astype(np.float64)
@@ -1937,16 +2168,98 @@ class PaperTradingEnvironment(TradingEnvironment):
         return new_obs, np.float64(reward), done, self.status
 
 
+class MarketSnapshot(object):
+    """
+    Ticker and balances cache for live trading.
+    Every consumer within a step reads the same exchange state, fetched at most once per ttl seconds.
+    Must be invalidated after fills.
+    """
+    def __init__(self, tapi, ttl=5.0, clock=time):
+        """
+        :param tapi: ExchangeConnection: Exchange api
+        :param ttl: float: Seconds to keep ticker and balances
+        :param clock: callable: Epoch time source
+        """
+        self.tapi = tapi
+        self.ttl = ttl
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.data = {}
+        self.calls = {'returnTicker': 0, 'returnBalances': 0}
+
+    def get(self, method):
+        with self.lock:
+            if method not in self.data or self.clock() - self.data[method][0] > self.ttl:
+                self.calls[method] += 1
+                self.data[method] = (self.clock(), getattr(self.tapi, method)())
+            return self.data[method][1]
+
+    def returnTicker(self):
+        return self.get('returnTicker')
+
+    def returnBalances(self):
+        return self.get('returnBalances')
+
+    def put(self, method, value):
+        """
+        Store a value received from elsewhere, like a broadcast ticker
+        :param method: str: Method name
+        :param value: Method return value
+        """
+        with self.lock:
+            self.data[method] = (self.clock(), value)
+
+    def invalidate(self, *methods):
+        """
+        Drop cached values
+        :param methods: str: Methods to invalidate. If none, invalidate all.
+        """
+        with self.lock:
+            for method in methods or list(self.data.keys()):
+                self.data.pop(method, None)
+
+
 class LiveTradingEnvironment(TradingEnvironment):
     """
     Live trading environment for financial strategies execution
     ** USE AT YOUR OWN RISK**
     """
-    def __init__(self, period, obs_steps, tapi, fiat, name):
+    def __init__(self, period, obs_steps, tapi, fiat, name, order_workers=3, snapshot_ttl=5.0):
+        """
+        :param order_workers: int: Max concurrent order legs. Poloniex allows 6 calls/s and each leg takes
+        at least a ticker and an order call.
+        :param snapshot_ttl: float: Seconds to reuse ticker and balances between exchange calls
+        """
         assert isinstance(tapi, ExchangeConnection), "tapi must be an ExchangeConnection instance."
+        self.snapshot = MarketSnapshot(tapi, snapshot_ttl)
         super().__init__(period, obs_steps, tapi, fiat, name)
+        self.order_workers = order_workers
+        self.order_executor = None
+        self.order_results = OrderedDict()
+
+        # Fiat each concurrent buy leg may fall back to, and a lock for the fallback
+        self.fiat_budget = {}
+        self.fiat_lock = threading.Lock()
 
     # Data feed methods
+    def get_balance(self):
+        """
+        Get balance from market snapshot
+        :return: dict: Dict containing Decimal values for portfolio allocation
+        """
+        try:
+            balance = self.snapshot.returnBalances()
+
+            filtered_balance = {}
+            for symbol in self.symbols:
+                filtered_balance[symbol] = convert_to.decimal(balance[symbol])
+
+            return filtered_balance
+
+        except Exception as e:
+            Logger.error(LiveTradingEnvironment.get_balance, self.parse_error(e))
+            raise e
+
     def get_balance_array(self):
         """
         Return ordered balance array
@@ -1967,7 +2280,7 @@ class LiveTradingEnvironment(TradingEnvironment):
         portval = dec_zero
         balance = self.get_balance()
         if not ticker:
-            ticker = self.tapi.returnTicker()
+            ticker = self.snapshot.returnTicker()
         for pair in self.pairs:
             portval = balance[pair.split('_')[1]].fma(convert_to.decimal(ticker[pair]['last']),
                                                       portval)
@@ -1984,7 +2297,7 @@ class LiveTradingEnvironment(TradingEnvironment):
         portfolio = np.empty(len(self.symbols), dtype=np.dtype(Decimal))
         portval = self.calc_total_portval(ticker)
         if not ticker:
-            ticker = self.tapi.returnTicker()
+            ticker = self.snapshot.returnTicker()
         balance = self.get_balance()
         for i, pair in enumerate(self.pairs):
             portfolio[i] = safe_div(dec_con.multiply(balance[pair.split('_')[1]],
@@ -2003,7 +2316,7 @@ class LiveTradingEnvironment(TradingEnvironment):
         desired_balance = np.empty(len(self.symbols), dtype=np.dtype(Decimal))
         portval = fiat = self.calc_total_portval(ticker)
         if not ticker:
-            ticker = self.tapi.returnTicker()
+            ticker = self.snapshot.returnTicker()
         for i, pair in enumerate(self.pairs):
             desired_balance[i] = safe_div(dec_con.multiply(portval , action[i]),
                                           dec_con.create_decimal(ticker[pair]['last']))
@@ -2025,13 +2338,16 @@ class LiveTradingEnvironment(TradingEnvironment):
 
             while True:
                 try:
-                    price = self.tapi.returnTicker()[pair]['highestBid']
+                    price = self.snapshot.returnTicker()[pair]['highestBid']
 
                     Logger.debug(LiveTradingEnvironment.immediate_sell,
                                       "Selling %s %s at %s" % (pair, amount, price))
 
                     response = self.tapi.sell(pair, price, amount, orderType="immediateOrCancel")
 
+                    # Balances and prices changed
+                    self.snapshot.invalidate()
+
                     Logger.debug(LiveTradingEnvironment.immediate_sell,
                                  "Response: %s" % str(response))
 
@@ -2056,6 +2372,7 @@ class LiveTradingEnvironment(TradingEnvironment):
                         amount = self.get_balance()[symbol]
 
                 except ExchangeError as error:
+                    self.snapshot.invalidate()
                     Logger.error(LiveTradingEnvironment.immediate_sell, self.parse_error(error))
 
                     if 'Total must be at least' in error.__str__():
@@ -2110,16 +2427,20 @@ class LiveTradingEnvironment(TradingEnvironment):
         try:
             pair = self._fiat + '_' + symbol
             amount = str(amount)
+            resized = False
 
             while True:
                 try:
-                    price = self.tapi.returnTicker()[pair]['lowestAsk']
+                    price = self.snapshot.returnTicker()[pair]['lowestAsk']
 
                     Logger.debug(LiveTradingEnvironment.immediate_buy,
                                       "Buying %s %s at %s" % (pair, amount, price))
 
                     response = self.tapi.buy(pair, price, amount, orderType="immediateOrCancel")
 
+                    # Balances and prices changed
+                    self.snapshot.invalidate()
+
                     Logger.debug(LiveTradingEnvironment.immediate_buy,
                                  "Response: %s" % str(response))
 
@@ -2136,17 +2457,17 @@ class LiveTradingEnvironment(TradingEnvironment):
                         return True
 
                     elif 'Not enough %s.' % self._fiat == response:
-                        self.status['NotEnoughFiat'] += 1
-
-                        price = convert_to.decimal(self.tapi.returnTicker()[pair]['lowestAsk'])
-                        fiat_units = self.get_balance()[self._fiat]
+                        price = convert_to.decimal(self.snapshot.returnTicker()[pair]['lowestAsk'])
+                        fiat_units = self.leg_fiat(symbol)
 
                         amount = str(safe_div(fiat_units, price).quantize(dec_eps))
+                        resized = True
 
                     elif 'Order execution timed out.' == response:
                         amount = self.get_balance()[symbol]
 
                 except ExchangeError as error:
+                    self.snapshot.invalidate()
                     Logger.error(LiveTradingEnvironment.immediate_buy,
                                       self.parse_error(error))
 
@@ -2157,16 +2478,16 @@ class LiveTradingEnvironment(TradingEnvironment):
                         return True
 
                     elif 'Not enough %s.' % self._fiat == error.__str__():
-                        if not self.status['NotEnoughFiat']:
-                            self.status['NotEnoughFiat'] += 1
-
-                            price = convert_to.decimal(self.tapi.returnTicker()[pair]['lowestAsk'])
-                            fiat_units = self.get_balance()[self._fiat]
+                        if not resized:
+                            price = convert_to.decimal(self.snapshot.returnTicker()[pair]['lowestAsk'])
+                            fiat_units = self.leg_fiat(symbol)
 
                             amount = str(safe_div(fiat_units, price))
+                            resized = True
 
                         else:
-                            self.status['NotEnoughFiat'] += 1
+                            with self.fiat_lock:
+                                self.status['NotEnoughFiat'] += 1
                             return True
 
                     elif 'Order execution timed out.' == error.__str__():
@@ -2198,70 +2519,109 @@ class LiveTradingEnvironment(TradingEnvironment):
 
             raise error
 
+    def split_fiat(self, orders):
+        """
+        Split fiat balance among buy legs, pro rata to their cost at the ask
+        :param orders: list: (symbol, amount) tuples
+        :return: dict: Decimal fiat units each leg may spend
+        """
+        ticker = self.snapshot.returnTicker()
+        fiat_units = self.get_balance()[self._fiat]
+
+        costs = OrderedDict()
+        for symbol, amount in orders:
+            price = convert_to.decimal(ticker[self._fiat + '_' + symbol]['lowestAsk'])
+            costs[symbol] = dec_con.multiply(convert_to.decimal(amount), price)
+        total = sum(costs.values(), dec_zero)
+
+        # Round down, so shares never add up to more than the balance
+        budget = OrderedDict()
+        for symbol, cost in costs.items():
+            budget[symbol] = safe_div(dec_con.multiply(fiat_units, cost), total).quantize(dec_qua, ROUND_DOWN)
+        return budget
+
+    def leg_fiat(self, symbol):
+        """
+        Fiat a buy leg can spend after a not enough fiat reply. Fiat left, capped by the leg share.
+        Legs fall back one at a time.
+        :param symbol: str: Leg symbol
+        :return: Decimal: Fiat units
+        """
+        with self.fiat_lock:
+            self.status['NotEnoughFiat'] += 1
+            fiat_units = self.get_balance()[self._fiat]
+            if symbol in self.fiat_budget:
+                fiat_units = min(fiat_units, self.fiat_budget[symbol])
+            return fiat_units
+
     # Online Trading methods
-    def rebalance_sell(self, balance_change, order_type="immediate"):
+    def execute_orders(self, orders, side):
         """
-        Execute rebalance sell orders sequentially
-        :param balance_change: numpy array: Balance change
-        :param order_type: str: Order type to use
-        :return: bool: True if executed successfully
+        Execute order legs concurrently, bounded by order_workers
+        :param orders: list: (symbol, amount) tuples
+        :param side: str: sell or buy
+        :return: OrderedDict: Per leg results with side, amount, fill status and error
         """
-        done = True
-        for i, change in enumerate(balance_change):
-            if change < dec_zero:
-                # Reset flag
-                resp = False
+        assert side in ['sell', 'buy'], "side must be whether 'sell' or 'buy'."
+        order = self.immediate_sell if side == 'sell' else self.immediate_buy
 
-                # Get symbol
-                symbol = self.symbols[i]
+        results = OrderedDict()
+        if not orders:
+            return results
 
-                # While order is not completed, try to sell
-                while not resp:
-                    while not resp:
-                        try:
-                            resp = self.immediate_sell(symbol, abs(change.quantize(dec_qua)))
-                        except Exception as e:
-                            Logger.error(LiveTradingEnvironment.rebalance_buy,
-                                              self.parse_error(e))
-                            break
+        # Keep the same worker threads between rebalances, so their exchange connections are reused
+        if self.order_executor is None:
+            self.order_executor = ThreadPoolExecutor(max_workers=max(1, self.order_workers))
 
-                # Update flag
-                if not resp:
-                    done = False
+        def leg(symbol, amount):
+            with self.timings.measure('execute'):
+                return order(symbol, amount)
 
-        return done
+        futures = [self.order_executor.submit(leg, symbol, amount) for symbol, amount in orders]
 
-    def rebalance_buy(self, balance_change, order_type="immediate"):
+        for (symbol, amount), future in zip(orders, futures):
+            try:
+                filled = bool(future.result())
+                error = None
+            except Exception as e:
+                Logger.error(LiveTradingEnvironment.execute_orders, self.parse_error(e))
+                filled = False
+                error = e
+
+            results[symbol] = {'side': side, 'amount': amount, 'filled': filled, 'error': error}
+
+        self.order_results.update(results)
+
+        return results
+
+    def rebalance_sell(self, balance_change, order_type="immediate"):
         """
-        Execute rebalance buy orders sequentially
+        Execute rebalance sell orders concurrently
         :param balance_change: numpy array: Balance change
         :param order_type: str: Order type to use
         :return: bool: True if executed successfully
         """
-        done = True
-        for i, change in enumerate(balance_change):
-            if change > dec_zero:
-
-                # Reset flag
-                resp = False
-
-                # Get symbol
-                symbol = self.symbols[i]
+        orders = [(self.symbols[i], abs(change.quantize(dec_qua))) for i, change in enumerate(balance_change)
+                  if change < dec_zero]
 
-                # While order is not completed, try to buy
-                while not resp:
-                    try:
-                        resp = self.immediate_buy(symbol, abs(change.quantize(dec_qua)))
-                    except Exception as e:
-                        Logger.error(LiveTradingEnvironment.rebalance_buy,
-                                          self.parse_error(e))
-                        break
+        return all(leg['filled'] for leg in self.execute_orders(orders, 'sell').values())
 
-                # Update flag
-                if not resp:
-                    done = False
+    def rebalance_buy(self, balance_change, order_type="immediate"):
+        """
+        Execute rebalance buy orders concurrently
+        :param balance_change: numpy array: Balance change
+        :param order_type: str: Order type to use
+        :return: bool: True if executed successfully
+        """
+        orders = [(self.symbols[i], abs(change.quantize(dec_qua))) for i, change in enumerate(balance_change)
+                  if change > dec_zero]
 
-        return done
+        # Legs run at once, so each gets its own share of the fiat to fall back to
+        self.fiat_budget = self.split_fiat(orders) if orders else {}
+        try:
+            return all(leg['filled'] for leg in self.execute_orders(orders, 'buy').values())
+        finally:
+            self.fiat_budget = {}
 
     def online_rebalance(self, action, timestamp):
         """
@@ -2272,14 +2632,15 @@ class LiveTradingEnvironment(TradingEnvironment):
         try:
             done = False
             self.status['NotEnoughFiat'] = False
+            self.order_results = OrderedDict()
             # First, assert action is valid
             action = self.assert_action(action)
 
             # Calculate position change given last portftolio and action vector
-            ticker = self.tapi.returnTicker()
+            ticker = self.snapshot.returnTicker()
             balance_change = dec_vec_sub(self.calc_desired_balance_array(action, ticker), self.get_balance_array())[:-1]
 
-            # Sell assets first
+            # Sell assets first, all legs at once
             resp_1 = self.rebalance_sell(balance_change)
 
             # Then, buy what you want
@@ -2289,20 +2650,24 @@ class LiveTradingEnvironment(TradingEnvironment):
             if resp_1 and resp_2:
                 done = True
 
-            # Get new ticker
-            ticker = self.tapi.returnTicker()
+            with self.timings.measure('bookkeeping'):
+                # Drop exchange state from before the fills
+                self.snapshot.invalidate()
 
-            # Log executed action and final balance
-            self.log_action_vector(self.timestamp, self.calc_portfolio_vector(ticker), done)
+                # Get new ticker
+                ticker = self.snapshot.returnTicker()
 
-            # Update portfolio_df
-            final_balance = self.get_balance()
-            final_balance['timestamp'] = timestamp
-            self.balance = final_balance
+                # Log executed action and final balance
+                self.log_action_vector(self.timestamp, self.calc_portfolio_vector(ticker), done)
 
-            # Calculate new portval
-            self.portval = {'portval': self.calc_total_portval(ticker),
-                            'timestamp': self.portfolio_df.index[-1]}
+                # Update portfolio_df
+                final_balance = self.get_balance()
+                final_balance['timestamp'] = timestamp
+                self.balance = final_balance
+
+                # Calculate new portval
+                self.portval = {'portval': self.calc_total_portval(ticker),
+                                'timestamp': self.portfolio_df.index[-1]}
 
             return done
 
@@ -2375,11 +2740,12 @@ class LiveTradingEnvironment(TradingEnvironment):
         done = self.online_rebalance(action, timestamp)
 
         # Wait for next bar open
-        try:
-            sleep(datetime.timestamp(floor_datetime(timestamp, self.period) + timedelta(minutes=self.period)) -
-                  datetime.timestamp(self.timestamp))
-        except ValueError:
-            pass
+        if self.wait_bar:
+            try:
+                sleep(datetime.timestamp(floor_datetime(timestamp, self.period) + timedelta(minutes=self.period)) -
+                      datetime.timestamp(self.timestamp))
+            except ValueError:
+                pass
 
         # Observe environment
         new_obs = self.get_observation(True).astype(np.float64)
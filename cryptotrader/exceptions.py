@@ -14,4 +14,10 @@ class MaxRetriesException(DataFeedException):
     pass
 
 class UnexpectedResponseException(DataFeedException):
-    pass
\ No newline at end of file
+    pass
+
+class ReplayException(DataFeedException):
+    pass
+
+class CircuitOpenException(MaxRetriesException):
+    pass
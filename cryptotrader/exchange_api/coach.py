@@ -18,36 +18,167 @@
 #    51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
 import logging
+import os
+import mmap
+import fcntl
+import struct
 from time import time, sleep
-from threading import Semaphore, Timer
+from threading import Lock
 from collections import deque
-from ..utils import Logger
+from contextlib import contextmanager
+from ..utils import Logger, LatencyHistogram
 
 # logger
 # logger = logging.getLogger(__name__)
 
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter. Calls reserve a token and sleep in their own thread until it is due,
+    so no thread is started per call and waiting calls are served in arrival order.
+    State can live in a file, shared by every process that opens the same path.
+    """
+    STATE = struct.Struct('dd')
+
+    def __init__(self, rate, capacity, path=None, clock=time, sleep=sleep):
+        """
+        :param rate: float: Tokens added per second
+        :param capacity: float: Max tokens, the burst size
+        :param path: str: State file shared between processes. None keeps state in memory
+        :param clock: callable: Time source. Must be wall clock time when shared
+        :param sleep: callable: Sleep function
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = Lock()
+        self.hist = LatencyHistogram()
+        self.calls = 0
+        self.waited = 0
+        self.wait_time = 0.0
+
+        if path:
+            self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+            with self.flock():
+                if os.fstat(self.fd).st_size < self.STATE.size:
+                    os.ftruncate(self.fd, self.STATE.size)
+            self.state = mmap.mmap(self.fd, self.STATE.size)
+        else:
+            self.fd = None
+            self.state = bytearray(self.STATE.size)
+
+    def __del__(self):
+        if self.fd is not None:
+            self.state.close()
+            os.close(self.fd)
+
+    @contextmanager
+    def flock(self):
+        if self.fd is None:
+            yield
+        else:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def reserve(self, tokens=1):
+        """
+        Take tokens, going into debt if the bucket is short
+        :param tokens: float: Tokens to take
+        :return: float: Seconds until the tokens are due
+        """
+        with self.lock, self.flock():
+            now = self.clock()
+            level, stamp = self.STATE.unpack_from(self.state)
+            # New state starts full
+            if not stamp:
+                level, stamp = self.capacity, now
+            level = min(self.capacity, level + max(0.0, now - stamp) * self.rate) - tokens
+            self.STATE.pack_into(self.state, 0, level, max(now, stamp))
+
+        return -level / self.rate if level < 0 else 0.0
+
+    def acquire(self, tokens=1):
+        """
+        Block until tokens are available
+        :param tokens: float: Tokens to take
+        :return: float: Seconds waited
+        """
+        wait = self.reserve(tokens)
+        if wait > 0:
+            self.sleep(wait)
+
+        with self.lock:
+            self.calls += 1
+            self.hist.record(1000 * wait)
+            if wait > 0:
+                self.waited += 1
+                self.wait_time += wait
+
+        return wait
+
+    @property
+    def tokens(self):
+        with self.lock, self.flock():
+            level, stamp = self.STATE.unpack_from(self.state)
+            if not stamp:
+                return self.capacity
+            return min(self.capacity, level + max(0.0, self.clock() - stamp) * self.rate)
+
+    def stats(self):
+        """
+        Wait statistics of calls made in this process
+        :return: dict: calls, calls that waited, total wait in seconds, wait percentiles in ms, tokens left
+        """
+        with self.lock:
+            stats = {'calls': self.calls,
+                     'waited': self.waited,
+                     'wait_time': self.wait_time,
+                     'p50': self.hist.percentile(50),
+                     'p99': self.hist.percentile(99),
+                     'max': self.hist.percentile(100)}
+        stats['tokens'] = self.tokens
+        return stats
+
+
 class Coach(object):
     """
     Coaches the api wrapper, makes sure it doesn't get all hyped up on Mt.Dew
     Poloniex default call limit is 6 calls per 1 sec.
+    Public and private calls share one token bucket unless privateLimit is set.
     """
 
-    def __init__(self, timeFrame=1.1, callLimit=6):
+    def __init__(self, timeFrame=1.1, callLimit=6, privateLimit=None, path=None):
         """
         timeFrame = float time in secs [default = 1.0]
         callLimit = int max amount of calls per 'timeFrame' [default = 6]
+        privateLimit = int max amount of private calls per 'timeFrame', in a bucket of their own
+        path = str state file prefix, to share limits between processes
         """
         self.timeFrame = timeFrame
-        self.semaphore = Semaphore(callLimit)
+        self.callLimit = callLimit
+        self.buckets = {'public': TokenBucket(callLimit / timeFrame, callLimit,
+                                              path + '.public' if path else None)}
+        if privateLimit:
+            self.buckets['private'] = TokenBucket(privateLimit / timeFrame, privateLimit,
+                                                  path + '.private' if path else None)
+        else:
+            self.buckets['private'] = self.buckets['public']
 
-    def wait(self):
+    def wait(self, kind='public'):
         """ Makes sure our api calls don't go past the api call limit """
-        self.semaphore.acquire()  # blocking call
-        # delayed release
-        timer = Timer(self.timeFrame, self.semaphore.release)
-        # allows the timer to be canceled on exit
-        timer.setDaemon(True)
-        timer.start()
+        return self.buckets[kind.lower()].acquire()
+
+    def stats(self):
+        """
+        :return: dict: Wait statistics by bucket
+        """
+        return {kind: bucket.stats() for kind, bucket in self.buckets.items()
+                if kind == 'public' or bucket is not self.buckets['public']}
 
 
 class Coach2(object):
@@ -81,7 +212,7 @@ class Coach2(object):
             Logger.debug(Coach2.timeOverTimeframe, "...waiting... %f" % requiredElapsed)
             sleep(requiredElapsed)
 
-    def wait(self):
+    def wait(self, kind=None):
         """ Makes sure our api calls don't go past the api call limit """
         self.timeBook.append(time())
         self.maybeSleep()
@@ -38,14 +38,18 @@ from hmac import new as _new
 from itertools import chain as _chain
 from json import loads as _loads
 from time import sleep
+import re as _re
+import asyncio
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
-from requests import get as _get
-from requests import post as _post
+from requests import Session as _Session
+from requests.adapters import HTTPAdapter as _HTTPAdapter
 
 from ..exceptions import *
 # local
 from .coach import Coach
-from ..utils import Logger
+from ..utils import Logger, CircuitBreaker
 
 # # logger
 # logger = logging.getLogger(__name__)
@@ -92,6 +96,92 @@ PRIVATE_COMMANDS = [
     'getMarginPosition',
     'closeMarginPosition']
 
+# Commands that move funds keep the full retry, never cut short by the circuit breaker
+TRADE_COMMANDS = [
+    'createLoanOffer',
+    'cancelLoanOffer',
+    'toggleAutoRenew',
+    'buy',
+    'sell',
+    'cancelOrder',
+    'moveOrder',
+    'withdraw',
+    'transferBalance',
+    'marginBuy',
+    'marginSell',
+    'closeMarginPosition']
+
+
+# Fast numeric decoding
+def _fromText(body, size):
+    """ Parse comma separated numbers in C. Raises ValueError unless
+    exactly <size> numbers are found. """
+    values = np.fromstring(body.translate(None, b'[]{}"'), sep=',')
+    if values.shape[0] != size:
+        raise ValueError('Unexpected response layout')
+    return values
+
+
+def parseChartData(data):
+    """ Chart data to a numpy record array. Response bytes are parsed
+    straight to float64, without python objects per value. Already decoded
+    json lists are converted too.
+    raises ValueError on responses that are not a list of candles """
+    if not isinstance(data, (bytes, str)):
+        keys = list(data[0].keys()) if data else ['date', 'high', 'low', 'open', 'close', 'volume',
+                                                 'quoteVolume', 'weightedAverage']
+        values = np.array([[float(candle[key]) for key in keys] for candle in data],
+                          dtype=np.float64).reshape(-1, len(keys))
+    else:
+        data = data if isinstance(data, bytes) else data.encode()
+        end = data.find(b'}')
+        if not data.lstrip().startswith(b'[{') or end < 0:
+            raise ValueError('Not a chart data list')
+
+        # Keys are in the same order on every candle
+        keys = _re.findall(rb'"(\w+)":', data[:end])
+        body = data
+        for key in keys:
+            body = body.replace(b'"' + key + b'":', b'')
+        values = _fromText(body, data.count(b'{') * len(keys)).reshape(-1, len(keys))
+        keys = [key.decode() for key in keys]
+
+    out = np.empty(values.shape[0], dtype=[(key, np.int64 if key == 'date' else np.float64) for key in keys])
+    for i, key in enumerate(keys):
+        out[key] = values[:, i]
+    return out
+
+
+def parseTicker(data):
+    """ Ticker to a numpy record array, one row per pair. Response bytes are
+    parsed straight to float64, without python objects per value. Already
+    decoded json dicts are converted too.
+    raises ValueError on responses that are not a ticker """
+    if not isinstance(data, (bytes, str)):
+        if not data:
+            raise ValueError('Empty ticker')
+        pairs = list(data.keys())
+        keys = list(data[pairs[0]].keys())
+        values = np.array([[float(data[pair][key]) for key in keys] for pair in pairs], dtype=np.float64)
+    else:
+        data = data if isinstance(data, bytes) else data.encode()
+        pairs = _re.findall(rb'"(\w+)":\s*\{', data)
+        if not pairs:
+            raise ValueError('Not a ticker')
+        start = data.index(b'{', data.index(b'{') + 1)
+        keys = _re.findall(rb'"(\w+)":', data[start:data.index(b'}', start)])
+        body = _re.sub(rb'"\w+":', b'', data)
+        values = _fromText(body, len(pairs) * len(keys)).reshape(-1, len(keys))
+        pairs = [pair.decode() for pair in pairs]
+        keys = [key.decode() for key in keys]
+
+    out = np.empty(len(pairs), dtype=[('pair', 'U%d' % max(len(pair) for pair in pairs))] +
+                                     [(key, np.int64 if key == 'id' else np.float64) for key in keys])
+    out['pair'] = pairs
+    for i, key in enumerate(keys):
+        out[key] = values[:, i]
+    return out
+
 
 # class ExchangeError(Exception):
 #     """ Exception for handling poloniex api errors """
@@ -99,10 +189,13 @@ PRIVATE_COMMANDS = [
 
 class Poloniex(object):
     """The Poloniex Object!"""
+    publicUrl = 'https://poloniex.com/public'
+    privateUrl = 'https://poloniex.com/tradingApi'
 
     def __init__(
             self, key=False, secret=False,
-            timeout=None, coach=None, jsonNums=False):
+            timeout=None, coach=None, jsonNums=False, poolSize=8, compress=True,
+            breaker=None):
         """
         key = str api key supplied by Poloniex
         secret = str secret hash supplied by Poloniex
@@ -110,6 +203,12 @@ class Poloniex(object):
             (otherwise 'requests.exceptions.Timeout' is raised)
         coach = bool to indicate if the api coach should be used
         jsonNums = datatype to use when parsing json ints and floats
+        poolSize = int keep-alive connections kept open, one per concurrent caller
+        compress = bool to ask for gzip compressed responses
+        breaker = dict of CircuitBreaker settings for commands failing in a
+            row, or False to always retry. On by default. Circuits are kept
+            per command and currencyPair, and TRADE_COMMANDS always get the
+            full retry
         # Time Placeholders: (MONTH == 30*DAYS)
         self.MINUTE, self.HOUR, self.DAY, self.WEEK, self.MONTH, self.YEAR
         """
@@ -117,10 +216,20 @@ class Poloniex(object):
         self.coach = coach
         if not self.coach:
             self.coach = Coach()
+        # keep-alive http session, so calls skip the tcp and tls handshakes
+        self.compress = compress
+        self.session = None
+        self.executor = None
+        self.resizePool(poolSize)
         # create nonce
         self._nonce = int("{:.6f}".format(datetime.utcnow().timestamp()).replace('.', ''))
         # json number datatypes
         self.jsonNums = jsonNums
+        # retried calls and calls that ran out of retries
+        self.retries, self.failures = 0, 0
+        # commands failing in a row fail fast instead of retrying
+        self.breaker = CircuitBreaker(**(breaker or {})) \
+            if breaker is not False else None
         # grab keys, set timeout
         self.key, self.secret, self.timeout = key, secret, timeout
         # set time labels
@@ -128,25 +237,90 @@ class Poloniex(object):
         self.WEEK, self.MONTH = self.DAY * 7, self.DAY * 30
         self.YEAR = self.DAY * 365
 
+    def resizePool(self, poolSize):
+        """ Start a new http session keeping up to <poolSize> connections
+        open. Call it with the number of threads making calls. """
+        if self.session:
+            self.session.close()
+        self.poolSize = poolSize
+        self.session = _Session()
+        adapter = _HTTPAdapter(pool_connections=1, pool_maxsize=poolSize)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers['Accept-Encoding'] = 'gzip, deflate' if self.compress else 'identity'
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def close(self):
+        """ Close pooled connections """
+        self.session.close()
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def stats(self):
+        """ Returns retry counts, circuit breaker states and coach wait
+        statistics """
+        stats = {'retries': self.retries, 'failures': self.failures}
+        if self.breaker:
+            stats['breaker'] = self.breaker.stats()
+        if hasattr(self.coach, 'stats'):
+            stats['coach'] = self.coach.stats()
+        return stats
+
     # -----------------Meat and Potatos---------------------------------------
     def _retry(func):
         """ retry decorator """
         @_wraps(func)
         def retrying(*args, **kwargs):
             problems = []
+            api = args[0] if args and isinstance(args[0], Poloniex) else None
+            breaker = getattr(api, 'breaker', None)
+            # one circuit per api command and pair
+            if func.__name__ == '__call__' and len(args) > 1:
+                endpoint = args[1]
+                params = args[2] if len(args) > 2 else kwargs.get('args')
+                pair = (params or {}).get('currencyPair')
+            else:
+                endpoint = func.__name__
+                pair = kwargs.get('currencyPair',
+                                  args[1] if len(args) > 1 else None)
+            if pair not in (None, 'all'):
+                endpoint = '%s %s' % (endpoint, pair)
+            # trade commands keep their full retry
+            if endpoint.split(' ')[0] in TRADE_COMMANDS:
+                breaker = None
             for delay in _chain(retryDelays, [None]):
+                # fail fast if command is known to be down
+                if breaker:
+                    breaker.check(endpoint)
                 try:
                     # attempt call
-                    return func(*args, **kwargs)
+                    ret = func(*args, **kwargs)
+                    if breaker:
+                        breaker.success(endpoint)
+                    return ret
 
                 # we need to try again
                 except RequestException as problem:
                     problems.append(problem)
-                    if delay is None:
+                    opened = breaker.failure(endpoint, problem) \
+                        if breaker else False
+                    if delay is None or opened:
                         Logger.debug(func, problems)
+                        # count for stats
+                        if api:
+                            api.failures += 1
+                        if opened:
+                            raise CircuitOpenException(
+                                '%s circuit open after %d failures: %s' %
+                                (endpoint, len(problems), str(problem)))
                         raise MaxRetriesException(
                             'retryDelays exhausted ' + str(problem))
                     else:
+                        if api:
+                            api.retries += 1
                         # log exception and wait
                         Logger.debug(func, problem)
                         Logger.info(func, "-- delaying for %ds" % delay)
@@ -154,13 +328,14 @@ class Poloniex(object):
         return retrying
 
     @_retry
-    def __call__(self, command, args={}):
+    def __call__(self, command, args={}, parser=None):
         """ Main Api Function
         - encodes and sends <command> with optional [args] to Poloniex api
         - raises 'poloniex.ExchangeError' if an api key or secret is missing
             (and the command is 'private'), if the <command> is not valid, or
             if an error is returned from poloniex.com
-        - returns decoded json api message """
+        - returns decoded json api message, or <parser> output on the
+            response body if given """
         # get command type
         cmdType = self._checkCmd(command)
 
@@ -172,11 +347,11 @@ class Poloniex(object):
 
         # private?
         if cmdType == 'Private':
-            payload['url'] = 'https://poloniex.com/tradingApi'
+            payload['url'] = self.privateUrl
 
             # wait for coach
             if self.coach:
-                self.coach.wait()
+                self.coach.wait('private')
 
             # set nonce
             args['nonce'] = self.nonce
@@ -195,26 +370,38 @@ class Poloniex(object):
                                   'Key': self.key}
 
             # send the call
-            ret = _post(**payload)
+            ret = self.session.post(**payload)
 
             # return data
+            if parser:
+                return self._handleParsed(ret.content, parser)
             return self._handleReturned(ret.text)
 
         # public?
         if cmdType == 'Public':
             # encode url
-            payload['url'] = 'https://poloniex.com/public?' + _urlencode(args)
+            payload['url'] = self.publicUrl + '?' + _urlencode(args)
 
             # wait for coach
             if self.coach:
-                self.coach.wait()
+                self.coach.wait('public')
 
             # send the call
-            ret = _get(**payload)
+            ret = self.session.get(**payload)
 
             # return data
+            if parser:
+                return self._handleParsed(ret.content, parser)
             return self._handleReturned(ret.text)
 
+    async def acall(self, command, args={}):
+        """ Async api call for asyncio code. Runs __call__ on a thread pool
+        sized to the session pool, so concurrent calls reuse its connections. """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.poolSize)
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, self.__call__, command, dict(args))
+
     @property
     def nonce(self):
         """ Increments the nonce"""
@@ -239,6 +426,14 @@ class Poloniex(object):
 
         raise ExchangeError("Invalid Command!: %s" % command)
 
+    def _handleParsed(self, data, parser):
+        """ Handles returned data with a fast parser. Errors and unexpected
+        layouts go through the json path """
+        try:
+            return parser(data)
+        except ValueError:
+            return parser(self._handleReturned(data.decode()))
+
     def _handleReturned(self, data):
         """ Handles returned data from poloniex"""
         try:
@@ -292,21 +487,26 @@ class Poloniex(object):
             'depth': str(depth)
         })
 
+    def returnTickerArray(self):
+        """ Returns the ticker as a numpy record array, one row per
+        market, with float64 numbers. """
+        return self.__call__('returnTicker', parser=parseTicker)
+
     @_retry
     def marketTradeHist(self, currencyPair, start=False, end=False):
         """ Returns the past 200 trades for a given market, or up to 50,000
         trades between a range specified in UNIX timestamps by the "start" and
         "end" parameters. """
         if self.coach:
-            self.coach.wait()
+            self.coach.wait('public')
         args = {'command': 'returnTradeHistory',
                 'currencyPair': str(currencyPair).upper()}
         if start:
             args['start'] = start
         if end:
             args['end'] = end
-        ret = _get(
-            'https://poloniex.com/public?' + _urlencode(args),
+        ret = self.session.get(
+            self.publicUrl + '?' + _urlencode(args),
             timeout=self.timeout)
         # decode json
         return self._handleReturned(ret.text)
@@ -332,6 +532,25 @@ class Poloniex(object):
             'end': str(end)
         })
 
+    def returnChartArray(self, currencyPair, period=False,
+                         start=False, end=False):
+        """ Returns candlestick chart data as a numpy record array with
+        int64 dates and float64 numbers. Same parameters as returnChartData.
+        Use returnChartData for exact decimals. """
+        period = int(period)
+        if period not in [300, 900, 1800, 7200, 14400, 86400]:
+            raise ExchangeError("%s invalid candle period" % str(period))
+        if not start or start == 'None':
+            start = datetime.utcnow().timestamp() - self.DAY
+        if not end or end == 'None':
+            end = datetime.utcnow().timestamp()
+        return self.__call__('returnChartData', {
+            'currencyPair': str(currencyPair).upper(),
+            'period': str(period),
+            'start': str(start),
+            'end': str(end)
+        }, parser=parseChartData)
+
     def returnCurrencies(self):
         """ Returns information about all currencies. """
         return self.__call__('returnCurrencies')
@@ -0,0 +1,486 @@
+"""
+Local exchange simulator
+
+Answers the commands FeedDaemon parses with Poloniex reply formats, so it can stand in for the
+Poloniex api behind a FeedDaemon, or be used directly as an ExchangeConnection:
+
+    sim = ExchangeSimulator(pairs=['USDT_BTC', 'USDT_ETH'], balance={'USDT': '1000'}, latency=0.05)
+    daemon = sim.serve('ipc:///tmp/sim.ipc', exchange='poloniex')
+    tapi = DataFeed(exchange='poloniex', addr='ipc:///tmp/sim.ipc')
+
+Prices either replay stored candles or follow a synthetic random walk. Each pair keeps an order book,
+rebuilt around the open price at every bar and consumed by fills.
+"""
+import math
+import threading
+from itertools import count
+from datetime import datetime, timezone
+from decimal import Decimal
+from time import time, sleep
+
+import numpy as np
+import pandas as pd
+
+from ..datafeed import ExchangeConnection, FeedDaemon
+from .poloniex import parseChartData
+from ..exceptions import *
+from ..utils import Logger
+
+dec_qua = Decimal('1E-8')
+
+
+def dec_str(x):
+    """
+    Poloniex style number string
+    """
+    return '{:f}'.format(Decimal(x).quantize(dec_qua))
+
+
+class ExchangeSimulator(ExchangeConnection):
+    """
+    Exchange simulator with order book, latency and error injection
+    """
+    def __init__(self, pairs=None, data=None, period=5, balance=None, fee='0.0025', maker_fee='0.0015',
+                 price=100.0, volatility=0.005, warmup=300, spread=0.001, tick=0.0005, depth=10, liquidity=1000.0,
+                 min_total='0.0001', latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_message='Connection timed out. Please try again.', stall_rate=0.0, stall_delay=30.0,
+                 seed=None, clock=time):
+        """
+        :param pairs: list: Pair symbols. Inferred from data, if given
+        :param data: dict: Pair symbol: candle DataFrame or records, as returned by returnChartData, to replay
+        :param period: int: Candle period in minutes
+        :param balance: dict: Symbol: initial amount
+        :param fee: str: Taker fee
+        :param maker_fee: str: Maker fee
+        :param price: float: Synthetic initial price
+        :param volatility: float: Synthetic log return std per candle
+        :param warmup: int: Candles of history before the start time
+        :param spread: float: Relative bid ask spread
+        :param tick: float: Relative price step between book levels
+        :param depth: int: Book levels per side
+        :param liquidity: float: Quote value per book level
+        :param min_total: str: Min order total, in quote units
+        :param latency: float: Seconds added to every call
+        :param jitter: float: Max random seconds added to latency
+        :param error_rate: float: Probability of a call failing with error_message
+        :param error_message: str: Injected error
+        :param stall_rate: float: Probability of a call taking stall_delay seconds, so clients time out
+        :param stall_delay: float: Stalled call duration
+        :param seed: int: Random seed
+        :param clock: callable: Epoch time source
+        """
+        self.period = period
+        self.clock = clock
+        self.random = np.random.RandomState(seed)
+        self.lock = threading.RLock()
+        self.nonce = 0
+
+        # Market parameters
+        self.fee = Decimal(fee)
+        self.maker_fee = Decimal(maker_fee)
+        self.spread = spread
+        self.tick = tick
+        self.depth = depth
+        self.liquidity = liquidity
+        self.min_total = Decimal(min_total)
+
+        # Fault injection
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_message = error_message
+        self.stall_rate = stall_rate
+        self.stall_delay = stall_delay
+        self.calls = {}
+
+        # Prices
+        self.volatility = volatility
+        self.candles = {}
+        if data:
+            self.synthetic = False
+            for pair, candles in data.items():
+                self.candles[pair] = self.load_candles(candles)
+            warmup = min([warmup] + [candles.shape[0] - 1 for candles in self.candles.values()])
+        else:
+            self.synthetic = True
+            for pair in pairs:
+                self.candles[pair] = self.make_candles(price, warmup + 1)
+        self.pairs = sorted(self.candles)
+
+        # Timeline: candle warmup opens at the start time bar
+        self.epoch = self.bar_open(self.clock()) - warmup * self.seconds
+
+        # Account
+        self.symbols = sorted(set(symbol for pair in self.pairs for symbol in pair.split('_')))
+        self.funds = {symbol: Decimal('0') for symbol in self.symbols}
+        for symbol, amount in (balance or {}).items():
+            self.funds[symbol] = Decimal(str(amount))
+
+        # Order books and orders
+        self.books = {}
+        self.open_orders = []
+        self.trades = []
+        self.order_ids = count(1)
+        self.trade_ids = count(1)
+
+    @property
+    def seconds(self):
+        return self.period * 60
+
+    def bar_open(self, t):
+        return math.floor(t / self.seconds) * self.seconds
+
+    # Prices
+    def load_candles(self, candles):
+        """
+        :param candles: DataFrame or list: Candle records
+        :return: numpy array: open, high, low, close, volume, quoteVolume columns
+        """
+        df = pd.DataFrame.from_records(candles) if isinstance(candles, list) else candles
+        df = df.sort_values('date')
+        if 'quoteVolume' not in df:
+            df['quoteVolume'] = df['volume']
+        return df[['open', 'high', 'low', 'close', 'volume', 'quoteVolume']].astype(np.float64).values
+
+    def make_candles(self, price, n):
+        """
+        Synthetic candles following a geometric random walk
+        :param price: float: First open
+        :param n: int: Number of candles
+        :return: numpy array: open, high, low, close, volume, quoteVolume columns
+        """
+        returns = self.random.normal(0.0, self.volatility, n)
+        close = price * np.exp(np.cumsum(returns))
+        opening = np.append(price, close[:-1])
+        wick = np.exp(np.abs(self.random.normal(0.0, self.volatility / 2, (2, n))))
+        high = np.maximum(opening, close) * wick[0]
+        low = np.minimum(opening, close) / wick[1]
+        volume = self.random.lognormal(0.0, 1.0, n) * self.liquidity
+        return np.column_stack([opening, high, low, close, volume, volume / close])
+
+    def index(self):
+        """
+        Current candle index. Replayed data holds on its last candle.
+        """
+        index = int((self.bar_open(self.clock()) - self.epoch) // self.seconds)
+        for pair in self.pairs:
+            candles = self.candles[pair]
+            if index >= candles.shape[0]:
+                if self.synthetic:
+                    self.candles[pair] = np.vstack([candles,
+                                                    self.make_candles(candles[-1, 3], index - candles.shape[0] + 1)])
+                else:
+                    index = candles.shape[0] - 1
+        return index
+
+    def get_price(self, pair):
+        """
+        Trading price within the current bar, its open
+        """
+        with self.lock:
+            return self.candles[pair][self.index(), 0]
+
+    def check_pair(self, pair):
+        if pair not in self.candles:
+            raise ExchangeError('Invalid currency pair.')
+
+    # Order book
+    def get_book(self, pair):
+        """
+        Order book for the current bar. Levels are [price, amount] Decimal pairs, best first.
+        :param pair: str: Pair symbol
+        :return: dict: asks and bids
+        """
+        with self.lock:
+            self.check_pair(pair)
+            index = self.index()
+            book = self.books.get(pair)
+            if book is None or book['index'] != index:
+                price = self.candles[pair][index, 0]
+                amount = Decimal(self.liquidity / price).quantize(dec_qua)
+                book = {'index': index,
+                        'asks': [[Decimal(price * (1 + self.spread / 2) * (1 + self.tick) ** i).quantize(dec_qua),
+                                  amount] for i in range(self.depth)],
+                        'bids': [[Decimal(price * (1 - self.spread / 2) * (1 - self.tick) ** i).quantize(dec_qua),
+                                  amount] for i in range(self.depth)]}
+                self.books[pair] = book
+                self.match_open_orders(pair)
+            return book
+
+    def match(self, pair, side, rate, amount):
+        """
+        Book levels an order would take, without changing the book
+        :return: tuple: list of (price, amount) fills, unfilled amount
+        """
+        levels = self.get_book(pair)['asks' if side == 'buy' else 'bids']
+        fills = []
+        for price, size in levels:
+            if amount <= 0 or (price > rate if side == 'buy' else price < rate):
+                break
+            qty = min(amount, size)
+            fills.append((price, qty))
+            amount -= qty
+        return fills, amount
+
+    def settle(self, pair, side, fills, fee):
+        """
+        Consume book levels and move balances
+        :return: list: Poloniex style resulting trades
+        """
+        quote, base = pair.split('_')
+        levels = self.books[pair]['asks' if side == 'buy' else 'bids']
+        trades = []
+        for price, qty in fills:
+            levels[0][1] -= qty
+            if levels[0][1] <= 0:
+                levels.pop(0)
+
+            total = (price * qty).quantize(dec_qua)
+            if side == 'buy':
+                self.funds[quote] -= total
+                self.funds[base] += (qty * (1 - fee)).quantize(dec_qua)
+            else:
+                self.funds[base] -= qty
+                self.funds[quote] += (total * (1 - fee)).quantize(dec_qua)
+
+            trade = {'amount': dec_str(qty),
+                     'date': datetime.fromtimestamp(self.clock(), timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                     'rate': dec_str(price),
+                     'total': dec_str(total),
+                     'tradeID': str(next(self.trade_ids)),
+                     'type': side}
+            trades.append(trade)
+            self.trades.append(dict(trade, currencyPair=pair, fee=dec_str(fee)))
+
+        return trades
+
+    def place_order(self, pair, side, rate, amount, order_type=None):
+        """
+        Fill an order against the book
+        :param order_type: str: immediateOrCancel, fillOrKill, postOnly or None for a resting limit order
+        :return: dict: Poloniex style order reply
+        """
+        with self.lock:
+            self.check_pair(pair)
+            quote, base = pair.split('_')
+            rate, amount = Decimal(rate), Decimal(amount)
+
+            # Poloniex checks
+            if rate * amount < self.min_total:
+                raise ExchangeError('Total must be at least %s.' % str(self.min_total))
+            if side == 'buy' and self.funds[quote] < rate * amount:
+                raise ExchangeError('Not enough %s.' % quote)
+            if side == 'sell' and self.funds[base] < amount:
+                raise ExchangeError('Not enough %s.' % base)
+
+            fills, unfilled = self.match(pair, side, rate, amount)
+
+            if order_type == 'postOnly' and fills:
+                raise ExchangeError('Unable to place post-only order at this price.')
+            if order_type == 'fillOrKill' and unfilled > 0:
+                raise ExchangeError('Unable to fill order completely.')
+
+            order_number = str(next(self.order_ids))
+            reply = {'orderNumber': order_number,
+                     'resultingTrades': self.settle(pair, side, fills, self.fee)}
+
+            if order_type in ['immediateOrCancel', 'fillOrKill']:
+                reply['amountUnfilled'] = dec_str(unfilled)
+            elif unfilled > 0:
+                self.open_orders.append({'orderNumber': order_number, 'currencyPair': pair, 'type': side,
+                                         'rate': rate, 'amount': unfilled})
+
+            return reply
+
+    def match_open_orders(self, pair):
+        """
+        Fill resting orders against a fresh book, as maker
+        """
+        for order in [order for order in self.open_orders if order['currencyPair'] == pair]:
+            quote, base = pair.split('_')
+            fills, unfilled = self.match(pair, order['type'], order['rate'], order['amount'])
+            funds = self.funds[quote] if order['type'] == 'buy' else self.funds[base]
+            needed = sum(price * qty for price, qty in fills) if order['type'] == 'buy' else \
+                order['amount'] - unfilled
+
+            # Orders without funds are canceled
+            if funds < needed:
+                self.open_orders.remove(order)
+                continue
+
+            self.settle(pair, order['type'], fills, self.maker_fee)
+            order['amount'] = unfilled
+            if unfilled <= 0:
+                self.open_orders.remove(order)
+
+    # Api entry point
+    def __call__(self, command, args={}):
+        """
+        FeedDaemon entry point. Same signature as Poloniex.__call__
+        :param command: str: Api command
+        :param args: dict: Command arguments
+        :return: Poloniex style reply
+        """
+        with self.lock:
+            self.calls[command] = self.calls.get(command, 0) + 1
+            delay = self.latency + self.jitter * self.random.random_sample()
+            if self.random.random_sample() < self.stall_rate:
+                delay += self.stall_delay
+            fail = self.random.random_sample() < self.error_rate
+
+        if delay > 0:
+            sleep(delay)
+
+        if fail:
+            Logger.debug(ExchangeSimulator.__call__, "Injected error on %s" % command)
+            raise ExchangeError(self.error_message)
+
+        if command == 'returnTicker':
+            return self._returnTicker()
+        elif command == 'returnBalances':
+            return self._returnBalances()
+        elif command == 'returnFeeInfo':
+            return self._returnFeeInfo()
+        elif command == 'returnCurrencies':
+            return self._returnCurrencies()
+        elif command == 'returnChartData':
+            return self._returnChartData(**args)
+        elif command == 'returnTradeHistory':
+            return self._returnTradeHistory(**args)
+        elif command in ['buy', 'sell']:
+            order_type = [key for key in ['immediateOrCancel', 'fillOrKill', 'postOnly'] if key in args]
+            return self.place_order(args['currencyPair'], command, args['rate'], args['amount'],
+                                    order_type[0] if order_type else None)
+
+        raise ExchangeError("Invalid Command!: %s" % command)
+
+    def serve(self, addr='ipc:///tmp/feed.ipc', exchange='poloniex', n_workers=8, **kwargs):
+        """
+        Start a FeedDaemon process serving this simulator
+        :param addr: str: Client side address
+        :param exchange: str: Exchange name clients query
+        :param n_workers: int: Daemon worker threads
+        :param kwargs: FeedDaemon options
+        :return: FeedDaemon: Started daemon process
+        """
+        daemon = FeedDaemon(api={exchange: self}, addr=addr, n_workers=n_workers, **kwargs)
+        daemon.daemon = True
+        daemon.start()
+        return daemon
+
+    # Command handlers
+    def _returnTicker(self):
+        with self.lock:
+            index = self.index()
+            ticker = {}
+            for i, pair in enumerate(self.pairs):
+                book = self.get_book(pair)
+                candles = self.candles[pair]
+                day = candles[max(0, index - int(86400 // self.seconds)):index + 1]
+                ticker[pair] = {'id': i + 1,
+                                'last': dec_str(candles[index, 0]),
+                                'lowestAsk': dec_str(book['asks'][0][0]) if book['asks'] else '0.00000000',
+                                'highestBid': dec_str(book['bids'][0][0]) if book['bids'] else '0.00000000',
+                                'percentChange': dec_str(candles[index, 0] / day[0, 0] - 1),
+                                'baseVolume': dec_str(day[:, 4].sum()),
+                                'quoteVolume': dec_str(day[:, 5].sum()),
+                                'isFrozen': '0',
+                                'high24hr': dec_str(day[:, 1].max()),
+                                'low24hr': dec_str(day[:, 2].min())}
+            return ticker
+
+    def _returnBalances(self):
+        with self.lock:
+            return {symbol: dec_str(amount) for symbol, amount in self.funds.items()}
+
+    def _returnFeeInfo(self):
+        return {'makerFee': dec_str(self.maker_fee),
+                'takerFee': dec_str(self.fee),
+                'thirtyDayVolume': '0.00000000',
+                'nextTier': '600.00000000'}
+
+    def _returnCurrencies(self):
+        return {symbol: {'id': i + 1, 'name': symbol, 'txFee': '0.00000000', 'minConf': 1, 'depositAddress': None,
+                         'disabled': 0, 'delisted': 0, 'frozen': 0} for i, symbol in enumerate(self.symbols)}
+
+    def _returnChartData(self, currencyPair, period=None, start=None, end=None):
+        with self.lock:
+            self.check_pair(currencyPair)
+            period = int(float(period)) if period else self.seconds
+            if period % self.seconds:
+                raise ExchangeError('Please specify a valid period.')
+            step = period // self.seconds
+
+            # Candles up to the current one, which is still open
+            index = self.index()
+            candles = self.candles[currencyPair][:index + 1].copy()
+            candles[index, 1:4] = candles[index, 0]
+            dates = self.epoch + np.arange(candles.shape[0]) * self.seconds
+
+            # Aggregate to the requested period
+            if step > 1:
+                groups = (dates // period).astype(np.int64)
+                df = pd.DataFrame(candles, columns=['open', 'high', 'low', 'close', 'volume', 'quoteVolume'])
+                df['date'] = groups * period
+                candles = df.groupby('date').agg({'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last',
+                                                  'volume': 'sum', 'quoteVolume': 'sum'})
+                dates = candles.index.values
+                candles = candles[['open', 'high', 'low', 'close', 'volume', 'quoteVolume']].values
+
+            start = float(start) if start not in [None, 'None'] else dates[0]
+            end = float(end) if end not in [None, 'None'] else dates[-1]
+            mask = (dates >= start) & (dates <= end)
+
+            return [{'date': int(date),
+                     'open': dec_str(row[0]),
+                     'high': dec_str(row[1]),
+                     'low': dec_str(row[2]),
+                     'close': dec_str(row[3]),
+                     'volume': dec_str(row[4]),
+                     'quoteVolume': dec_str(row[5]),
+                     'weightedAverage': dec_str((row[0] + row[3]) / 2)}
+                    for date, row in zip(dates[mask], candles[mask])]
+
+    def _returnTradeHistory(self, currencyPair='all', start=None, end=None):
+        with self.lock:
+            trades = {}
+            for trade in self.trades:
+                if currencyPair.lower() == 'all' or currencyPair == trade['currencyPair']:
+                    trades.setdefault(trade['currencyPair'], []).append(
+                        {key: value for key, value in trade.items() if key != 'currencyPair'})
+            return trades
+
+    # ExchangeConnection methods
+    def returnTicker(self):
+        return self.__call__('returnTicker')
+
+    def returnBalances(self):
+        return self.__call__('returnBalances')
+
+    def returnFeeInfo(self):
+        return self.__call__('returnFeeInfo')
+
+    def returnCurrencies(self):
+        return self.__call__('returnCurrencies')
+
+    def returnChartData(self, currencyPair, period, start=None, end=None):
+        return self.__call__('returnChartData', {'currencyPair': str(currencyPair).upper(), 'period': str(period),
+                                                 'start': str(start), 'end': str(end)})
+
+    def returnChartArray(self, currencyPair, period, start=None, end=None):
+        return parseChartData(self.returnChartData(currencyPair, period, start, end))
+
+    def returnTradeHistory(self, currencyPair='all', start=None, end=None):
+        return self.__call__('returnTradeHistory', {'currencyPair': currencyPair})
+
+    def sell(self, currencyPair, rate, amount, orderType=False):
+        args = {'currencyPair': str(currencyPair).upper(), 'rate': str(rate), 'amount': str(amount)}
+        if orderType:
+            args[orderType] = 1
+        return self.__call__('sell', args)
+
+    def buy(self, currencyPair, rate, amount, orderType=False):
+        args = {'currencyPair': str(currencyPair).upper(), 'rate': str(rate), 'amount': str(amount)}
+        if orderType:
+            args[orderType] = 1
+        return self.__call__('buy', args)
@@ -1,6 +1,7 @@
 import numpy as np
 import pandas as pd
 import talib as ta
+from collections import deque
 from cryptotrader.utils import safe_div
 
 
@@ -10,6 +11,18 @@ def price_relative(obs, period=1):
     return price_relative
 
 
+def price_relative_array(prices, period=1):
+    """
+    Price relative over a whole price array, same as price_relative last row at every step
+    :param prices: numpy array: Prices with shape (steps, symbols)
+    :param period: int: Lag period
+    :return: numpy array: Price relatives. First period rows are ones.
+    """
+    relative = np.ones_like(prices, dtype=np.float64)
+    relative[period:] = safe_div(prices[period:], prices[:-period])
+    return relative
+
+
 def momentum(obs, period=14):
     prices = obs.xs('open', level=1, axis=1).astype(np.float64)
     # mean_volume = obs.xs('volume', level=1, axis=1).astype(np.float64).apply(lambda x: safe_div(x[-period:-1].sum(),
@@ -32,4 +45,71 @@ class OLS(object):
         self.ls_intercept = Y.mean() - self.ls_coef_ * X.mean()
 
     def predict(self, X):
-        return self.ls_coef_ * X + self.ls_intercept
\ No newline at end of file
+        return self.ls_coef_ * X + self.ls_intercept
+
+
+class PivotDetector(object):
+    """
+    Streaming local extremum detector for a single price series.
+    A candle is a pivot when it is strictly greater or lower than the order candles on each side,
+    same as argrelextrema, so it gets confirmed order candles after it happens.
+    Each new candle costs O(order).
+    """
+    def __init__(self, order=7, maxlen=8):
+        """
+        :param order: int: Number of candles on each side to compare
+        :param maxlen: int: Number of confirmed pivots to keep
+        """
+        self.order = order
+        self.maxlen = maxlen
+        self.reset()
+
+    def reset(self):
+        self.window = deque(maxlen=2 * self.order + 1)
+        self.pivots = deque(maxlen=self.maxlen)
+        self.last_index = None
+
+    def update(self, price, index=None):
+        """
+        Push a new candle into the detector
+        :param price: float: Candle price
+        :param index: Candle index label
+        """
+        self.window.append((index, float(price)))
+        self.last_index = index
+
+        if len(self.window) == self.window.maxlen:
+            center_index, center = self.window[self.order]
+            others = [p for i, (_, p) in enumerate(self.window) if i != self.order]
+            if center > max(others) or center < min(others):
+                self.pivots.append((center_index, center))
+
+    def feed(self, series):
+        """
+        Update the detector with a price series, processing only candles after the last one seen.
+        If the series does not contain the last candle seen, the detector is rebuilt from the series.
+        :param series: pandas Series: Price series indexed by candle time
+        :return: numpy array: Confirmed pivots inside the series followed by its last price
+        """
+        index = series.index
+        if self.last_index is not None and self.last_index in index:
+            start = index.get_loc(self.last_index) + 1
+        else:
+            self.reset()
+            start = 0
+
+        for idx, price in zip(index[start:], series.values[start:]):
+            self.update(price, idx)
+
+        return self.extremes(since=index[0])
+
+    def extremes(self, since=None):
+        """
+        :param since: Drop pivots before this index label
+        :return: numpy array: Confirmed pivots followed by the last price
+        """
+        if not self.window:
+            return np.array([])
+        extremes = [p for i, p in self.pivots if since is None or i >= since]
+        extremes.append(self.window[-1][1])
+        return np.array(extremes, dtype=np.float64)
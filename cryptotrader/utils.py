@@ -5,13 +5,20 @@ from functools import partialmethod
 import zmq
 import msgpack
 from socket import gaierror
-from time import time, sleep
+from time import time, sleep, perf_counter
+import threading
+import json
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import wait, FIRST_COMPLETED
 import smtplib
 
 import numpy as np
 # from bson import Decimal128
 import math
 
+from .exceptions import CircuitOpenException
+
 # Decimal precision
 getcontext().prec = 64
 getcontext().Emax = 33
@@ -127,6 +134,400 @@ def floor_datetime(t, period):
     return t
 
 
+class BarScheduler(object):
+    """
+    Bar open trigger for live trading.
+    Fires once per bar, offset seconds after the bar boundary, or as soon as the feed
+    notifies that the bar candle has arrived, whichever comes first.
+    """
+    def __init__(self, period, offset=0.5, clock=time):
+        """
+        :param period: int: Bar period in minutes
+        :param offset: float: Seconds after bar open to fire
+        :param clock: callable: Epoch time source
+        """
+        self.period = period
+        self.offset = offset
+        self.clock = clock
+        self.event = threading.Event()
+        self.last_bar = None
+        self.notified = None
+        self.stopped = False
+        self.lags = deque(maxlen=1000)
+
+    @property
+    def seconds(self):
+        return self.period * 60
+
+    def bar_open(self, t=None):
+        """
+        Open timestamp of the bar containing t
+        :param t: float: Epoch time
+        :return: float: Epoch time
+        """
+        if t is None:
+            t = self.clock()
+        return math.floor(t / self.seconds) * self.seconds
+
+    def start(self, fire_now=False):
+        """
+        Skip the bar in progress, so the first trigger is the next bar open
+        :param fire_now: bool: Trigger the bar in progress right away
+        """
+        self.stopped = False
+        self.notified = None
+        self.event.clear()
+        self.last_bar = self.bar_open() - (self.seconds if fire_now else 0)
+
+    def stop(self):
+        self.stopped = True
+        self.event.set()
+
+    def notify(self, bar=None):
+        """
+        Signal a new candle on the feed. Safe to call from other threads.
+        :param bar: float: Epoch open time of the new candle. Defaults to current bar
+        """
+        if bar is None:
+            bar = self.bar_open()
+        if self.notified is None or bar > self.notified:
+            self.notified = bar
+        self.event.set()
+
+    def due(self, now):
+        """
+        Latest bar whose trigger time has passed
+        :param now: float: Epoch time
+        :return: float: Bar open epoch time
+        """
+        bar = self.bar_open(now)
+        if now - bar < self.offset:
+            bar -= self.seconds
+        if self.notified is not None and self.notified > bar:
+            bar = self.notified
+        return bar
+
+    def wait(self):
+        """
+        Block until the next bar trigger
+        :return: tuple: bar open epoch time, trigger lag in seconds. None if stopped
+        """
+        if self.last_bar is None:
+            self.start()
+
+        while not self.stopped:
+            now = self.clock()
+            bar = self.due(now)
+            if bar > self.last_bar:
+                self.last_bar = bar
+                lag = now - bar
+                self.lags.append(lag)
+                return bar, lag
+
+            # Sleep until next trigger time or feed notification
+            trigger = self.bar_open(now) + self.offset
+            if trigger <= now:
+                trigger += self.seconds
+            self.event.wait(trigger - now)
+            self.event.clear()
+
+    def run(self, callback):
+        """
+        Call callback(bar, lag) on every bar trigger until stopped
+        :param callback: callable
+        """
+        while True:
+            trigger = self.wait()
+            if trigger is None:
+                break
+            callback(*trigger)
+
+
+class LatencyHistogram(object):
+    """
+    Rolling latency histogram, HDR style.
+    Values go to logarithmic buckets, so percentiles have bounded relative error at any scale.
+    Only the last window samples are counted.
+    """
+    def __init__(self, window=1000, precision=0.01, lowest=1e-3):
+        """
+        :param window: int: Number of samples kept
+        :param precision: float: Max relative error of reported values
+        :param lowest: float: Lowest distinguishable value, in ms
+        """
+        self.precision = precision
+        self.lowest = lowest
+        self.log_base = math.log1p(precision)
+        self.samples = deque(maxlen=window)
+        self.counts = {}
+        self.total = 0
+
+    def __len__(self):
+        return len(self.samples)
+
+    def bucket(self, value):
+        if value <= self.lowest:
+            return 0
+        return int(math.ceil(math.log(value / self.lowest) / self.log_base))
+
+    def value(self, bucket):
+        """
+        Upper bound of bucket
+        """
+        return self.lowest * (1 + self.precision) ** bucket
+
+    def record(self, value):
+        """
+        :param value: float: Latency in ms
+        """
+        # Drop oldest sample
+        if len(self.samples) == self.samples.maxlen:
+            old = self.samples[0]
+            self.counts[old] -= 1
+            if not self.counts[old]:
+                del self.counts[old]
+
+        bucket = self.bucket(value)
+        self.samples.append(bucket)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+
+    def percentile(self, q):
+        """
+        :param q: float: Percentile, from 0 to 100
+        :return: float: Latency in ms
+        """
+        if not self.samples:
+            return float('nan')
+
+        rank = max(1, int(math.ceil(q / 100 * len(self.samples))))
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= rank:
+                return self.value(bucket)
+
+    def to_dict(self):
+        return OrderedDict([('count', len(self.samples)),
+                            ('total', self.total),
+                            ('p50', self.percentile(50)),
+                            ('p90', self.percentile(90)),
+                            ('p99', self.percentile(99)),
+                            ('max', self.percentile(100)),
+                            ('buckets', [[self.value(bucket), self.counts[bucket]]
+                                         for bucket in sorted(self.counts)])])
+
+
+class Timings(object):
+    """
+    Per stage latency histograms. Thread safe.
+    """
+    def __init__(self, window=1000, precision=0.01):
+        self.window = window
+        self.precision = precision
+        self.histograms = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __getitem__(self, stage):
+        return self.histograms[stage]
+
+    def __contains__(self, stage):
+        return stage in self.histograms
+
+    def record(self, stage, seconds):
+        """
+        :param stage: str: Stage name
+        :param seconds: float: Elapsed time
+        """
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = LatencyHistogram(self.window, self.precision)
+            self.histograms[stage].record(1000 * seconds)
+
+    @contextmanager
+    def measure(self, stage):
+        """
+        Time a block
+        :param stage: str: Stage name
+        """
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, perf_counter() - t0)
+
+    def summary(self, percentiles=(50, 99)):
+        """
+        :param percentiles: tuple: Percentiles to report
+        :return: OrderedDict: Percentile latencies in ms by stage
+        """
+        with self.lock:
+            return OrderedDict((stage, OrderedDict(('p%d' % q, hist.percentile(q)) for q in percentiles))
+                               for stage, hist in self.histograms.items())
+
+    def to_json(self, path=None):
+        """
+        Export histograms
+        :param path: str: File to write to
+        :return: str: JSON string
+        """
+        with self.lock:
+            data = json.dumps(OrderedDict((stage, hist.to_dict()) for stage, hist in self.histograms.items()))
+
+        if path:
+            with open(path, 'w') as f:
+                f.write(data)
+
+        return data
+
+    def reset(self):
+        with self.lock:
+            self.histograms = OrderedDict()
+
+
+class CircuitBreaker(object):
+    """
+    Per endpoint circuit breaker.
+    After max_failures failures in a row an endpoint is open and its calls fail fast. Every reset_timeout
+    seconds one trial call goes through: a success closes the endpoint, a failure keeps it open. Thread safe.
+    """
+    def __init__(self, max_failures=5, reset_timeout=30.0, clock=time):
+        """
+        :param max_failures: int: Failures in a row that open an endpoint. None never opens
+        :param reset_timeout: float: Seconds an open endpoint rejects calls before a trial call
+        :param clock: callable: Time source
+        """
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.endpoints = OrderedDict()
+
+    def endpoint(self, key):
+        if key not in self.endpoints:
+            self.endpoints[key] = {'failures': 0, 'opened': None, 'trips': 0, 'rejected': 0, 'last_error': None}
+        return self.endpoints[key]
+
+    def state(self, key):
+        """
+        :param key: str: Endpoint name
+        :return: str: closed, open or half_open, if a trial call is due
+        """
+        with self.lock:
+            opened = self.endpoints[key]['opened'] if key in self.endpoints else None
+        if opened is None:
+            return 'closed'
+        return 'open' if self.clock() - opened < self.reset_timeout else 'half_open'
+
+    def allow(self, key):
+        """
+        Whether a call may go through. A due trial call re-arms the timeout, so only one goes per period.
+        :param key: str: Endpoint name
+        :return: bool
+        """
+        with self.lock:
+            endpoint = self.endpoint(key)
+            if endpoint['opened'] is None:
+                return True
+            now = self.clock()
+            if now - endpoint['opened'] >= self.reset_timeout:
+                endpoint['opened'] = now
+                return True
+            endpoint['rejected'] += 1
+            return False
+
+    def check(self, key):
+        """
+        Raise if endpoint is open
+        :param key: str: Endpoint name
+        """
+        if not self.allow(key):
+            with self.lock:
+                endpoint = self.endpoint(key)
+                retry_in = endpoint['opened'] + self.reset_timeout - self.clock()
+                error = endpoint['last_error']
+            raise CircuitOpenException("%s circuit open, retry in %.1fs. Last error: %s" % (key, retry_in, error))
+
+    def success(self, key):
+        with self.lock:
+            endpoint = self.endpoint(key)
+            endpoint['failures'] = 0
+            endpoint['opened'] = None
+
+    def failure(self, key, error=None):
+        """
+        :param key: str: Endpoint name
+        :param error: Exception or str: Failure reason
+        :return: bool: Whether the endpoint is open
+        """
+        with self.lock:
+            endpoint = self.endpoint(key)
+            endpoint['failures'] += 1
+            endpoint['last_error'] = str(error) if error is not None else None
+            if endpoint['opened'] is not None:
+                # Failed trial call
+                endpoint['opened'] = self.clock()
+            elif self.max_failures is not None and endpoint['failures'] >= self.max_failures:
+                endpoint['opened'] = self.clock()
+                endpoint['trips'] += 1
+                Logger.error(CircuitBreaker.failure, "%s circuit open after %d failures: %s" %
+                             (key, endpoint['failures'], endpoint['last_error']))
+            return endpoint['opened'] is not None
+
+    def reset(self):
+        with self.lock:
+            self.endpoints = OrderedDict()
+
+    def stats(self):
+        """
+        :return: OrderedDict: state, failures in a row, times opened, rejected calls and last error by endpoint
+        """
+        with self.lock:
+            keys = list(self.endpoints.keys())
+        out = OrderedDict()
+        for key in keys:
+            state = self.state(key)
+            with self.lock:
+                endpoint = dict(self.endpoints[key])
+            out[key] = OrderedDict([('state', state),
+                                    ('failures', endpoint['failures']),
+                                    ('trips', endpoint['trips']),
+                                    ('rejected', endpoint['rejected']),
+                                    ('last_error', endpoint['last_error'])])
+        return out
+
+
+def hedged(executor, func, delay, attempts=2):
+    """
+    Call func, and call it again on another thread if it did not return within delay seconds.
+    The first call to return wins. Only for idempotent calls.
+    :param executor: concurrent.futures.Executor: Runs the calls
+    :param func: callable: Call with no arguments
+    :param delay: float: Seconds before each hedge call
+    :param attempts: int: Max calls sent
+    :return: tuple: func return, index of the winning call, calls sent. Raises the last error if all calls fail
+    """
+    pending = {executor.submit(func): 0}
+    sent = 1
+    error = None
+    while pending:
+        done, _ = wait(list(pending), timeout=delay if sent < attempts else None, return_when=FIRST_COMPLETED)
+
+        # Slow call, hedge it
+        if not done:
+            pending[executor.submit(func)] = sent
+            sent += 1
+            continue
+
+        for future in done:
+            index = pending.pop(future)
+            if future.exception() is None:
+                return future.result(), index, sent
+            error = future.exception()
+
+    raise error
+
+
 # Array methods
 def array_softmax(x, SAFETY=2.0):
     """
@@ -7,7 +7,12 @@ import pytest
 import mock
 from hypothesis import given, example, settings, strategies as st
 from hypothesis.extra.numpy import arrays, array_shapes
-from cryptotrader.envs.trading import TradingEnvironment, PaperTradingEnvironment, BacktestDataFeed
+from cryptotrader.envs.trading import TradingEnvironment, PaperTradingEnvironment, BacktestDataFeed, \
+    LiveTradingEnvironment
+from cryptotrader.datafeed import DataFeed
+from cryptotrader.exceptions import MaxRetriesException
+from time import time, sleep
+import threading
 from cryptotrader.utils import convert_to, array_normalize, array_softmax, floor_datetime
 from cryptotrader.spaces import Box, Tuple
 import numpy as np
@@ -41,6 +46,43 @@ def ready_env():
         yield env
         shutil.rmtree(os.path.join(os.path.abspath(os.path.curdir), 'logs'))
 
+@pytest.fixture
+def live_env():
+    live_tapi = mock.Mock(spec=DataFeed)
+    live_tapi.pairs = ["USDT_BTC", "USDT_ETH", "USDT_LTC", "USDT_XRP"]
+    live_tapi.configure_mock(**{'returnCurrencies.return_value': {symbol: {} for symbol in
+                                                                 ['BTC', 'ETH', 'LTC', 'XRP', 'USDT']},
+                                'returnFeeInfo.return_value': tapi.returnFeeInfo.return_value,
+                                'returnBalances.return_value': {'BTC': '1.00000000', 'ETH': '10.00000000',
+                                                                'LTC': '0.00000000', 'XRP': '0.00000000',
+                                                                'USDT': '1000.00000000'},
+                                'returnTicker.return_value': {pair: {'last': '10.00000000',
+                                                                     'highestBid': '9.99000000',
+                                                                     'lowestAsk': '10.01000000'}
+                                                              for pair in live_tapi.pairs}})
+
+    # Orders take a while to fill. Track how many are in flight at once.
+    live_tapi.in_flight = live_tapi.max_in_flight = 0
+    lock = threading.Lock()
+
+    def order(pair, price, amount, orderType=False):
+        with lock:
+            live_tapi.in_flight += 1
+            live_tapi.max_in_flight = max(live_tapi.max_in_flight, live_tapi.in_flight)
+        sleep(0.2)
+        with lock:
+            live_tapi.in_flight -= 1
+        if pair == 'USDT_XRP':
+            raise ValueError("Order failed")
+        return {'amountUnfilled': '0.00000000'}
+
+    live_tapi.sell.side_effect = order
+    live_tapi.buy.side_effect = order
+
+    yield LiveTradingEnvironment(period=5, obs_steps=10, tapi=live_tapi, fiat="USDT", name='live_env_test',
+                                 order_workers=2)
+    shutil.rmtree(os.path.join(os.path.abspath(os.path.curdir), 'logs'))
+
 @pytest.fixture
 def data_feed():
     df = BacktestDataFeed(tapi, period=5, pairs=["USDT_BTC", "USDT_ETH"], balance={"BTC":'1.00000000',
@@ -421,7 +463,253 @@ class Test_env_step(object):
 # LIVETRADING ENVIRONMENT TESTS
 
 
-if __name__ == '__main__':
-    pytest.main()
+def test_parallel_history(live_env):
+    env = live_env
+    env.fetch_workers = 2
+    period = env.period * 60
+    calls = []
+    lock = threading.Lock()
+    env.tapi.in_flight = env.tapi.max_in_flight = 0
+
+    def chart_data(pair, period, start=None, end=None):
+        with lock:
+            calls.append(pair)
+            env.tapi.in_flight += 1
+            env.tapi.max_in_flight = max(env.tapi.max_in_flight, env.tapi.in_flight)
+        sleep(0.2)
+        with lock:
+            env.tapi.in_flight -= 1
+        # XRP fails on its first request only
+        if pair == 'USDT_XRP' and calls.count(pair) == 1:
+            raise MaxRetriesException("Chart data failed")
+        start = int(np.ceil(start / period) * period)
+        return [{'date': date, 'open': '1.0', 'high': '1.0', 'low': '1.0', 'close': '1.0',
+                 'volume': '1.0'} for date in range(start, int(end) + 1, period)]
+
+    env.tapi.returnChartData.side_effect = chart_data
+
+    t0 = time()
+    obs = env.get_history()
+    elapsed = time() - t0
+
+    # Bounded parallelism
+    assert env.tapi.max_in_flight == 2
+    assert elapsed < 4 * 0.2 + 0.2 + 0.15
+    # Only the failed pair is fetched again
+    assert sorted(calls) == sorted(env.pairs + ['USDT_XRP'])
+    assert list(obs.columns.levels[0]) == env.pairs
+    assert obs.shape[0] >= env.obs_steps
+
+
+# LIVE TRADING TESTS
+def test_execute_orders(live_env):
+    t0 = time()
+    results = live_env.execute_orders([('BTC', '0.5'), ('ETH', '5'), ('LTC', '1')], 'sell')
+
+    # Legs run concurrently, bounded by order_workers
+    assert time() - t0 < 0.55
+    assert live_env.tapi.max_in_flight == 2
+    assert list(results.keys()) == ['BTC', 'ETH', 'LTC']
+    assert all(leg['filled'] and leg['side'] == 'sell' and leg['error'] is None for leg in results.values())
+
+
+def test_rebalance_legs(live_env):
+    balance_change = convert_to.decimal(np.array([-0.5, -5, 1, 1, 0]))
+
+    assert live_env.rebalance_sell(balance_change)
+    assert live_env.tapi.sell.call_count == 2
+
+    # A failed leg does not stop the others
+    assert not live_env.rebalance_buy(balance_change)
+    assert live_env.tapi.buy.call_count == 2
+    assert live_env.order_results['LTC']['filled']
+    assert not live_env.order_results['XRP']['filled']
+    assert isinstance(live_env.order_results['XRP']['error'], ValueError)
+    assert [leg['side'] for leg in live_env.order_results.values()] == ['sell', 'sell', 'buy', 'buy']
+
+    # Every leg is timed, failed ones included
+    assert len(live_env.timings['execute']) == 4
+    assert live_env.timings['execute'].percentile(50) >= 200
+
+
+def test_buy_legs_share_fiat(live_env):
+    # Orders are checked against the fiat balance when placed and settle when filled, like the exchange
+    balance = {'BTC': Decimal('0'), 'ETH': Decimal('0'), 'LTC': Decimal('0'), 'XRP': Decimal('0'),
+               'USDT': Decimal('1000')}
+    lock = threading.Lock()
+    spent = []
+
+    def buy(pair, price, amount, orderType=False):
+        cost = Decimal(price) * Decimal(amount)
+        with lock:
+            if cost > balance['USDT']:
+                return 'Not enough USDT.'
+        sleep(0.1)
+        with lock:
+            balance['USDT'] -= cost
+            spent.append(cost)
+        return {'amountUnfilled': '0.00000000'}
+
+    live_env.tapi.buy.side_effect = buy
+    live_env.tapi.returnBalances.side_effect = lambda: {symbol: str(value) for symbol, value in balance.items()}
+
+    # Together both legs ask for more than twice the fiat balance
+    balance_change = convert_to.decimal(np.array([120, 150, 0, 0, 0]))
+    assert live_env.rebalance_buy(balance_change)
+
+    assert live_env.tapi.buy.call_count == 4
+    assert balance['USDT'] >= 0
+    assert sum(spent) <= Decimal('1000')
+    assert live_env.status['NotEnoughFiat'] == 2
+    assert live_env.fiat_budget == {}
+
+
+def test_market_snapshot(live_env):
+    live_env.tapi.reset_mock()
+    action = convert_to.decimal(np.array([0.2, 0.2, 0.2, 0.2, 0.2]))
+
+    # One ticker and one balance call for all step consumers
+    live_env.calc_total_portval()
+    live_env.calc_portfolio_vector()
+    live_env.calc_desired_balance_array(action)
+    live_env.get_balance_array()
+    assert live_env.tapi.returnTicker.call_count == 1
+    assert live_env.tapi.returnBalances.call_count == 1
+
+    # Fills invalidate it
+    live_env.immediate_sell('BTC', '0.5')
+    assert live_env.tapi.returnTicker.call_count == 1
+    live_env.calc_total_portval()
+    assert live_env.tapi.returnTicker.call_count == 2
+    assert live_env.tapi.returnBalances.call_count == 2
+    assert live_env.snapshot.calls == {'returnTicker': 2, 'returnBalances': 2}
+
+    # And so does ttl
+    live_env.snapshot.ttl = 0
+    sleep(0.01)
+    live_env.calc_total_portval()
+    assert live_env.tapi.returnTicker.call_count == 3
+
+
+def test_candle_cache(live_env):
+    env = live_env
+    period = env.period * 60
+
+    def chart_data(pair, period, start=None, end=None):
+        start = int(np.ceil(start / period) * period)
+        return [{'date': date, 'open': str(date), 'high': str(date), 'low': str(date), 'close': str(date),
+                 'volume': '1.0'} for date in range(start, int(end) + 1, period)]
+
+    env.tapi.returnChartData.side_effect = chart_data
+
+    now = floor_datetime(datetime.now(timezone.utc), env.period)
+    index = pd.date_range(end=now - pd.Timedelta(minutes=env.period), freq="%dT" % env.period, periods=env.obs_steps)
+
+    # Seed buffer with the whole window
+    df = env.get_ohlc('USDT_BTC', index)
+    assert env.tapi.returnChartData.call_count == 1
+    assert env.tapi.returnChartData.call_args[1]['start'] == datetime.timestamp(index[0])
+    assert list(df.open) == [str(int(datetime.timestamp(t))) for t in index]
+
+    # Complete candles are served from memory
+    assert env.get_ohlc('USDT_BTC', index).equals(df)
+    assert env.tapi.returnChartData.call_count == 1
+
+    # Next bar fetches only the new candle, which is still open
+    index = index.shift(1)
+    df = env.get_ohlc('USDT_BTC', index)
+    assert env.tapi.returnChartData.call_count == 2
+    assert env.tapi.returnChartData.call_args[1]['start'] == datetime.timestamp(index[-1])
+    assert list(df.open) == [str(int(datetime.timestamp(t))) for t in index]
+
+    # Incomplete candle is fetched again
+    env.get_ohlc('USDT_BTC', index)
+    assert env.tapi.returnChartData.call_count == 3
+    assert env.tapi.returnChartData.call_args[1]['start'] == datetime.timestamp(index[-1])
+
+
+def test_subscriber_mode(live_env):
+    env = live_env
+    period = env.period * 60
+
+    def chart_data(pair, period, start=None, end=None):
+        start = int(np.ceil(start / period) * period)
+        return [{'date': date, 'open': str(date), 'high': str(date), 'low': str(date), 'close': str(date),
+                 'volume': '1.0'} for date in range(start, int(end) + 1, period)]
+
+    env.tapi.returnChartData.side_effect = chart_data
+
+    with mock.patch('cryptotrader.envs.trading.CandleSubscriber') as subscriber:
+        scheduler = env.subscribe()
+    assert env.scheduler is scheduler and scheduler.period == env.period
+    assert [call[0] for call in subscriber.return_value.subscribe.call_args_list] == [(pair, period)
+                                                                                      for pair in env.pairs]
+    subscriber.return_value.start.assert_called_once_with()
+
+    # Seed buffers with complete candles
+    now = floor_datetime(datetime.now(timezone.utc), env.period)
+    index = pd.date_range(end=now - pd.Timedelta(minutes=env.period), freq="%dT" % env.period, periods=env.obs_steps)
+    for pair in env.pairs:
+        env.get_ohlc(pair, index)
+    assert env.tapi.returnChartData.call_count == len(env.pairs)
+
+    # Broadcast candles extend the buffers
+    date = int(datetime.timestamp(now))
+    ticker = {'USDT_BTC': {'last': '1.00000000'}}
+    for pair in env.pairs:
+        assert scheduler.notified is None
+        env.on_candle(pair, period, chart_data(pair, period, date, date)[0], ticker)
+    assert scheduler.notified == date + period
+    assert env.snapshot.returnTicker() == ticker
+
+    # So the next bar needs no fetch
+    index = index.shift(1)
+    df = env.get_ohlc('USDT_BTC', index)
+    assert env.tapi.returnChartData.call_count == len(env.pairs)
+    assert list(df.open) == [str(int(datetime.timestamp(t))) for t in index]
+
+    # Out of order candles are left to get_candles
+    env.on_candle('USDT_BTC', period, chart_data('USDT_BTC', period, date + 2 * period, date + 2 * period)[0], None)
+    assert env.candles[('USDT_BTC', env.period)]['data'].index[-1] == now
+
+    env.unsubscribe()
+    subscriber.return_value.stop.assert_called_once_with()
+    assert env.scheduler is None
+
+
+def test_candle_during_fetch(live_env):
+    env = live_env
+    period = env.period * 60
+    now = floor_datetime(datetime.now(timezone.utc), env.period)
+    date = int(datetime.timestamp(now))
+    clock = mock.Mock(return_value=date + 1.0)
+    env.clock = clock
+
+    def chart_data(pair, period, start=None, end=None):
+        start = int(np.ceil(start / period) * period)
+        return [{'date': date, 'open': str(date), 'high': str(date), 'low': str(date), 'close': str(date),
+                 'volume': '1.0'} for date in range(start, int(end) + 1, period)]
+
+    env.tapi.returnChartData.side_effect = chart_data
+    index = pd.date_range(end=now - pd.Timedelta(minutes=env.period), freq="%dT" % env.period, periods=env.obs_steps)
+    try:
+        env.get_ohlc('USDT_BTC', index)
+
+        # The bar in progress is fetched open, and its closed candle is broadcast before the fetch returns
+        def open_candle(pair, period, start=None, end=None):
+            clock.return_value = date + period + 1.0
+            env.on_candle(pair, period, dict(chart_data(pair, period, date, date)[0], close='closed'), None)
+            return [dict(candle, close='open') for candle in chart_data(pair, period, start, end)]
+
+        env.tapi.returnChartData.side_effect = open_candle
+        env.get_candles('USDT_BTC', index[0], now)
+
+        buffer = env.candles[('USDT_BTC', env.period)]
+        assert buffer['data'].close.iat[-1] == 'closed' and buffer['data'].index[-1] == now
+        assert buffer['next'] == now + pd.Timedelta(minutes=env.period)
+    finally:
+        env.clock = None
 
 
+if __name__ == '__main__':
+    pytest.main()
@@ -0,0 +1,221 @@
+"""
+Test apriori agents
+"""
+import os
+import shutil
+import pytest
+import numpy as np
+import pandas as pd
+import mock
+
+from cryptotrader.datafeed import BacktestDataFeed
+from cryptotrader.envs.trading import BacktestEnvironment
+from cryptotrader.agents import apriori
+from cryptotrader.models.apriori import PivotDetector
+from scipy.signal import argrelextrema
+
+from .mocks import *
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'notebooks', 'data', 'test')
+pairs = ["USDT_BTC", "USDT_ETH", "USDT_LTC"]
+data_length = 100
+
+
+# Fixtures
+@pytest.fixture(scope='module')
+def backtest_env():
+    data_feed = BacktestDataFeed(tapi, period=30, pairs=pairs, balance={"BTC": '0.00000000',
+                                                                        "ETH": '0.00000000',
+                                                                        "LTC": '0.00000000',
+                                                                        "USDT": '100.00000000'})
+    for pair in pairs:
+        df = pd.read_json(os.path.join(data_dir, pair + '_30min'), convert_dates=False, orient='records',
+                          date_unit='s', keep_default_dates=False, dtype=False).iloc[:data_length]
+        df.set_index('date', inplace=True, drop=False)
+        data_feed.ohlc_data[pair] = df
+    data_feed.data_length = data_length
+
+    yield BacktestEnvironment(period=30, obs_steps=10, tapi=data_feed, fiat="USDT", name='replay_test')
+    shutil.rmtree(os.path.join(os.path.abspath(os.path.curdir), 'logs'))
+
+
+# REPLAY TESTS
+# Every agent with a replay path, and its test params
+replay_agents = [cls for cls in vars(apriori).values() if isinstance(cls, type) and
+                 issubclass(cls, apriori.APrioriAgent) and cls is not apriori.APrioriAgent and
+                 'replay_step' in vars(cls)]
+replay_params = {apriori.OLMAR: {'window': 5, 'eps': 1.02},
+                 apriori.OGS: {'lr': 0.1}}
+
+
+@pytest.mark.parametrize('agent_class', replay_agents, ids=lambda cls: cls.__name__)
+def test_replay_matches_test(backtest_env, agent_class):
+    env = backtest_env
+    agent = agent_class(fiat="USDT", **replay_params.get(agent_class, {}))
+    agent.test(env)
+
+    portval = env.portfolio_df.portval.astype(np.float64).values
+    prices = np.column_stack([env.tapi.ohlc_data[pair].open.astype(np.float64).values
+                              for pair in pairs])[:env.data_length - 1]
+
+    weights, turnover, wealth = agent.replay(prices, fee=0.0025, start=env.obs_steps + 1)
+
+    assert weights.shape == (portval.shape[0] - 1, len(pairs) + 1)
+    assert np.allclose(weights.sum(axis=1), 1.0)
+    assert turnover.shape == wealth.shape == (portval.shape[0] - 1,)
+    assert np.allclose(wealth, portval[1:] / portval[0], atol=1e-3)
+
+
+def test_replay_not_supported():
+    with pytest.raises(NotImplementedError):
+        apriori.CWMR(fiat="USDT").replay(np.ones((10, 2)))
+
+
+# PIVOT DETECTOR TESTS
+@pytest.mark.parametrize('order', [1, 3, 7])
+def test_pivot_detector_matches_argrelextrema(order):
+    prices = np.random.RandomState(order).normal(size=300).cumsum() + 100
+    detector = PivotDetector(order=order, maxlen=prices.shape[0])
+    for i, price in enumerate(prices):
+        detector.update(price, i)
+
+    # Confirmed pivots are the ones with order candles on both sides
+    idx = np.concatenate([argrelextrema(prices, np.greater, order=order)[0],
+                          argrelextrema(prices, np.less, order=order)[0]])
+    idx = np.sort(idx[(idx >= order) & (idx < prices.shape[0] - order)])
+
+    assert [i for i, _ in detector.pivots] == list(idx)
+    assert np.allclose(detector.extremes(), np.append(prices[idx], prices[-1]))
+
+
+def test_pivot_detector_feed():
+    prices = pd.Series(np.random.RandomState(0).normal(size=200).cumsum() + 100,
+                       index=pd.date_range('2017-01-01', periods=200, freq='30min'))
+    detector = PivotDetector(order=3)
+    for t in range(50, 200):
+        window = prices.iloc[t - 50:t]
+        full = PivotDetector(order=3)
+        full.feed(prices.iloc[:t])
+        assert np.allclose(detector.feed(window), full.extremes(since=window.index[0]))
+        assert detector.last_index == window.index[-1]
+
+    # Going back in time rebuilds the detector
+    assert np.allclose(detector.feed(prices.iloc[:50]), PivotDetector(order=3).feed(prices.iloc[:50]))
+
+
+# ARENA TESTS
+def test_arena_matches_test(backtest_env):
+    env = backtest_env
+    make_agents = lambda: [apriori.OLMAR(window=5, eps=1.02, fiat="USDT"),
+                           apriori.PAMR(fiat="USDT"),
+                           apriori.OLMAR(window=10, eps=1.02, fiat="USDT")]
+
+    arena = apriori.Arena(make_agents())
+    results = arena.run(env)
+
+    assert list(arena.agents.keys()) == ['OLMAR', 'PAMR', 'OLMAR_1']
+    assert set(results.index) == set(arena.agents.keys())
+    assert results.error.isnull().all()
+
+    portval = arena.get_portval()
+    for name, agent in zip(arena.agents.keys(), make_agents()):
+        agent.test(env)
+        assert np.allclose(portval[name].values, env.portfolio_df.portval.astype(np.float64).values)
+        assert np.isclose(results.at[name, 'portval'], np.float64(env.portfolio_df.portval.iloc[-1]))
+
+
+def test_arena_runs_twice(backtest_env):
+    env = backtest_env
+    arena = apriori.Arena([apriori.OLMAR(window=5, eps=1.02, fiat="USDT"),
+                           apriori.PAMR(fiat="USDT"),
+                           apriori.OGS(lr=0.1, fiat="USDT"),
+                           apriori.MW(fiat="USDT"),
+                           apriori.TCO(fiat="USDT"),
+                           apriori.ConstantRebalance(fiat="USDT")])
+
+    arena.run(env)
+    first = arena.get_portval().copy()
+    arena.run(env)
+    second = arena.get_portval()
+
+    assert first.shape == second.shape
+    assert np.allclose(first.values, second.values)
+
+
+# FIT TESTS
+def test_sample_episodes(backtest_env):
+    env = backtest_env
+    episodes = env.sample_episodes(5, seed=42)
+
+    assert np.all(episodes == env.sample_episodes(5, seed=42))
+    assert np.all((episodes >= env.obs_steps) & (episodes <= env.data_length - 3))
+
+    env.training = True
+    env.start_index = episodes[0]
+    try:
+        first = env.reset()
+        assert env.index == episodes[0] + 1
+        assert first.equals(env.reset())
+    finally:
+        env.training = False
+        env.start_index = None
+
+
+def test_evaluate_cache(backtest_env, tmpdir):
+    env = backtest_env
+    agent = apriori.OLMAR(fiat="USDT")
+    params = {'window': 5, 'eps': 1.02}
+    episodes = [20, 40]
+    path = str(tmpdir.join('cache.jsonl'))
+
+    cache = apriori.RewardCache(path)
+    r, rstd = agent.evaluate(env, params, episodes, cache, nb_max_episode_steps=20)
+    assert len(cache) == 2 and cache.hits == 0
+    assert env.start_index is None
+
+    # Resumed evaluation reads rewards from disk and runs no backtest
+    cache = apriori.RewardCache(path)
+    with mock.patch.object(apriori.Agent, 'test') as test:
+        assert agent.evaluate(env, params, episodes, cache, nb_max_episode_steps=20) == (r, rstd)
+        test.assert_not_called()
+    assert cache.hits == 2
+
+    # Another episode is a miss
+    agent.evaluate(env, params, [30], cache, nb_max_episode_steps=20)
+    assert len(apriori.RewardCache(path)) == 3
+
+
+def test_sample_search_space():
+    hp = {'ma1': [2, 10], 'ma2': [10, 20]}
+    search_space = {'mean_type': {'simple': hp, 'exp': hp, 'none': None}, 'alpha': [0, 1]}
+    random_state = np.random.RandomState(0)
+
+    for _ in range(20):
+        params = apriori.sample_search_space(search_space, random_state)
+        assert params['mean_type'] in search_space['mean_type']
+        assert 0 <= params['alpha'] <= 1
+        if params['mean_type'] == 'none':
+            assert set(params) == {'mean_type', 'alpha'}
+        else:
+            assert 2 <= params['ma1'] <= 10 and 10 <= params['ma2'] <= 20
+
+
+def test_successive_halving(backtest_env):
+    env = backtest_env
+    agent = apriori.OLMAR(fiat="USDT")
+    cache = apriori.RewardCache()
+
+    params, info = agent.successive_halving(env, 4, [20, 30, 40, 50], cache, {'window': [2, 8], 'eps': [1.0, 1.1]},
+                                            [lambda window, eps: window > 3], eta=2, seed=0, verbose=0,
+                                            nb_max_episode_steps=5)
+
+    assert params['window'] > 3
+    assert [(rung['configs'], rung['episodes']) for rung in info['rungs']] == [(4, 1), (2, 2), (1, 4)]
+    # Promoted configs only run their new episodes
+    assert info['budget'] == 4 + 2 + 2
+    assert info['full_budget'] == 16
+    assert info['optimum'] == info['rungs'][-1]['best']
+
+
+if __name__ == '__main__':
+    pytest.main()
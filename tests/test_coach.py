@@ -0,0 +1,91 @@
+"""
+Test api rate limiters
+"""
+import threading
+import multiprocessing
+import pytest
+from time import time, sleep
+
+from cryptotrader.exchange_api.coach import TokenBucket, Coach
+
+
+class Clock(object):
+    def __init__(self, t):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+    def sleep(self, seconds):
+        self.t += seconds
+
+
+def test_token_bucket():
+    clock = Clock(1000.0)
+    bucket = TokenBucket(rate=5, capacity=5, clock=clock, sleep=clock.sleep)
+
+    # Burst up to capacity, then one call every 1 / rate seconds
+    assert [bucket.acquire() for _ in range(5)] == [0.0] * 5
+    assert bucket.acquire() == pytest.approx(0.2)
+    assert bucket.acquire() == pytest.approx(0.2)
+    assert clock.t == pytest.approx(1000.4)
+
+    # Refills while idle, never above capacity
+    clock.t += 10
+    assert bucket.tokens == 5
+
+    stats = bucket.stats()
+    assert stats['calls'] == 7 and stats['waited'] == 2
+    assert stats['wait_time'] == pytest.approx(0.4)
+    assert stats['max'] == pytest.approx(200, rel=0.02)
+
+
+def test_no_thread_per_call():
+    bucket = TokenBucket(rate=1000, capacity=1)
+    threads = threading.active_count()
+    t0 = time()
+    for _ in range(100):
+        bucket.acquire()
+        assert threading.active_count() == threads
+    assert time() - t0 >= 0.09
+
+
+def test_coach_buckets():
+    coach = Coach(timeFrame=1.0, callLimit=2, privateLimit=1)
+    for bucket in coach.buckets.values():
+        bucket.sleep = lambda seconds: None
+
+    assert coach.wait('public') == coach.wait('public') == 0.0
+    assert coach.wait('private') == 0.0
+    assert coach.wait('Public') > 0 and coach.wait('private') > 0
+    assert coach.stats()['public']['calls'] == 3 and coach.stats()['private']['calls'] == 2
+
+    # One bucket for all calls by default
+    coach = Coach()
+    assert coach.buckets['public'] is coach.buckets['private']
+    assert list(coach.stats()) == ['public']
+
+
+def calls(path, n, out):
+    bucket = TokenBucket(rate=20, capacity=1, path=path)
+    for _ in range(n):
+        bucket.acquire()
+    out.put(time())
+
+
+def test_shared_bucket(tmpdir):
+    path = str(tmpdir.join('bucket'))
+    out = multiprocessing.Queue()
+    t0 = time()
+    procs = [multiprocessing.Process(target=calls, args=(path, 5, out)) for _ in range(2)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+
+    # 10 calls at 20 per second, whatever the process
+    assert max(out.get(), out.get()) - t0 >= 0.4
+
+
+if __name__ == '__main__':
+    pytest.main()
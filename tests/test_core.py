@@ -0,0 +1,67 @@
+"""
+Test core agent loop
+"""
+import pytest
+import mock
+import numpy as np
+import pandas as pd
+from decimal import Decimal
+
+from cryptotrader.core import Agent
+from cryptotrader.utils import BarScheduler, Timings
+from cryptotrader.exceptions import CircuitOpenException
+
+
+# TRADE LOOP TESTS
+def test_trade_runs_on_bar_trigger():
+    env = mock.Mock()
+    env.period = 1
+    env.calc_total_portval.return_value = Decimal('100.0')
+    env.get_observation.return_value = pd.DataFrame([[1.0]])
+    env.step.return_value = (pd.DataFrame([[1.0]]), 0.01, True, {'Error': False})
+    env.timings = Timings()
+
+    scheduler = mock.Mock(spec=BarScheduler)
+    scheduler.wait.side_effect = [(60.0, 0.001), (120.0, 0.001), None]
+
+    agent = Agent(name='scheduled')
+    agent.rebalance = mock.Mock(return_value=np.array([0.0, 1.0]))
+
+    with mock.patch('cryptotrader.core.time', return_value=120.005):
+        agent.trade(env, scheduler=scheduler)
+
+    assert env.step.call_count == agent.rebalance.call_count == 2
+    assert agent.step == 2
+    assert agent.log["Bar latency"] == "trigger 1.0 ms, orders 5.0 ms"
+    scheduler.start.assert_called_once_with(fire_now=False)
+    scheduler.stop.assert_called_once_with()
+    assert env.wait_bar
+    assert [len(env.timings[stage]) for stage in ['observe', 'decide', 'bar_to_orders']] == [2, 2, 2]
+    assert np.isclose(env.timings['bar_to_orders'].percentile(0), 5.0, rtol=0.01)
+
+    # Portval is read after the orders, not between the decision and the orders
+    calls = [call[0] for call in env.method_calls if call[0] in ('calc_total_portval', 'step')]
+    assert calls == ['calc_total_portval', 'step', 'calc_total_portval', 'step', 'calc_total_portval']
+
+
+def test_trade_waits_through_open_circuit():
+    env = mock.Mock()
+    env.period = 1
+    env.calc_total_portval.return_value = Decimal('100.0')
+    env.get_observation.side_effect = [CircuitOpenException('returnChartData circuit open'), pd.DataFrame([[1.0]])]
+    env.step.return_value = (pd.DataFrame([[1.0]]), 0.01, True, {'Error': False})
+    env.timings = Timings()
+
+    scheduler = mock.Mock(spec=BarScheduler)
+    scheduler.wait.side_effect = [(60.0, 0.001), (120.0, 0.001), None]
+
+    agent = Agent(name='circuit')
+    agent.rebalance = mock.Mock(return_value=np.array([0.0, 1.0]))
+
+    # Open circuit skips the bar, like exhausted retries, and the next bar trades
+    with mock.patch('cryptotrader.core.time', return_value=120.005):
+        agent.trade(env, scheduler=scheduler)
+
+    assert scheduler.wait.call_count == 3
+    assert env.step.call_count == agent.rebalance.call_count == 1
+    assert agent.step == 1
@@ -0,0 +1,780 @@
+"""
+Test FeedDaemon and DataFeed
+"""
+import json
+import pytest
+import msgpack
+import zmq
+import numpy as np
+import pandas as pd
+import threading
+import asyncio
+import mock
+import math
+import queue
+from decimal import Decimal
+from time import time, sleep
+from itertools import chain, repeat
+from hypothesis import given, strategies as st
+
+from cryptotrader.datafeed import DataFeed, PROTOCOL, pack_request, unpack_request, pack_reply, unpack_reply, \
+    to_fixed, ResponseCache, PipelinedDataFeed, FeedDaemon, \
+    CandleSubscriber, reciprocal, pair_reciprocal, FeedMetrics, RecordingFeed, ReplayFeed, pack_log, unpack_log
+from cryptotrader.exchange_api.simulator import ExchangeSimulator
+from cryptotrader.exceptions import DataFeedException, RequestTimeoutException, MaxRetriesException, \
+    ExchangeError, ReplayException, CircuitOpenException, UnexpectedResponseException
+
+from .mocks import *
+
+
+class Clock(object):
+    def __init__(self, t):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+# Fixtures
+@pytest.fixture(scope='module')
+def daemon(tmpdir_factory):
+    sim = ExchangeSimulator(pairs=['USDT_BTC', 'BTC_ETH'], balance={'BTC': '1'}, seed=0)
+    addr = 'ipc://' + str(tmpdir_factory.mktemp('feed').join('feed.ipc'))
+    daemon = sim.serve(addr, exchange='sim', n_workers=2)
+    yield addr
+    daemon.terminate()
+    daemon.join()
+
+
+# PROTOCOL TESTS
+@given(st.decimals(min_value=-10 ** 10, max_value=10 ** 10, places=8))
+def test_to_fixed(value):
+    assert to_fixed(str(value)) == int(value * 10 ** 8)
+
+
+def test_chart_data_frames():
+    frames = pack_reply(chart_data, 'numpy')
+    assert frames[0] == PROTOCOL
+    assert len(frames) == 2 + len(chart_data[0])
+
+    # Exact values, as strings
+    records = unpack_reply(frames)
+    for record, original in zip(records, chart_data):
+        assert record['date'] == original['date']
+        for key in original:
+            assert Decimal(record[key]) == Decimal(str(original[key]))
+
+    # Or straight to floats
+    df = unpack_reply(frames, frame=True)
+    assert df.date.dtype == np.int64
+    assert np.array_equal(df.close.values, pd.DataFrame.from_records(chart_data).close.astype(float).values)
+
+
+@given(st.lists(st.decimals(min_value='0.00000001', max_value=10 ** 9, places=8), min_size=1))
+def test_reciprocal_exact(values):
+    # Same as Decimal division quantized to 8 places, in exchange format
+    expected = [(Decimal('1') / value).quantize(Decimal('0E-8')) for value in values]
+    for text in [['%.8f' % value for value in values], [str(value.normalize()) for value in values]]:
+        result = reciprocal(text)
+        assert [Decimal(value) for value in result] == expected
+        assert all(len(value.partition('.')[2]) == 8 for value in result)
+
+
+def test_pair_reciprocal():
+    records = [{'date': 1, 'high': '0.07010000', 'low': '0.06990000', 'open': '0.07000000', 'close': '0.0700',
+                'volume': '12.30000000', 'quoteVolume': '170.20000000'}]
+    inverted = pair_reciprocal(records)
+    assert inverted == [{'date': 1, 'high': '14.30615165', 'low': '14.26533524', 'open': '14.28571429',
+                         'close': '14.28571429', 'volume': '170.20000000', 'quoteVolume': '12.30000000'}]
+
+    # DataFrames keep strings exact and floats as floats
+    assert pair_reciprocal(pd.DataFrame.from_records(records)).to_dict('records') == inverted
+    df = pair_reciprocal(pd.DataFrame.from_records(records).astype({'high': float, 'low': float, 'open': float,
+                                                                    'close': float}))
+    assert df.high.dtype == np.float64
+    assert np.allclose(df[['high', 'low', 'open', 'close']].values,
+                       pd.DataFrame.from_records(inverted)[['high', 'low', 'open', 'close']].astype(float).values)
+
+    with pytest.raises(ZeroDivisionError):
+        pair_reciprocal([dict(records[0], low='0.00000000')])
+
+
+def test_pair_reciprocal_number_cells():
+    # Whole prices come back as int from the exchange json, other sources may give float or Decimal
+    records = [{'date': 1, 'high': 2, 'low': 0.5, 'open': Decimal('0.25'), 'close': '0.50000000',
+                'volume': '12.30000000', 'quoteVolume': '170.20000000'}]
+    inverted = pair_reciprocal(records)
+    assert inverted == [{'date': 1, 'high': '2.00000000', 'low': '0.50000000', 'open': '4.00000000',
+                         'close': '2.00000000', 'volume': '170.20000000', 'quoteVolume': '12.30000000'}]
+
+    # Number columns stay float, object columns holding Decimals give exact strings
+    df = pair_reciprocal(pd.DataFrame.from_records(records))
+    assert df.high.dtype == np.float64 and np.allclose(df[['high', 'low']].values, [[2.0, 0.5]])
+    assert df[['open', 'close']].to_dict('records') == [{'open': '4.00000000', 'close': '2.00000000'}]
+    assert reciprocal(np.array([Decimal('0.3'), 1e-05], dtype=object)) == ['3.33333333', '100000.00000000']
+
+
+def test_request_version():
+    frames = pack_request('poloniex', 'returnChartData', ['USDT_BTC', 300, None, None])
+    assert unpack_request(frames) == {'v': 1, 'exchange': 'poloniex', 'command': 'returnChartData',
+                                      'args': ['USDT_BTC', '300', 'None', 'None'], 'encoding': 'numpy'}
+
+    frames[1] = msgpack.packb({'v': 0})
+    with pytest.raises(DataFeedException):
+        unpack_request(frames)
+
+
+# CACHE TESTS
+def chart_call(start, end):
+    return 'sim', 'returnChartData', {'currencyPair': 'USDT_BTC', 'period': '300', 'start': str(start), 'end': str(end)}
+
+
+def test_cache_ttl():
+    clock = Clock(1500000100.0)
+    cache = ResponseCache(clock=clock)
+    calls = []
+
+    def fetch(call):
+        calls.append(call)
+        args = call[2] if len(call) > 2 else {}
+        if call[1] == 'returnChartData':
+            return [{'date': date} for date in range(int(args['start']), int(args['end']) + 1, 300)]
+        return {'t': clock.t}
+
+    # Ranges within the same candles share the upstream call, each gets its own slice
+    dates = lambda start, end: [{'date': date} for date in range(start, end + 1, 300)]
+    assert cache.get(chart_call(1499997010, 1500000100), fetch) == dates(1499997300, 1500000000)
+    assert cache.get(chart_call(1499997000, 1500000299), fetch) == dates(1499997000, 1500000000)
+    assert len(calls) == 1 and calls[0][2]['start'] == '1499997000'
+    assert cache.get(chart_call(1499997000, 1499999000), fetch) == dates(1499997000, 1499998800)
+    assert len(calls) == 2
+
+    # Windows between candles get the exchange empty range reply, not candles out of range
+    assert cache.get(chart_call(1499997010, 1499997100), fetch) == [{'date': 0}]
+    assert len(calls) == 3 and calls[2][2]['start'] == calls[2][2]['end'] == '1499997000'
+    array = np.array([(1499997000, 1.5)], dtype=[('date', np.int64), ('close', np.float64)])
+    empty = cache.select(chart_call(1499997010, 1499997100), array)
+    assert empty.dtype == array.dtype and empty.tolist() == [(0, 0.0)]
+
+    # Expires at the next candle open
+    clock.t = 1500000300.0
+    cache.get(chart_call(1499997000, 1500000299), fetch)
+    assert len(calls) == 4
+
+    # Ticker has its own ttl, private calls are never cached
+    cache.get(('sim', 'returnTicker'), fetch)
+    clock.t += 0.5
+    cache.get(('sim', 'returnTicker'), fetch)
+    clock.t += 1.0
+    cache.get(('sim', 'returnTicker'), fetch)
+    cache.get(('sim', 'returnBalances'), fetch)
+    cache.get(('sim', 'returnBalances'), fetch)
+    assert [call[1] for call in calls[4:]] == ['returnTicker', 'returnTicker', 'returnBalances', 'returnBalances']
+    assert cache.stats()['hits'] == 2 and cache.stats()['misses'] == 6
+
+    # Errors are not cached
+    assert cache.get(('sim', 'returnCurrencies'), lambda call: 'Please try again.') == 'Please try again.'
+    assert cache.get(('sim', 'returnCurrencies'), fetch) == {'t': clock.t}
+
+
+def test_cache_coalescing():
+    cache = ResponseCache()
+    release = threading.Event()
+    calls = []
+
+    def fetch(call):
+        calls.append(call)
+        release.wait(5)
+        return {'USDT_BTC': {'last': '1'}}
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get(('sim', 'returnTicker'), fetch)))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    while cache.stats()['coalesced'] < 7:
+        sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [{'USDT_BTC': {'last': '1'}}] * 8
+    assert cache.stats()['misses'] == 1
+
+
+# LANE TESTS
+def test_priority_lanes():
+    daemon = FeedDaemon(api={}, n_workers=3, min_workers=1, idle_timeout=0.01)
+    daemon.start_worker = mock.Mock(side_effect=lambda: setattr(daemon, 'workers', daemon.workers + 1))
+
+    for pair in ['USDT_BTC', 'USDT_ETH', 'USDT_LTC']:
+        daemon.enqueue([b'client', b''], [('sim returnChartData %s 300 None None' % pair).encode()])
+    daemon.enqueue([b'client', b''], pack_request('sim', 'sell', ['USDT_BTC', '1', '1']))
+    daemon.enqueue([b'client', b''], [b'sim returnBalances'])
+
+    # Pool grows with the queue, up to n_workers
+    assert daemon.start_worker.call_count == 3
+    assert daemon.queue_stats()['depth'] == {'trade': 1, 'account': 1, 'market': 3}
+
+    # Trading first, then account queries, then market data
+    assert [daemon.next_task()[0] for _ in range(4)] == ['trade', 'account', 'market', 'market']
+
+    # One thread is kept free for trading
+    assert daemon.next_task() is None
+    daemon.workers = 1
+    daemon.busy['market'] -= 1
+    task = daemon.next_task()
+    assert task[0] == 'market' and task[2] == [b'sim returnChartData USDT_LTC 300 None None']
+
+    stats = daemon.queue_stats()
+    assert stats['depth'] == {'trade': 0, 'account': 0, 'market': 0}
+    assert stats['max_depth'] == {'trade': 1, 'account': 1, 'market': 3}
+
+
+def test_trading_not_delayed(tmpdir):
+    sim = ExchangeSimulator(pairs=['USDT_BTC', 'USDT_ETH', 'USDT_LTC', 'USDT_XRP'], balance={'BTC': '1'}, seed=0,
+                            latency=0.2)
+    addr = 'ipc://' + str(tmpdir.join('feed.ipc'))
+    daemon = sim.serve(addr, exchange='sim', n_workers=3, min_workers=1, cache=False)
+    feed = PipelinedDataFeed(exchange='sim', addr=addr, timeout=5)
+    try:
+        # Warm up synthetic prices
+        feed.returnTicker()
+
+        t0 = time()
+        charts = [feed.request('returnChartData %s 300 None None' % pair)
+                  for pair in ['USDT_BTC', 'USDT_ETH', 'USDT_LTC', 'USDT_XRP']]
+        sleep(0.05)
+        assert feed.sell('USDT_BTC', '1', '0.1', 'immediateOrCancel')['amountUnfilled'] == '0.00000000'
+        assert time() - t0 < 0.35
+        assert all(isinstance(chart.result(), list) for chart in charts)
+        assert time() - t0 > 0.35
+
+        stats = feed.queueStats()
+        assert stats['workers'] == 3
+        assert stats['served']['market'] == 5 and stats['served']['trade'] == 1
+        assert {'market', 'trade'} <= set(stats['wait'])
+    finally:
+        feed.close()
+        daemon.terminate()
+        daemon.join()
+
+
+# DAEMON TESTS
+def test_binary_matches_json(daemon):
+    binary = DataFeed(exchange='sim', addr=daemon, timeout=5)
+    legacy = DataFeed(exchange='sim', addr=daemon, timeout=5, binary=False)
+    now = time()
+
+    for pair in ['USDT_BTC', 'ETH_BTC']:
+        records = legacy.returnChartData(pair, 300, now - 86400, now)
+        assert binary.returnChartData(pair, 300, now - 86400, now) == records
+
+        df = binary.returnChartFrame(pair, 300, now - 86400, now)
+        assert np.allclose(df[['open', 'high', 'low', 'close']].astype(float).values,
+                           pd.DataFrame.from_records(records)[['open', 'high', 'low', 'close']].astype(float).values)
+
+    assert binary.returnBalances() == legacy.returnBalances()
+    assert binary.sell('USDT_BTC', '1', '5', 'immediateOrCancel') == 'Not enough BTC.'
+
+
+def test_float_chart_frames(daemon):
+    feed = DataFeed(exchange='sim', addr=daemon, timeout=5)
+    now = time()
+    records = feed.returnChartData('USDT_BTC', 300, now - 86400, now)
+
+    df = feed.returnChartFrame('USDT_BTC', 300, now - 86400, now)
+    assert df.close.dtype == np.float64
+    assert np.allclose(df[['open', 'high', 'low', 'close']].values,
+                       pd.DataFrame.from_records(records)[['open', 'high', 'low', 'close']].astype(float).values)
+
+
+def test_float_encoding():
+    sim = ExchangeSimulator(pairs=['USDT_BTC'], seed=0)
+    feed_daemon = FeedDaemon(api={'sim': sim}, cache=False)
+    args = ['USDT_BTC', '300', 'None', 'None']
+
+    # Float requests are decoded by the exchange connection, others keep exact decimals
+    with mock.patch.object(sim, 'returnChartArray', wraps=sim.returnChartArray) as array:
+        exact = unpack_reply(feed_daemon.process(pack_request('sim', 'returnChartData', args)), frame=True)
+        assert not array.called
+        fast = unpack_reply(feed_daemon.process(pack_request('sim', 'returnChartData', args, 'float')), frame=True)
+        assert array.call_count == 1
+
+    assert np.allclose(fast[['open', 'high', 'low', 'close']].values, exact[['open', 'high', 'low', 'close']].values)
+    assert np.array_equal(fast.date.values, exact.date.values)
+
+
+def test_chart_data_multi(daemon):
+    feed = DataFeed(exchange='sim', addr=daemon, timeout=5)
+    legacy = DataFeed(exchange='sim', addr=daemon, timeout=5, binary=False)
+    pairs = ['USDT_BTC', 'ETH_BTC']
+    end = time() // 300 * 300 - 300
+    start = end - 86400
+
+    # Same candles as one request per pair, reciprocal included
+    multi = feed.returnChartDataMulti(pairs, 300, start, end)
+    assert list(multi.keys()) == pairs
+    for pair in pairs:
+        assert multi[pair] == feed.returnChartData(pair, 300, start, end)
+    assert legacy.returnChartDataMulti(pairs, 300, start, end) == multi
+
+    # One float64 frame, aligned on date
+    for df in [feed.returnChartFrameMulti(pairs, 300, start, end),
+               legacy.returnChartFrameMulti(pairs, 300, start, end)]:
+        assert list(df.columns.levels[0]) == sorted(pairs)
+        assert list(df.index) == [candle['date'] for candle in multi['USDT_BTC']]
+        for pair in pairs:
+            assert np.allclose(df[pair][['open', 'high', 'low', 'close']].values,
+                               pd.DataFrame.from_records(multi[pair])[['open', 'high', 'low', 'close']]
+                               .astype(float).values)
+
+    with mock.patch.object(DataFeed, 'retryDelays', []), pytest.raises(MaxRetriesException):
+        feed.returnChartFrameMulti(['USDT_BTC', 'USDT_XRP'], 300, start, end)
+
+
+def test_chart_multi_alignment():
+    sim = ExchangeSimulator(pairs=['USDT_BTC', 'BTC_ETH'], seed=0, clock=Clock(1500000000.0))
+    feed_daemon = FeedDaemon(api={'sim': sim}, n_workers=2)
+    args = {'currencyPairs': ['USDT_BTC', 'ETH_BTC'], 'period': '300', 'start': '1499990000', 'end': '1500000000'}
+    btc = sim.returnChartArray('USDT_BTC', 300, 1499990000, 1500000000)
+    eth = sim.returnChartArray('BTC_ETH', 300, 1499990000, 1500000000)
+
+    def chart_array(currencyPair, period, start=None, end=None):
+        if currencyPair == 'ETH_BTC':
+            raise ExchangeError('Invalid currency pair.')
+        return btc[2:] if currencyPair == 'USDT_BTC' else eth
+
+    # Candles missing on one pair are dropped from all
+    with mock.patch.object(sim, 'returnChartArray', side_effect=chart_array):
+        out = feed_daemon.chart_multi(('sim', 'returnChartDataMulti', args), 'float')
+
+    assert np.array_equal(out['date'], btc['date'][2:])
+    assert np.allclose(out['USDT_BTC close'], btc['close'][2:])
+
+    # Reversed pair is inverted
+    assert np.allclose(out['ETH_BTC close'], 1 / eth['close'][2:])
+    assert np.allclose(out['ETH_BTC high'], 1 / eth['low'][2:])
+    assert np.allclose(out['ETH_BTC volume'], eth['quoteVolume'][2:])
+
+    assert feed_daemon.chart_multi(('sim', 'returnChartDataMulti', dict(args, currencyPairs=['USDT_XRP']))) == \
+        'USDT_XRP: Invalid currency pair.'
+
+
+# METRICS TESTS
+def test_feed_health():
+    clock = Clock(1000.0)
+    metrics = FeedMetrics(window=60, max_error_rate=0.2, max_latency=1.0, min_calls=3, clock=clock)
+    assert metrics.health()['status'] == 'ok'
+
+    for i in range(8):
+        metrics.record('upstream', 'polo', 'returnTicker', 0.1)
+    metrics.record('upstream', 'polo', 'returnTicker', 0.1, 'Connection timed out. Please try again.')
+    metrics.record('upstream', 'sim', 'returnTicker', 2.0)
+    health = metrics.health()
+    assert health['exchanges']['polo']['status'] == 'ok'
+    assert health['exchanges']['polo']['error_rate'] == pytest.approx(1 / 9)
+    assert health['exchanges']['polo']['last_error']['error'] == 'Connection timed out. Please try again.'
+    assert health['exchanges']['sim']['status'] == 'degraded'
+    assert health['status'] == 'degraded'
+
+    # Old calls leave the window
+    clock.t += 61
+    for i in range(3):
+        metrics.record('upstream', 'polo', 'returnTicker', 0.1, 'retryDelays exhausted')
+    health = metrics.health()
+    assert health['exchanges']['polo']['status'] == 'down' and health['exchanges']['sim']['calls'] == 0
+    assert health['status'] == 'down'
+
+    summary = metrics.summary('upstream')
+    assert summary['polo returnTicker']['count'] == 12 and summary['polo returnTicker']['errors'] == 4
+    assert set(summary['polo returnTicker']) == {'count', 'errors', 'p50', 'p90', 'p99', 'p100'}
+
+
+def test_daemon_metrics():
+    sim = ExchangeSimulator(pairs=['USDT_BTC'], balance={'BTC': '1'}, seed=0)
+    feed_daemon = FeedDaemon(api={'sim': sim}, n_workers=2)
+    for req in ['sim returnTicker', 'sim returnTicker', 'sim returnBalances', 'sim returnChartData XXX_YYY 300 None None']:
+        feed_daemon.process([req.encode()])
+    sim.error_rate = 1.0
+    feed_daemon.process([b'sim returnBalances'])
+
+    metrics = unpack_reply(feed_daemon.process(pack_request('sim', 'metrics', [])))
+    assert metrics['requests']['sim returnTicker']['count'] == 2
+    assert metrics['requests']['sim returnChartData']['errors'] == 1
+    assert metrics['requests']['sim returnBalances'] == dict(metrics['requests']['sim returnBalances'], count=2,
+                                                             errors=1)
+
+    # Cache hits do not go upstream, and rejected calls do not count against the exchange
+    assert metrics['upstream']['sim returnTicker']['count'] == 1
+    assert metrics['upstream']['sim returnChartData']['errors'] == 0
+    assert metrics['upstream']['sim returnBalances']['errors'] == 1
+    assert metrics['cache']['hits'] == 1
+    assert metrics['health']['exchanges']['sim']['calls'] == 4
+    assert {'utilisation', 'workers', 'busy', 'served'} <= set(metrics['workers'])
+    json.dumps(metrics)
+
+
+def test_health_while_busy(tmpdir):
+    sim = ExchangeSimulator(pairs=['USDT_BTC'], balance={'BTC': '1'}, seed=0, latency=1.0)
+    addr = 'ipc://' + str(tmpdir.join('health.ipc'))
+    daemon = sim.serve(addr, exchange='sim', n_workers=1, min_workers=1)
+    feed = PipelinedDataFeed(exchange='sim', addr=addr, timeout=5)
+    try:
+        assert feed.health()['status'] == 'ok'
+
+        # Broker answers while the only worker is busy and requests wait
+        balances = [feed.submit('returnBalances') for _ in range(2)]
+        sleep(0.2)
+        t0 = time()
+        health = feed.health()
+        assert time() - t0 < 0.5
+        assert health['saturated'] and health['queue_depth'] == 1 and health['status'] == 'degraded'
+
+        assert all(future.result(5)['BTC'] == '1.00000000' for future in balances)
+        assert feed.metrics()['requests']['sim returnBalances']['count'] == 2
+    finally:
+        feed.close()
+        daemon.terminate()
+        daemon.join()
+
+
+def test_hedged_requests():
+    sim = ExchangeSimulator(pairs=['USDT_BTC'], balance={'BTC': '1'}, seed=0, stall_rate=0.5, stall_delay=1.0)
+    feed_daemon = FeedDaemon(api={'sim': sim}, cache=False, hedge_after=0.05)
+
+    # First upstream call stalls, its hedge does not
+    with mock.patch.object(sim, 'random') as random:
+        random.random_sample.side_effect = chain([0.0, 0.0], repeat(0.9))
+        t0 = time()
+        ticker = unpack_reply(feed_daemon.process(pack_request('sim', 'returnTicker', [])))
+        assert time() - t0 < 0.5
+        assert 'USDT_BTC' in ticker
+        feed_daemon.process(pack_request('sim', 'returnTicker', []))
+        feed_daemon.process(pack_request('sim', 'returnBalances', []))
+
+    metrics = feed_daemon.get_metrics()
+    assert metrics['hedges'] == {'sim returnTicker': {'sent': 1, 'won': 1}}
+    assert metrics['upstream']['sim returnTicker']['count'] == 2
+    assert sim.calls == {'returnTicker': 3, 'returnBalances': 1}
+    json.dumps(metrics)
+
+
+def test_feed_circuit_breaker():
+    clock = Clock(1000.0)
+    feed = DataFeed(exchange='sim', addr='ipc:///tmp/breaker_test.ipc', timeout=1,
+                    breaker={'max_failures': 3, 'reset_timeout': 30.0, 'clock': clock})
+
+    # Retries stop once the method is open, then calls fail fast
+    with mock.patch.object(DataFeed, 'retryDelays', [0] * 8), \
+            mock.patch.object(feed, 'get_response', side_effect=RequestTimeoutException('timedout')) as rep:
+        with pytest.raises(CircuitOpenException):
+            feed.returnTicker()
+        assert rep.call_count == 3
+        with pytest.raises(CircuitOpenException):
+            feed.returnTicker()
+        assert rep.call_count == 3
+
+    assert feed.stats()['breaker']['returnTicker']['state'] == 'open'
+
+    # Trial call after the reset timeout closes it
+    clock.t += 30
+    with mock.patch.object(feed, 'get_response', return_value={'USDT_BTC': {}}):
+        assert feed.returnTicker() == {'USDT_BTC': {}}
+    assert feed.stats()['breaker']['returnTicker']['state'] == 'closed'
+
+
+def test_feed_circuit_per_pair():
+    clock = Clock(1000.0)
+    feed = DataFeed(exchange='sim', addr='ipc:///tmp/breaker_pair_test.ipc', timeout=1,
+                    breaker={'max_failures': 3, 'reset_timeout': 30.0, 'clock': clock})
+    candles = [{'date': 1, 'open': '1.00000000', 'close': '1.00000000'}]
+
+    # One failing pair does not open the method for other pairs
+    with mock.patch.object(DataFeed, 'retryDelays', [0] * 8), \
+            mock.patch.object(feed, 'get_response', side_effect=UnexpectedResponseException('bad')):
+        with pytest.raises(CircuitOpenException):
+            feed.returnChartData('USDT_BTC', 300)
+    with mock.patch.object(feed, 'get_response', return_value=candles):
+        assert feed.returnChartData('USDT_ETH', 300) == candles
+        with pytest.raises(CircuitOpenException):
+            feed.returnChartData(currencyPair='USDT_BTC', period=300)
+    assert feed.stats()['breaker']['returnChartData USDT_BTC']['state'] == 'open'
+    assert feed.stats()['breaker']['returnChartData USDT_ETH']['state'] == 'closed'
+
+    # Orders go through every retry delay, the breaker stays out of it
+    with mock.patch.object(DataFeed, 'retryDelays', [0] * 8), \
+            mock.patch.object(feed, 'get_response', side_effect=RequestTimeoutException('timedout')) as rep:
+        with pytest.raises(MaxRetriesException) as error:
+            feed.buy('USDT_BTC', '1', '1')
+        assert not isinstance(error.value, CircuitOpenException)
+        assert rep.call_count == 9
+    assert 'buy USDT_BTC' not in feed.stats()['breaker']
+
+
+def test_reconnect_replaces_socket():
+    feed = DataFeed(exchange='sim', addr='ipc:///tmp/reconnect_test.ipc', timeout=0.01)
+    for _ in range(3):
+        with pytest.raises(RequestTimeoutException):
+            feed.get_response('returnTicker')
+
+    # Timed out sockets are closed and replaced, not kept
+    assert len(feed._socks) == 1 and feed._socks[0] is feed.sock
+    assert not feed.sock.closed
+
+
+def test_daemon_cache(daemon):
+    feed = DataFeed(exchange='sim', addr=daemon, timeout=5)
+    before = feed.cacheStats()
+    ticker = feed.returnTicker()
+    assert feed.returnTicker() == ticker
+    feed.returnBalances()
+
+    stats = feed.cacheStats()
+    assert stats['hits'] + stats['coalesced'] - before['hits'] - before['coalesced'] >= 1
+    assert stats['hits'] + stats['misses'] + stats['coalesced'] - before['hits'] - before['misses'] - \
+        before['coalesced'] == 2
+
+
+def test_pipelined_requests(tmpdir):
+    sim = ExchangeSimulator(pairs=['USDT_BTC', 'USDT_ETH', 'BTC_ETH'], balance={'BTC': '1'}, seed=0, latency=0.2)
+    addr = 'ipc://' + str(tmpdir.join('feed.ipc'))
+    daemon = sim.serve(addr, exchange='sim', n_workers=4, cache=False)
+    feed = PipelinedDataFeed(exchange='sim', addr=addr, timeout=5)
+    try:
+        assert feed.returnBalances()['BTC'] == '1.00000000'
+
+        # All in flight at once over one socket
+        t0 = time()
+        futures = [feed.submit('returnChartFrame', pair, 300) for pair in ['USDT_BTC', 'USDT_ETH', 'ETH_BTC']]
+        frames = [future.result() for future in futures]
+        assert time() - t0 < 0.6
+        assert len(feed._socks) == 1
+        assert all(df.shape[0] == frames[0].shape[0] for df in frames)
+
+        async def tickers():
+            return await asyncio.gather(*[feed.call('returnTicker') for _ in range(4)])
+
+        loop = asyncio.new_event_loop()
+        t0 = time()
+        assert all('USDT_BTC' in ticker for ticker in loop.run_until_complete(tickers()))
+        assert time() - t0 < 0.6
+        loop.close()
+
+        # Legacy json replies
+        legacy = PipelinedDataFeed(exchange='sim', addr=addr, timeout=5, binary=False)
+        assert legacy.returnChartData('USDT_BTC', 300)[-1] == feed.returnChartData('USDT_BTC', 300)[-1]
+        legacy.close()
+    finally:
+        feed.close()
+        daemon.terminate()
+        daemon.join()
+
+
+def test_pipelined_timeout(tmpdir):
+    feed = PipelinedDataFeed(exchange='sim', addr='ipc://' + str(tmpdir.join('none.ipc')), timeout=0.1)
+    future = feed.request('returnTicker')
+    with pytest.raises(RequestTimeoutException):
+        future.result(5)
+
+    pending = feed.request('returnTicker')
+    feed.close()
+    with pytest.raises(DataFeedException):
+        pending.result(5)
+
+
+class FastScheduler(object):
+    """ Fires the current bar every 0.2 s """
+    def __init__(self, period, offset=0.5, clock=time):
+        self.seconds = period * 60
+
+    def start(self):
+        pass
+
+    def wait(self):
+        sleep(0.2)
+        return math.floor(time() / self.seconds) * self.seconds, 0.0
+
+
+def test_candle_broadcast(tmpdir):
+    sim = ExchangeSimulator(pairs=['USDT_BTC', 'BTC_ETH'], seed=0)
+    addr = 'ipc://' + str(tmpdir.join('feed.ipc'))
+    with mock.patch('cryptotrader.datafeed.BarScheduler', FastScheduler):
+        daemon = sim.serve(addr, exchange='sim', n_workers=2, pub_addr='ipc://' + str(tmpdir.join('pub.ipc')))
+
+    feed = DataFeed(exchange='sim', addr=addr, timeout=5)
+    received = queue.Queue()
+    subscriber = CandleSubscriber(feed, lambda *args: received.put(args))
+    try:
+        assert subscriber.subscribe('USDT_BTC', 300)['reciprocal'] is False
+        assert subscriber.subscribe('ETH_BTC', 300)['pair'] == 'BTC_ETH'
+        with pytest.raises(DataFeedException):
+            subscriber.subscribe('USDT_XXX', 300)
+        subscriber.start()
+
+        candles = {}
+        while len(candles) < 2:
+            pair, period, candle, ticker = received.get(timeout=5)
+            assert period == 300 and 'USDT_BTC' in ticker
+            candles[pair] = candle
+
+        # Same closed candle a client would pull, reciprocal pairs included
+        for pair, candle in candles.items():
+            assert feed.returnChartData(pair, 300, candle['date'], candle['date'])[0] == candle
+            assert candle['date'] == math.floor(time() / 300) * 300 - 300
+    finally:
+        subscriber.stop()
+        daemon.terminate()
+        daemon.join()
+
+
+def test_broadcast_disabled(daemon):
+    with pytest.raises(DataFeedException, match='disabled'):
+        CandleSubscriber(DataFeed(exchange='sim', addr=daemon, timeout=5), print).subscribe('USDT_BTC', 300)
+
+
+def test_unsupported_version(daemon):
+    context = zmq.Context()
+    sock = context.socket(zmq.REQ)
+    sock.connect(daemon)
+    sock.send_multipart([PROTOCOL, msgpack.packb({'v': 99, 'exchange': 'sim', 'command': 'returnTicker'})])
+    assert sock.poll(5000)
+    assert 'Unsupported protocol version' in unpack_reply(sock.recv_multipart())
+    sock.close()
+
+
+# RECORD AND REPLAY TESTS
+def test_log_values():
+    df = pd.DataFrame({'close': [1.5, 2.5], 'pair': ['a', 'b']}, index=pd.Index([10, 20], name='date'))
+    multi = pd.DataFrame(np.eye(2), columns=pd.MultiIndex.from_tuples([('USDT_BTC', 'open'), ('USDT_BTC', 'close')]))
+    array = np.array([(1, 2.5)], dtype=[('date', np.int64), ('close', np.float64)])
+    value = {'amount': Decimal('0.12345678'), 'frame': df, 'multi': multi, 'array': array, 'n': np.int64(3),
+             'time': pd.Timestamp('2017-01-01 00:00', tz='utc')}
+
+    out = unpack_log(pack_log(value))
+    assert out['amount'] == value['amount'] and isinstance(out['amount'], Decimal)
+    assert out['frame'].equals(df) and out['frame'].index.name == 'date'
+    assert out['multi'].equals(multi)
+    assert out['array'].dtype == array.dtype and np.array_equal(out['array'], array)
+    assert out['n'] == 3 and out['time'] == value['time']
+
+
+def test_record_replay(tmpdir):
+    clock = Clock(1500000000.0)
+    sim = ExchangeSimulator(pairs=['USDT_BTC', 'USDT_ETH'], balance={'USDT': '1000'}, seed=0, clock=clock)
+    path = str(tmpdir.join('calls.log'))
+
+    recorder = RecordingFeed(sim, path, clock=clock)
+    charts = []
+    for _ in range(3):
+        charts.append(recorder.returnChartData('USDT_BTC', 300, clock() - 3000, clock()))
+        clock.t += 300
+    ticker = recorder.returnTicker()
+    rep = recorder.buy('USDT_BTC', ticker['USDT_BTC']['lowestAsk'], '0.01', 'immediateOrCancel')
+    with pytest.raises(ExchangeError, match='Not enough ETH.'):
+        recorder.sell('USDT_ETH', '1', '1', 'immediateOrCancel')
+    balances = recorder.returnBalances()
+    recorder.close()
+
+    feed = ReplayFeed(path)
+    assert feed.pairs == sim.pairs and feed.period == sim.period
+    assert feed.clock() == 1500000000.0
+
+    # Same calls, same replies, whatever the arguments
+    assert [feed.returnChartData('USDT_BTC', 300) for _ in range(3)] == charts
+    assert feed.clock() == 1500000600.0
+    assert feed.returnTicker() == ticker
+    assert feed.buy('USDT_BTC', '1', '1', 'immediateOrCancel') == rep
+    with pytest.raises(ExchangeError, match='Not enough ETH.'):
+        feed.sell('USDT_ETH', '1', '1', 'immediateOrCancel')
+    assert feed.returnBalances() == balances
+    assert feed.stats() == {'served': 7, 'reused': 0, 'remaining': 0}
+
+    # Reads past the log end serve the last reply. Trades and unknown calls fail.
+    assert feed.returnChartData('USDT_BTC', 300) == charts[-1]
+    assert feed.stats()['reused'] == 1
+    with pytest.raises(ReplayException):
+        feed.buy('USDT_BTC', '1', '1', 'immediateOrCancel')
+    with pytest.raises(ReplayException):
+        feed.returnChartData('USDT_ETH', 300)
+    with pytest.raises(AttributeError):
+        feed.returnTradeHistory
+
+
+def test_replay_multi_arg_error(tmpdir):
+    clock = Clock(1500000000.0)
+    sim = ExchangeSimulator(pairs=['USDT_BTC'], seed=0, clock=clock)
+    path = str(tmpdir.join('calls.log'))
+
+    recorder = RecordingFeed(sim, path, clock=clock)
+    error = UnicodeDecodeError('utf-8', b'\xff', 0, 1, 'invalid start byte')
+    with mock.patch.object(sim, 'returnTicker', side_effect=error):
+        with pytest.raises(UnicodeDecodeError):
+            recorder.returnTicker()
+    recorder.close()
+
+    # UnicodeDecodeError can't be built from the message, so it comes back as a DataFeedException
+    feed = ReplayFeed(path)
+    with pytest.raises(DataFeedException, match='invalid start byte'):
+        feed.returnTicker()
+
+
+def test_replay_speed(tmpdir):
+    clock = Clock(1500000000.0)
+    sim = ExchangeSimulator(pairs=['USDT_BTC'], seed=0, clock=clock)
+    path = str(tmpdir.join('calls.log'))
+
+    recorder = RecordingFeed(sim, path, clock=clock)
+    for _ in range(3):
+        recorder.returnTicker()
+        clock.t += 10
+    recorder.close()
+
+    # 20 recorded seconds at 100x
+    feed = ReplayFeed(path, speed=100)
+    t0 = time()
+    for _ in range(3):
+        feed.returnTicker()
+    assert 0.18 < time() - t0 < 1.0
+
+    # As fast as possible
+    feed = ReplayFeed(path)
+    t0 = time()
+    for _ in range(3):
+        feed.returnTicker()
+    assert time() - t0 < 0.1
+    assert feed.clock() == 1500000020.0
+
+
+def test_replay_scheduler(tmpdir):
+    clock = Clock(1500000000.0)
+    sim = ExchangeSimulator(pairs=['USDT_BTC'], seed=0, clock=clock)
+    path = str(tmpdir.join('calls.log'))
+
+    # Three bars of ticker polling
+    recorder = RecordingFeed(sim, path, clock=clock)
+    for _ in range(3):
+        clock.t += 300
+        recorder.returnTicker()
+    recorder.close()
+
+    feed = ReplayFeed(path, speed=1000)
+    env = mock.Mock(spec=['period', 'snapshot'])
+    env.period = 5
+    scheduler = feed.attach(env)
+    assert env.scheduler is scheduler and env.clock() == env.snapshot.clock() == 1500000000.0
+
+    # Jumps bar to bar on the replay clock, 900 recorded seconds in about a second
+    t0 = time()
+    bars = []
+    scheduler.start()
+    for trigger in iter(scheduler.wait, None):
+        bars.append(trigger[0])
+        assert feed.clock() == trigger[0] + 0.5
+    assert bars == [1500000300.0, 1500000600.0]
+    assert time() - t0 < 2.0
+
+
+if __name__ == '__main__':
+    pytest.main()
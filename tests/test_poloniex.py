@@ -1,5 +1,16 @@
 import cryptotrader.exchange_api.poloniex
 import unittest
+import gzip
+import json
+import asyncio
+import threading
+import pytest
+import mock
+import numpy as np
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from cryptotrader.exchange_api.poloniex import Poloniex, parseChartData, parseTicker
+from cryptotrader.exceptions import ExchangeError, MaxRetriesException, CircuitOpenException
 
 
 class TestPolo(unittest.TestCase):
@@ -38,5 +49,201 @@ class TestPolo(unittest.TestCase):
             self.polo.returnOrderBook(currencyPair='atestfoo')
 
 
+# Fixtures
+@pytest.fixture
+def server():
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        connections = set()
+        encodings = []
+        bodies = {}
+
+        def reply(self):
+            self.connections.add(self.client_address)
+            self.encodings.append(self.headers.get('Accept-Encoding'))
+            command = parse_qs(urlparse(self.path).query).get('command', [None])[0]
+            body = self.bodies.get(command) or json.dumps({'path': self.path, 'last': 1.5}).encode()
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                body = gzip.compress(body)
+                self.send_response(200)
+                self.send_header('Content-Encoding', 'gzip')
+            else:
+                self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            self.reply()
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            self.reply()
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd, Handler
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_polo(httpd, **kwargs):
+    polo = Poloniex(key='key', secret='secret', timeout=5, coach=False, **kwargs)
+    polo.coach = None
+    polo.publicUrl = 'http://127.0.0.1:%d/public' % httpd.server_port
+    polo.privateUrl = 'http://127.0.0.1:%d/tradingApi' % httpd.server_port
+    return polo
+
+
+# SESSION TESTS
+def test_keep_alive(server):
+    httpd, handler = server
+    polo = make_polo(httpd)
+    assert polo.returnTicker()['last'] == '1.5'
+    polo.returnBalances()
+    polo.marketTradeHist('USDT_BTC')
+
+    # One connection for all calls, gzip asked for
+    assert len(handler.connections) == 1
+    assert handler.encodings == ['gzip, deflate'] * 3
+
+    polo = make_polo(httpd, compress=False)
+    polo.returnTicker()
+    assert handler.encodings[-1] == 'identity'
+
+
+def test_async_calls(server):
+    httpd, handler = server
+    polo = make_polo(httpd, poolSize=4)
+
+    async def tickers():
+        return await asyncio.gather(*[polo.acall('returnTicker') for _ in range(8)])
+
+    loop = asyncio.new_event_loop()
+    assert all(rep['last'] == '1.5' for rep in loop.run_until_complete(tickers()))
+    loop.close()
+
+    # Pool bounds the connections opened
+    assert len(handler.connections) <= 4
+    polo.close()
+
+
+def test_retry_stats(server):
+    httpd, handler = server
+    polo = make_polo(httpd)
+    polo.coach = cryptotrader.exchange_api.poloniex.Coach()
+    polo.returnTicker()
+    polo.publicUrl = 'http://127.0.0.1:1/public'
+
+    with mock.patch.object(cryptotrader.exchange_api.poloniex, 'retryDelays', (0, 0)), \
+            pytest.raises(MaxRetriesException):
+        polo.returnTicker()
+
+    stats = polo.stats()
+    assert stats['retries'] == 2 and stats['failures'] == 1
+    assert stats['coach']['public']['calls'] == 4
+    polo.close()
+
+
+def test_circuit_breaker(server):
+    httpd, handler = server
+    polo = make_polo(httpd, breaker={'max_failures': 2, 'reset_timeout': 60})
+    polo.publicUrl = 'http://127.0.0.1:1/public'
+
+    # Stops retrying once the command is open, then fails fast
+    with mock.patch.object(cryptotrader.exchange_api.poloniex, 'retryDelays', (0, 0, 0)):
+        with pytest.raises(CircuitOpenException):
+            polo.returnTicker()
+        with mock.patch.object(polo.session, 'get') as get, pytest.raises(CircuitOpenException):
+            polo.returnTicker()
+        get.assert_not_called()
+
+    stats = polo.stats()
+    assert stats['retries'] == 1 and stats['failures'] == 1
+    assert stats['breaker']['returnTicker']['state'] == 'open'
+    assert stats['breaker']['returnTicker']['rejected'] == 1
+    polo.close()
+
+
+def test_circuit_breaker_per_pair(server):
+    httpd, handler = server
+    polo = make_polo(httpd, breaker={'max_failures': 2, 'reset_timeout': 60})
+    polo.publicUrl = 'http://127.0.0.1:1/public'
+    polo.privateUrl = 'http://127.0.0.1:1/tradingApi'
+
+    # Circuits are kept per pair, and trade commands always get the full retry
+    with mock.patch.object(cryptotrader.exchange_api.poloniex, 'retryDelays', (0, 0, 0)):
+        with pytest.raises(CircuitOpenException):
+            polo.marketTradeHist('USDT_BTC')
+        with pytest.raises(CircuitOpenException):
+            polo.returnChartData('USDT_BTC', 300)
+        with pytest.raises(MaxRetriesException) as error:
+            polo.buy('USDT_BTC', '1', '1')
+        assert not isinstance(error.value, CircuitOpenException)
+
+    stats = polo.stats()
+    assert stats['breaker']['marketTradeHist USDT_BTC']['state'] == 'open'
+    assert stats['breaker']['returnChartData USDT_BTC']['state'] == 'open'
+    assert 'buy USDT_BTC' not in stats['breaker'] and 'buy' not in stats['breaker']
+    polo.close()
+
+
+# PARSER TESTS
+chart = [{"date": 1500000000 + 300 * i, "high": "%.8f" % (2500.1 + i), "low": "%.8f" % (2400.5 - i),
+          "open": "2450.00000000", "close": "%.8f" % (2460.12345678 + i), "volume": "%.8f" % (10.5 * i),
+          "quoteVolume": "0.00412300", "weightedAverage": "2455.5"} for i in range(50)]
+ticker = {"USDT_BTC": {"id": 121, "last": "2500.12", "lowestAsk": "2501.00000000", "highestBid": "2499.5",
+                       "percentChange": "-0.0123", "baseVolume": "1000.1", "quoteVolume": "0.4",
+                       "isFrozen": "0", "high24hr": "2600.0", "low24hr": "2400.0"},
+          "BTC_ETH": {"id": 148, "last": "0.07", "lowestAsk": "0.0701", "highestBid": "0.0699",
+                      "percentChange": "0.01", "baseVolume": "12.3", "quoteVolume": "170.2",
+                      "isFrozen": "0", "high24hr": "0.071", "low24hr": "0.069"}}
+
+
+def test_parse_chart_data():
+    body = json.dumps(chart).encode()
+    out = parseChartData(body)
+    assert out.dtype.names == tuple(chart[0].keys())
+    assert out['date'].dtype == np.int64
+    for key in chart[0]:
+        assert np.allclose(out[key], [float(candle[key]) for candle in chart])
+
+    # Decoded lists give the same array
+    assert np.array_equal(parseChartData(json.loads(body.decode())), out)
+
+    with pytest.raises(ValueError):
+        parseChartData(b'{"error": "Invalid currency pair."}')
+
+
+def test_parse_ticker():
+    out = parseTicker(json.dumps(ticker).encode())
+    assert list(out['pair']) == list(ticker.keys())
+    assert list(out['id']) == [121, 148]
+    for key in ['last', 'lowestAsk', 'highestBid', 'percentChange', 'high24hr']:
+        assert np.allclose(out[key], [float(ticker[pair][key]) for pair in ticker])
+
+    assert np.array_equal(parseTicker(ticker), out)
+
+
+def test_array_calls(server):
+    httpd, handler = server
+    handler.bodies['returnChartData'] = json.dumps(chart).encode()
+    handler.bodies['returnTicker'] = json.dumps(ticker).encode()
+    polo = make_polo(httpd)
+
+    assert np.allclose(polo.returnChartArray('USDT_BTC', 300)['close'], [float(c['close']) for c in chart])
+    assert list(polo.returnTickerArray()['pair']) == ['USDT_BTC', 'BTC_ETH']
+
+    # Errors go through the json path
+    handler.bodies['returnChartData'] = b'{"error": "Invalid currency pair."}'
+    with pytest.raises(ExchangeError, match='Invalid currency pair.'):
+        polo.returnChartArray('USDT_BTC', 300)
+    polo.close()
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
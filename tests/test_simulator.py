@@ -0,0 +1,163 @@
+"""
+Test exchange simulator
+"""
+import os
+import pytest
+import numpy as np
+import pandas as pd
+from decimal import Decimal
+from time import time
+
+from cryptotrader.exchange_api.simulator import ExchangeSimulator
+from cryptotrader.datafeed import DataFeed
+from cryptotrader.exceptions import ExchangeError
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'notebooks', 'data', 'test')
+
+
+class Clock(object):
+    def __init__(self, t):
+        self.t = t
+
+    def __call__(self):
+        return self.t
+
+
+# Fixtures
+@pytest.fixture
+def sim():
+    yield ExchangeSimulator(pairs=['USDT_BTC', 'USDT_ETH'], balance={'USDT': '1000'}, liquidity=100.0, depth=3,
+                            seed=42, clock=Clock(1500000000.0))
+
+
+# MARKET DATA TESTS
+def test_chart_data(sim):
+    now = sim.clock()
+    data = sim.returnChartData('USDT_BTC', 300, now - 3000, now)
+    assert [candle['date'] for candle in data] == list(range(1499997000, 1500000001, 300))
+
+    # Last candle is still open
+    assert data[-1]['open'] == data[-1]['high'] == data[-1]['low'] == data[-1]['close']
+    assert all(Decimal(candle['low']) <= Decimal(candle['open']) <= Decimal(candle['high']) for candle in data)
+
+    # Aggregated periods
+    data_30 = sim.returnChartData('USDT_BTC', 1800, now - 7200, now)
+    assert all(candle['date'] % 1800 == 0 for candle in data_30)
+    with pytest.raises(ExchangeError):
+        sim.returnChartData('USDT_BTC', 400, now - 7200, now)
+    with pytest.raises(ExchangeError):
+        sim.returnChartData('BTC_USDT', 300, now - 7200, now)
+
+
+def test_replay():
+    df = pd.read_json(os.path.join(data_dir, 'USDT_BTC_30min'), convert_dates=False, orient='records',
+                      date_unit='s', keep_default_dates=False, dtype=False).iloc[:100]
+    sim = ExchangeSimulator(data={'USDT_BTC': df}, period=30, warmup=50, clock=Clock(1500000000.0))
+
+    data = sim.returnChartData('USDT_BTC', 1800)
+    assert len(data) == 51
+    assert np.allclose([float(candle['close']) for candle in data[:-1]], df.close.astype(float).values[:50])
+    assert float(sim.returnTicker()['USDT_BTC']['last']) == pytest.approx(float(df.open.iat[50]))
+
+    # Next bar
+    sim.clock.t += 1800
+    assert float(sim.returnTicker()['USDT_BTC']['last']) == pytest.approx(float(df.open.iat[51]))
+
+
+def test_synthetic_prices_continue(sim):
+    last = sim.returnChartData('USDT_BTC', 300)[-1]
+    sim.clock.t += 3000
+    data = sim.returnChartData('USDT_BTC', 300, last['date'])
+    assert len(data) == 11
+    assert data[1]['open'] == sim.returnChartData('USDT_BTC', 300, last['date'], last['date'])[0]['close']
+
+
+# ORDER TESTS
+def test_immediate_or_cancel(sim):
+    ask = Decimal(sim.returnTicker()['USDT_BTC']['lowestAsk'])
+    book = sim.get_book('USDT_BTC')
+    prices = [price for price, _ in book['asks']]
+    level = book['asks'][0][1]
+
+    # Walks the book up to rate, rest is canceled
+    rep = sim.buy('USDT_BTC', str(prices[1]), str(3 * level), 'immediateOrCancel')
+    assert [Decimal(trade['rate']) for trade in rep['resultingTrades']] == [ask, prices[1]]
+    assert Decimal(rep['amountUnfilled']) == level
+    assert [price for price, _ in book['asks']] == prices[2:]
+
+    balance = sim.returnBalances()
+    assert Decimal(balance['BTC']) == 2 * (level * Decimal('0.9975')).quantize(Decimal('1E-8'))
+    assert Decimal(balance['USDT']) == Decimal('1000') - sum(Decimal(trade['total'])
+                                                            for trade in rep['resultingTrades'])
+
+    # Best ask moved
+    assert Decimal(sim.returnTicker()['USDT_BTC']['lowestAsk']) > ask
+
+
+def test_order_errors(sim):
+    with pytest.raises(ExchangeError, match='Not enough USDT.'):
+        sim.buy('USDT_BTC', '1000', '2', 'immediateOrCancel')
+    with pytest.raises(ExchangeError, match='Not enough ETH.'):
+        sim.sell('USDT_ETH', '1', '1', 'immediateOrCancel')
+    with pytest.raises(ExchangeError, match='Total must be at least'):
+        sim.buy('USDT_BTC', '1', '0.00001', 'immediateOrCancel')
+    with pytest.raises(ExchangeError, match='Invalid currency pair.'):
+        sim.buy('BTC_USDT', '1', '1', 'immediateOrCancel')
+
+    # Fill or kill does not touch the book
+    with pytest.raises(ExchangeError, match='Unable to fill order completely.'):
+        sim.buy('USDT_BTC', '200', '5', 'fillOrKill')
+    assert len(sim.get_book('USDT_BTC')['asks']) == 3
+    assert sim.returnBalances()['USDT'] == '1000.00000000'
+
+
+def test_resting_order(sim):
+    bid = Decimal(sim.returnTicker()['USDT_BTC']['highestBid'])
+    rep = sim.buy('USDT_BTC', str(bid), '0.1')
+    assert not rep['resultingTrades'] and len(sim.open_orders) == 1
+
+    # Fills as maker once the book crosses it
+    while not sim.funds['BTC']:
+        sim.clock.t += 300
+        sim.returnTicker()
+    assert sim.funds['BTC'] == Decimal('0.1') * (1 - sim.maker_fee)
+    assert not sim.open_orders
+
+
+# FAULT INJECTION TESTS
+def test_fault_injection(sim):
+    sim.latency = 0.05
+    t0 = time()
+    sim.returnBalances()
+    assert time() - t0 >= 0.05
+
+    sim.latency = 0.0
+    sim.error_rate = 1.0
+    with pytest.raises(ExchangeError, match='Please try again.'):
+        sim.returnTicker()
+    assert sim.calls == {'returnBalances': 1, 'returnTicker': 1}
+
+
+# DAEMON TESTS
+def test_serve(tmpdir):
+    sim = ExchangeSimulator(pairs=['USDT_BTC'], balance={'BTC': '1'}, seed=0)
+    addr = 'ipc://' + str(tmpdir.join('sim.ipc'))
+    daemon = sim.serve(addr, exchange='sim', n_workers=2)
+    try:
+        feed = DataFeed(exchange='sim', addr=addr, timeout=5)
+        assert feed.returnBalances() == {'BTC': '1.00000000', 'USDT': '0.00000000'}
+        assert feed.returnFeeInfo()['takerFee'] == '0.00250000'
+
+        rep = feed.sell('USDT_BTC', '1', '0.5', 'immediateOrCancel')
+        assert rep['amountUnfilled'] == '0.00000000'
+        assert feed.returnBalances()['BTC'] == '0.50000000'
+
+        # Exchange errors come back as strings
+        assert feed.sell('USDT_BTC', '1', '5', 'immediateOrCancel') == 'Not enough BTC.'
+    finally:
+        daemon.terminate()
+        daemon.join()
+
+
+if __name__ == '__main__':
+    pytest.main()
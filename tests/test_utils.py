@@ -10,7 +10,13 @@ from hypothesis.extra.numpy import arrays, array_shapes
 from math import nan
 import numpy as np
 
-from cryptotrader.utils import convert_to, array_normalize, array_softmax
+from cryptotrader.utils import convert_to, array_normalize, array_softmax, BarScheduler, LatencyHistogram, Timings, \
+    CircuitBreaker, hedged
+from cryptotrader.exceptions import CircuitOpenException
+from concurrent.futures import ThreadPoolExecutor
+from time import time, sleep
+import json
+import threading
 from decimal import Decimal, InvalidOperation, Overflow
 
 @given(st.one_of(st.floats(allow_nan=False, allow_infinity=False), st.integers()))
@@ -39,5 +45,130 @@ def test_array_softmax(data):
     array_softmax(data)
 
 
+# BAR SCHEDULER TESTS
+def test_bar_scheduler_fires_at_bar_open():
+    # Clock starts just before a bar boundary, and moves only while the scheduler sleeps
+    boundary = 60 * 1000
+    clock = mock.Mock(return_value=boundary - 0.1)
+    scheduler = BarScheduler(period=1, offset=0.05, clock=clock)
+    scheduler.event = mock.Mock()
+    scheduler.event.wait.side_effect = lambda timeout: setattr(clock, 'return_value', clock.return_value + timeout)
+    scheduler.start()
+
+    bar, lag = scheduler.wait()
+    assert bar == boundary
+    assert lag == pytest.approx(0.05)
+    assert scheduler.event.wait.call_args[0][0] == pytest.approx(0.15)
+
+    # One trigger per bar
+    scheduler.offset = 0.0
+    assert scheduler.wait() == (boundary + 60, 0.0)
+    assert clock() == boundary + 60
+
+
+def test_bar_scheduler_notify():
+    # New candle arrives on the feed before the local clock reaches the boundary
+    boundary = 60 * 1000
+    scheduler = BarScheduler(period=1, offset=1.0, clock=lambda: boundary - 5.0)
+    scheduler.start()
+
+    threading.Timer(0.05, scheduler.notify, args=(boundary,)).start()
+    t0 = time()
+    assert scheduler.wait() == (boundary, -5.0)
+    assert time() - t0 < 1.0
+
+    # Stale notifications do not trigger again
+    scheduler.notify(boundary)
+    threading.Timer(0.1, scheduler.stop).start()
+    assert scheduler.wait() is None
+
+
+# RETRY PATH TESTS
+def test_circuit_breaker():
+    clock = mock.Mock(return_value=1000.0)
+    breaker = CircuitBreaker(max_failures=3, reset_timeout=30.0, clock=clock)
+
+    # Successes reset the failure count
+    assert not breaker.failure('returnTicker') and not breaker.failure('returnTicker')
+    breaker.success('returnTicker')
+    assert [breaker.failure('returnTicker', 'timed out') for _ in range(3)] == [False, False, True]
+    assert breaker.state('returnTicker') == 'open' and breaker.state('returnChartData') == 'closed'
+    with pytest.raises(CircuitOpenException, match='timed out'):
+        breaker.check('returnTicker')
+    breaker.check('returnChartData')
+
+    # One trial call per reset timeout
+    clock.return_value += 30.0
+    assert breaker.state('returnTicker') == 'half_open'
+    assert breaker.allow('returnTicker') and not breaker.allow('returnTicker')
+    assert breaker.failure('returnTicker')
+    clock.return_value += 30.0
+    assert breaker.allow('returnTicker')
+    breaker.success('returnTicker')
+    assert breaker.state('returnTicker') == 'closed'
+
+    stats = breaker.stats()['returnTicker']
+    assert stats['trips'] == 1 and stats['rejected'] == 2 and stats['failures'] == 0
+
+
+def test_hedged():
+    executor = ThreadPoolExecutor(4)
+    delays = iter([1.0, 0.0, 0.0])
+
+    def call():
+        delay = next(delays)
+        sleep(delay)
+        return delay
+
+    # Slow call is hedged and the hedge wins
+    t0 = time()
+    assert hedged(executor, call, 0.05) == (0.0, 1, 2)
+    assert time() - t0 < 0.5
+
+    # Fast calls are not hedged
+    assert hedged(executor, call, 0.05) == (0.0, 0, 1)
+
+    # Errors are raised when no call is left
+    with pytest.raises(ValueError):
+        hedged(executor, mock.Mock(side_effect=ValueError), 0.05)
+    executor.shutdown(wait=False)
+
+
+# LATENCY HISTOGRAM TESTS
+@given(arrays(dtype=np.float64, shape=st.integers(1, 300),
+              elements=st.floats(min_value=1e-2, max_value=1e5, allow_nan=False, allow_infinity=False)))
+def test_latency_histogram(data):
+    hist = LatencyHistogram(window=200, precision=0.01)
+    for value in data:
+        hist.record(value)
+
+    # Only the rolling window is counted
+    window = data[-200:]
+    assert len(hist) == window.shape[0]
+    assert hist.total == data.shape[0]
+    assert sum(hist.counts.values()) == window.shape[0]
+
+    for q in [0, 50, 99, 100]:
+        exact = np.sort(window)[max(1, int(np.ceil(q / 100 * window.shape[0]))) - 1]
+        assert exact <= hist.percentile(q) <= exact * 1.0101
+
+
+def test_timings_json(tmpdir):
+    timings = Timings()
+    with timings.measure('observe'):
+        sleep(0.01)
+    timings.record('decide', 0.002)
+
+    summary = timings.summary()
+    assert list(summary) == ['observe', 'decide']
+    assert 10 <= summary['observe']['p50'] < 50
+    assert np.isclose(summary['decide']['p99'], 2.0, rtol=0.01)
+
+    path = str(tmpdir.join('timings.json'))
+    data = json.loads(timings.to_json(path))
+    assert data == json.load(open(path))
+    assert data['decide']['count'] == 1 and data['decide']['buckets'][0][1] == 1
+
+
 if __name__ == '__main__':
     pytest.main()
\ No newline at end of file